@@ -0,0 +1,21 @@
+"""
+Heart Disease Analytics Module
+
+This module contains offline jobs that score the reference population once
+and persist compact summaries next to the model host.
+
+Available functions:
+- build_cube(): Aggregate population risk over age, sex and general health
+- query_cube(): Slice a pre-aggregated cube
+- CohortIndex: Nearest-neighbour search for similar reference patients
+- RiskPercentiles: Rank a prediction against the population and its stratum
+- audit(): Cached subgroup performance and fairness report by Sex and Age_Category
+"""
+
+from .population_cube import build_cube, load_cube, query_cube
+from .cohort_index import CohortIndex
+from .risk_percentile import RiskPercentiles
+from .fairness_audit import audit
+
+__all__ = ['build_cube', 'load_cube', 'query_cube', 'CohortIndex', 'RiskPercentiles', 'audit']
+__version__ = '1.0.0'
@@ -0,0 +1,276 @@
+"""
+Subgroup performance and fairness audit.
+
+The audit population (the host's reference population, or a labelled CSV)
+is scored once. Every patient then belongs to four groups: everyone, their
+Sex, their Age_Category and their Sex x Age_Category pair. The row indices
+are expanded into one (group, score) array and sorted once, and all metrics
+for all groups come out of the same pass with np.bincount:
+
+    AUC                 Mann-Whitney rank sums within each group (ties averaged)
+    calibration         mean predicted probability vs observed rate, Brier score
+                        and expected calibration error (10 equal-width bins)
+    error rates         TPR, FPR, FNR, PPV and flag rate at the model's
+                        decision threshold
+
+The report also lists, per grouping, the largest gap between groups for
+each metric. Reports are cached as JSON keyed on the model checksum
+(booster, decision threshold and calibration) and the data checksum, so
+they are only recomputed when either changes.
+
+    python Analytics/fairness_audit.py
+    python Analytics/fairness_audit.py --dataset holdout.csv --min-size 50
+"""
+
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'Serving'))
+sys.path.append(os.path.join(ROOT, 'Data preprocess'))
+
+from model_host import HOST_DIR, REFERENCE_X_FILE, REFERENCE_Y_FILE, attach_host
+from inference import load_reference_scores, score_batch
+
+
+REPORT_DIR = os.environ.get("HEART_FAIRNESS_DIR", os.path.join("cache", "fairness"))
+GROUPINGS = ['Sex', 'Age_Category']
+N_BINS = 10
+MIN_GROUP_SIZE = 30
+GAP_METRICS = ['auc', 'tpr', 'fpr', 'ppv', 'calibration_ratio', 'ece']
+
+
+def _file_digest(paths):
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def model_checksum(host, calibrator=None):
+    """
+    Everything about the model that changes the report.
+    """
+    digest = hashlib.sha256(f"{host.version}|{host.threshold!r}".encode("utf-8"))
+    if calibrator is not None:
+        digest.update(np.ascontiguousarray(calibrator.knots).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def _group_ids(X, schema, groupings):
+    """
+    (group id per row for each of the 1 + len(groupings) + 1 groupings,
+    group labels). Group 0 is everyone, then each grouping's levels, then
+    every combination of the groupings' levels.
+    """
+    codes = [np.asarray(X[:, schema.columns.index(col)], dtype=np.int64) for col in groupings]
+    shape = [len(schema.categories[col]) for col in groupings]
+    ids, labels, offset = [np.zeros(len(X), dtype=np.int64)], [("All", "All")], 1
+    for col, code, size in zip(groupings, codes, shape):
+        ids.append(offset + code)
+        labels += [(col, level) for level in schema.categories[col]]
+        offset += size
+    ids.append(offset + np.ravel_multi_index(codes, shape))
+    labels += [(" × ".join(groupings), " / ".join(schema.categories[col][c] for col, c in zip(groupings, cell)))
+               for cell in np.ndindex(*shape)]
+    return ids, labels
+
+
+def grouped_metrics(scores, probabilities, y, group_ids, n_groups, threshold, n_bins=N_BINS):
+    """
+    Per-group metrics from one sort of the expanded (group, score) rows.
+    group_ids is a list of per-row id arrays, one per grouping.
+    """
+    n = len(scores)
+    groups = np.concatenate(group_ids)
+    rows = np.tile(np.arange(n), len(group_ids))
+    s, p, t = scores[rows], probabilities[rows], y[rows].astype(np.float64)
+
+    def per_group(weights=None):
+        return np.bincount(groups, weights=weights, minlength=n_groups).astype(np.float64)
+
+    count = per_group()
+    positives = per_group(t)
+    negatives = count - positives
+    flagged = s > threshold
+    true_pos = per_group(flagged & (t == 1))
+    false_pos = per_group(flagged & (t == 0))
+
+    # Average ranks within each group: sort by (group, score); tied runs share their mean rank
+    order = np.lexsort((s, groups))
+    g_sorted, s_sorted = groups[order], s[order]
+    group_start = np.searchsorted(g_sorted, np.arange(n_groups))
+    new_run = np.r_[True, (g_sorted[1:] != g_sorted[:-1]) | (s_sorted[1:] != s_sorted[:-1])]
+    run_id = np.cumsum(new_run) - 1
+    run_first = np.flatnonzero(new_run)
+    run_last = np.r_[run_first[1:], len(order)] - 1
+    position = np.arange(len(order)) - group_start[g_sorted] + 1
+    run_rank = (position[run_first] + position[run_last]) / 2
+    ranks = np.empty(len(order))
+    ranks[order] = run_rank[run_id]
+    rank_sum = per_group(ranks * t)
+
+    bins = np.minimum((p * n_bins).astype(np.int64), n_bins - 1)
+    cell = groups * n_bins + bins
+    bin_pred = np.bincount(cell, weights=p, minlength=n_groups * n_bins).reshape(n_groups, n_bins)
+    bin_obs = np.bincount(cell, weights=t, minlength=n_groups * n_bins).reshape(n_groups, n_bins)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_predicted = per_group(p) / count
+        observed_rate = positives / count
+        return {
+            "count": count.astype(np.int64),
+            "positives": positives.astype(np.int64),
+            "auc": (rank_sum - positives * (positives + 1) / 2) / (positives * negatives),
+            "mean_predicted": mean_predicted,
+            "observed_rate": observed_rate,
+            "calibration_ratio": mean_predicted / observed_rate,
+            "brier": per_group((p - t) ** 2) / count,
+            "ece": np.abs(bin_pred - bin_obs).sum(axis=1) / count,
+            "tpr": true_pos / positives,
+            "fpr": false_pos / negatives,
+            "fnr": 1.0 - true_pos / positives,
+            "ppv": true_pos / (true_pos + false_pos),
+            "flag_rate": (true_pos + false_pos) / count,
+        }
+
+
+def _json_value(value):
+    value = float(value)
+    return None if np.isnan(value) or np.isinf(value) else round(value, 6)
+
+
+def build_report(host, scores, y, X, groupings=GROUPINGS, calibrator=None, min_size=MIN_GROUP_SIZE):
+    """
+    Audit report for scored rows (X encoded with the host's schema).
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    probabilities = calibrator.transform(scores) if calibrator is not None else scores
+    group_ids, labels = _group_ids(np.asarray(X), host.schema, groupings)
+    metrics = grouped_metrics(scores, probabilities, y, group_ids, len(labels), host.threshold)
+
+    groups = []
+    for i, (grouping, level) in enumerate(labels):
+        entry = {"grouping": grouping, "group": level, "reliable": bool(metrics["count"][i] >= min_size)}
+        entry.update({name: (int(values[i]) if values.dtype.kind == 'i' else _json_value(values[i]))
+                      for name, values in metrics.items()})
+        groups.append(entry)
+
+    gaps = {}
+    for grouping in dict.fromkeys(g["grouping"] for g in groups[1:]):
+        members = [g for g in groups if g["grouping"] == grouping and g["reliable"]]
+        gaps[grouping] = {}
+        for name in GAP_METRICS:
+            values = [(g[name], g["group"]) for g in members if g[name] is not None]
+            if len(values) >= 2:
+                (low, low_group), (high, high_group) = min(values), max(values)
+                gaps[grouping][name] = {"gap": round(high - low, 6), "min": low_group, "max": high_group}
+    return {"threshold": host.threshold, "calibrated": calibrator is not None, "min_size": min_size,
+            "groups": groups, "gaps": gaps}
+
+
+def audit(host, dataset=None, groupings=GROUPINGS, min_size=MIN_GROUP_SIZE, directory=REPORT_DIR, force=False,
+          compute=True):
+    """
+    Cached audit report for the host's model on the reference population
+    or a labelled CSV. Recomputed only when the model or data checksum
+    (or the audit settings) change; with compute=False a missing report
+    is not computed and None is returned instead.
+    """
+    try:
+        from calibration import Calibrator
+        calibrator = Calibrator.load(host)
+    except ImportError:
+        calibrator = None
+
+    if dataset is None:
+        data_checksum = _file_digest([os.path.join(host.host_dir, f) for f in (REFERENCE_X_FILE, REFERENCE_Y_FILE)])
+    else:
+        data_checksum = _file_digest([dataset])
+    settings = hashlib.sha256(json.dumps([groupings, min_size]).encode("utf-8")).hexdigest()[:8]
+    key = f"{model_checksum(host, calibrator)}-{data_checksum}-{settings}"
+    path = os.path.join(directory, f"fairness-{key}.json")
+    if not force and os.path.exists(path):
+        with open(path) as f:
+            report = json.load(f)
+        report["cached"] = True
+        return report
+    if not compute:
+        return None
+
+    started = time.perf_counter()
+    if dataset is None:
+        X = host.reference_X
+        scores = load_reference_scores(host)
+        y = host.reference_y
+    else:
+        import pandas as pd
+
+        from feature_schema import TARGET_COLUMN
+        from patient_record import records_from_frame, records_to_matrix
+        from validation import RecordValidator
+
+        df = pd.read_csv(dataset)
+        records = records_from_frame(df, host.schema)
+        scores, _ = score_batch(host, host.schema, records, validator=RecordValidator(host.schema))
+        valid = ~np.isnan(scores)
+        X = records_to_matrix(records[valid], host.schema)
+        scores, y = scores[valid], (df[TARGET_COLUMN] == "Yes").to_numpy()[valid]
+
+    report = build_report(host, scores, y, X, groupings, calibrator, min_size)
+    report.update({
+        "model_version": host.version,
+        "model_checksum": model_checksum(host, calibrator),
+        "data": dataset or "reference",
+        "data_checksum": data_checksum,
+        "rows": int(len(scores)),
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    })
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump(report, f, indent=2)
+    os.replace(tmp_path, path)
+    report["cached"] = False
+    return report
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Audit model performance across Sex and Age_Category strata.")
+    parser.add_argument("--host-dir", default=HOST_DIR)
+    parser.add_argument("--dataset", help="labelled CSV to audit on (default: reference population)")
+    parser.add_argument("--min-size", type=int, default=MIN_GROUP_SIZE, help="smallest group counted in the gaps")
+    parser.add_argument("--force", action="store_true", help="recompute even if a cached report exists")
+    args = parser.parse_args()
+
+    host = attach_host(args.host_dir)
+    report = audit(host, args.dataset, min_size=args.min_size, force=args.force)
+
+    def fmt(value, spec=".3f"):
+        return "—" if value is None else format(value, spec)
+
+    print(f"{'grouping':<24}{'group':<22}{'n':>8}{'AUC':>7}{'TPR':>7}{'FPR':>7}{'PPV':>7}{'pred':>7}{'obs':>7}{'ECE':>7}")
+    for g in report["groups"]:
+        flag = "" if g["reliable"] else "  (small)"
+        print(f"{g['grouping']:<24}{g['group']:<22}{g['count']:>8,}{fmt(g['auc']):>7}{fmt(g['tpr']):>7}{fmt(g['fpr']):>7}"
+              f"{fmt(g['ppv']):>7}{fmt(g['mean_predicted']):>7}{fmt(g['observed_rate']):>7}{fmt(g['ece']):>7}{flag}")
+    print("\nLargest gaps between groups:")
+    for grouping, gaps in report["gaps"].items():
+        print(f"  {grouping}: " + ", ".join(f"{name} {gap['gap']:.3f} ({gap['min']} vs {gap['max']})" for name, gap in gaps.items()))
+    source = f"cached report from {report['created']}" if report["cached"] else f"computed in {report['elapsed_ms']:.0f} ms"
+    print(f"\n✅ {report['rows']:,} patients, model {report['model_version']}: {source}")
+
+
+if __name__ == "__main__":
+    main()
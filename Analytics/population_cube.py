@@ -0,0 +1,126 @@
+"""
+Pre-aggregated population risk cube.
+
+Offline job: score the whole BRFSS reference population once and aggregate
+the scores over every combination of the cube dimensions (each dimension
+either fixed to a value or rolled up to ALL). The result is a few hundred
+rows, so the dashboard answers any slice with a boolean mask over a tiny
+table instead of rescoring 300k patients per page view.
+
+    python Analytics/population_cube.py
+"""
+
+import itertools
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'Serving'))
+sys.path.append(os.path.join(ROOT, 'Data preprocess'))
+
+from model_host import HOST_DIR, attach_host
+from inference import load_reference_scores
+
+
+CUBE_FILE = "population_cube.parquet"
+DIMENSIONS = ['Age_Category', 'Sex', 'General_Health']
+QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+ALL = 'All'
+
+
+def build_cube(host, dimensions=DIMENSIONS, quantiles=QUANTILES):
+    """
+    Aggregate reference scores over all grouping sets of the dimensions.
+    Returns a DataFrame with one row per cell.
+    """
+    scores = np.asarray(load_reference_scores(host), dtype=np.float64)
+    X = host.reference_X
+    frame = pd.DataFrame({
+        dim: pd.Categorical.from_codes(
+            np.asarray(X[:, host.schema.columns.index(dim)], dtype=np.int64),
+            categories=host.schema.categories[dim],
+        )
+        for dim in dimensions
+    })
+    frame['risk'] = scores
+    frame['heart_disease'] = np.asarray(host.reference_y, dtype=np.float64)
+
+    cells = []
+    for r in range(len(dimensions) + 1):
+        for group in itertools.combinations(dimensions, r):
+            if group:
+                grouped = frame.groupby(list(group), observed=True)
+            else:
+                grouped = frame.groupby(np.zeros(len(frame), dtype=np.int8))
+            agg = grouped.agg(
+                count=('risk', 'size'),
+                mean_risk=('risk', 'mean'),
+                observed_rate=('heart_disease', 'mean'),
+            )
+            q = grouped['risk'].quantile(quantiles).unstack()
+            q.columns = [f"p{int(round(p * 100))}" for p in quantiles]
+            agg = agg.join(q).reset_index()
+            for dim in dimensions:
+                if dim not in group:
+                    agg[dim] = ALL
+            cells.append(agg[dimensions + ['count', 'mean_risk', 'observed_rate'] + list(q.columns)])
+
+    cube = pd.concat(cells, ignore_index=True)
+    for dim in dimensions:
+        cube[dim] = cube[dim].astype(str)
+    cube['count'] = cube['count'].astype(np.int64)
+    return cube
+
+
+def query_cube(cube, **selection):
+    """
+    Cells matching a selection, e.g. query_cube(cube, Sex='Female').
+    Dimensions not mentioned are rolled up to ALL; pass a dimension as
+    '*' to get one row per value instead.
+    """
+    mask = np.ones(len(cube), dtype=bool)
+    for dim in DIMENSIONS:
+        value = selection.get(dim, ALL)
+        if value == '*':
+            mask &= (cube[dim] != ALL).to_numpy()
+        else:
+            mask &= (cube[dim] == value).to_numpy()
+    return cube[mask]
+
+
+def save_cube(cube, host, path=None):
+    path = path or os.path.join(host.host_dir, CUBE_FILE)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    cube.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_cube(host_dir=HOST_DIR):
+    """
+    Load a previously built cube, or None if the offline job has not run.
+    """
+    path = os.path.join(host_dir, CUBE_FILE)
+    if not os.path.exists(path):
+        return None
+    return pd.read_parquet(path)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Score the reference population and build the risk cube.")
+    parser.add_argument("--host-dir", default=HOST_DIR)
+    args = parser.parse_args()
+
+    host = attach_host(args.host_dir)
+    cube = build_cube(host)
+    path = save_cube(cube, host)
+    print(f"✅ Population cube with {len(cube)} cells written to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Population risk percentiles.
+
+The reference population is scored once and reduced to a compact table of
+sorted score quantiles: one row for everyone and one per Age_Category x Sex
+stratum (1001 quantiles each, 0.1 percentile resolution). The table is stored
+next to the model host and memory-mapped, so placing a new prediction is a
+binary search per row with no rescoring at request time.
+
+    python Analytics/risk_percentile.py
+"""
+
+import json
+import os
+import sys
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'Serving'))
+sys.path.append(os.path.join(ROOT, 'Data preprocess'))
+
+from model_host import HOST_DIR, attach_host
+from inference import load_reference_scores
+
+
+QUANTILES_FILE = "risk_quantiles.npy"
+STRATA_FILE = "risk_strata.json"
+STRATA = ['Age_Category', 'Sex']
+N_QUANTILES = 1001
+
+
+class RiskPercentiles:
+    """
+    Sorted score quantiles, overall (row 0) and per stratum.
+    """
+
+    def __init__(self, quantiles, labels, strata, sizes):
+        self.quantiles = quantiles
+        self.labels = labels
+        self.strata = strata
+        self.sizes = sizes
+
+    @classmethod
+    def build(cls, host, strata=STRATA, n_quantiles=N_QUANTILES):
+        scores = np.asarray(load_reference_scores(host), dtype=np.float64)
+        X = host.reference_X
+        schema = host.schema
+        levels = np.linspace(0, 1, n_quantiles)
+
+        stratum_codes = [np.asarray(X[:, schema.columns.index(col)], dtype=np.int64) for col in strata]
+        shape = [len(schema.categories[col]) for col in strata]
+        flat = np.ravel_multi_index(stratum_codes, shape)
+
+        rows = [np.quantile(scores, levels)]
+        labels = ["All"]
+        sizes = [len(scores)]
+        order = np.argsort(flat, kind='stable')
+        bounds = np.searchsorted(flat[order], np.arange(int(np.prod(shape)) + 1))
+        for cell in range(int(np.prod(shape))):
+            members = scores[order[bounds[cell]:bounds[cell + 1]]]
+            # Empty strata fall back to the overall distribution
+            rows.append(np.quantile(members, levels) if len(members) else rows[0])
+            labels.append(" / ".join(
+                schema.categories[col][code] for col, code in zip(strata, np.unravel_index(cell, shape))
+            ))
+            sizes.append(len(members))
+
+        quantiles = np.vstack(rows).astype(np.float32)
+        path = os.path.join(host.host_dir, QUANTILES_FILE)
+        tmp_path = f"{path}.tmp-{os.getpid()}.npy"
+        np.save(tmp_path, quantiles)
+        os.replace(tmp_path, path)
+        # strata file goes last: its presence marks the table as complete
+        strata_path = os.path.join(host.host_dir, STRATA_FILE)
+        with open(f"{strata_path}.tmp-{os.getpid()}", "w") as f:
+            json.dump({"strata": strata, "labels": labels, "sizes": sizes}, f)
+        os.replace(f"{strata_path}.tmp-{os.getpid()}", strata_path)
+        return cls(quantiles, labels, strata, sizes)
+
+    @classmethod
+    def load(cls, host):
+        """
+        Memory-map the table from the host directory, or None if it has not
+        been built (build_host and main() build it).
+        """
+        strata_path = os.path.join(host.host_dir, STRATA_FILE)
+        if not os.path.exists(strata_path):
+            return None
+        with open(strata_path) as f:
+            meta = json.load(f)
+        quantiles = np.load(os.path.join(host.host_dir, QUANTILES_FILE), mmap_mode='r')
+        return cls(quantiles, meta["labels"], meta["strata"], meta["sizes"])
+
+    def stratum_rows(self, records, schema):
+        """
+        Row of the quantile table for each record's stratum.
+        """
+        codes = [records[col].astype(np.int64) for col in self.strata]
+        shape = [len(schema.categories[col]) for col in self.strata]
+        known = np.all([c < size for c, size in zip(codes, shape)], axis=0)
+        codes = [np.where(known, c, 0) for c in codes]
+        # Records with a missing/unknown stratum value are ranked overall
+        return np.where(known, np.ravel_multi_index(codes, shape) + 1, 0)
+
+    def percentile(self, scores, rows=None):
+        """
+        Percentile (0-100) of each score within its row of the table
+        (row 0, the whole population, by default).
+        """
+        scores = np.atleast_1d(np.asarray(scores, dtype=np.float32))
+        rows = np.zeros(len(scores), dtype=np.int64) if rows is None else np.atleast_1d(rows)
+        n = self.quantiles.shape[1]
+        result = np.empty(len(scores), dtype=np.float64)
+        for i, (score, row) in enumerate(zip(scores, rows)):
+            result[i] = np.searchsorted(self.quantiles[row], score, side='right') / n * 100
+        return result
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the population risk percentile table.")
+    parser.add_argument("--host-dir", default=HOST_DIR)
+    args = parser.parse_args()
+
+    host = attach_host(args.host_dir)
+    table = RiskPercentiles.build(host)
+    print(f"✅ Risk percentiles for {len(table.labels)} strata written to {args.host_dir}")
+
+
+if __name__ == "__main__":
+    main()
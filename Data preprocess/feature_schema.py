@@ -0,0 +1,79 @@
+import pandas as pd
+
+
+TARGET_COLUMN = 'Heart_Disease'
+
+
+class FeatureSchema:
+    """
+    Everything the model needs to know about the training feature frame,
+    derived once from the BRFSS dataset:
+    - Exact feature order the model was trained on
+    - Category vocabularies (sorted, so codes match sklearn's LabelEncoder)
+    - Fill values for missing columns (mode for categoricals, median for numerics)
+    - Observed [min, max] of each numeric column (validation derives its
+      plausibility limits from them)
+    """
+
+    def __init__(self, columns, categories, fill_values, numeric_ranges=None):
+        self.columns = list(columns)
+        self.categories = {col: list(vocab) for col, vocab in categories.items()}
+        self.fill_values = dict(fill_values)
+        self.numeric_ranges = {col: tuple(bounds) for col, bounds in (numeric_ranges or {}).items()}
+        self.categorical_columns = [c for c in self.columns if c in self.categories]
+        self.numeric_columns = [c for c in self.columns if c not in self.categories]
+        # Lookup tables built once so encoding a record is a dict hit per column
+        self._code_maps = {
+            col: {value: code for code, value in enumerate(vocab)}
+            for col, vocab in self.categories.items()
+        }
+
+    @classmethod
+    def from_dataframe(cls, df, target=TARGET_COLUMN):
+        """
+        Build the schema from the training dataset (same rules as the
+        original LabelEncoder-based preprocessing).
+        """
+        X = df.drop(columns=[target]) if target in df.columns else df
+        cat_cols = X.select_dtypes(include=["object", "string", "category"]).columns.tolist()
+
+        categories = {}
+        fill_values = {}
+        numeric_ranges = {}
+        for col in X.columns:
+            if col in cat_cols:
+                values = X[col].astype(str)
+                vocab = sorted(values.unique().tolist())
+                categories[col] = vocab
+                mode_val = values.mode(dropna=True)
+                fill_values[col] = vocab.index(mode_val.iloc[0]) if not mode_val.empty else 0
+            else:
+                values = pd.to_numeric(X[col], errors="coerce")
+                fill_values[col] = float(values.median())
+                if values.notna().any():
+                    numeric_ranges[col] = (float(values.min()), float(values.max()))
+
+        return cls(X.columns, categories, fill_values, numeric_ranges)
+
+    def to_dict(self):
+        return {
+            "columns": self.columns,
+            "categories": self.categories,
+            "fill_values": self.fill_values,
+            "numeric_ranges": {col: list(bounds) for col, bounds in self.numeric_ranges.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        # Manifests written before numeric ranges were recorded have none
+        return cls(data["columns"], data["categories"], data["fill_values"], data.get("numeric_ranges"))
+
+    @property
+    def n_features(self):
+        return len(self.columns)
+
+    def code_map(self, col):
+        """
+        Mapping of category string -> integer code for one column.
+        """
+        return self._code_maps[col]
@@ -0,0 +1,209 @@
+"""
+Compact patient records.
+
+A patient is stored as one element of a NumPy structured array whose layout
+follows the feature schema: categoricals as uint8 codes (LabelEncoder order),
+numerics as float32. One record is ~40 bytes instead of a dict of Python
+strings and floats, and a batch is a single contiguous buffer that validation,
+preprocessing, result caching and batch scoring all share.
+
+Code 255 marks a missing categorical (filled with the training mode, as the
+original preprocessing did) and 254 a value never seen in training.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+MISSING_CODE = 255
+UNKNOWN_CODE = 254
+
+
+def record_dtype(schema):
+    """
+    Structured dtype for a schema, fields in training column order.
+    """
+    for col, vocab in schema.categories.items():
+        if len(vocab) >= UNKNOWN_CODE:
+            raise ValueError(f"'{col}' has too many categories for a uint8 code")
+    return np.dtype([
+        (col, np.uint8 if col in schema.categories else np.float32)
+        for col in schema.columns
+    ])
+
+
+def _codes_from_values(values, vocab):
+    codes = pd.Categorical(values, categories=vocab).codes.astype(np.int16)
+    codes[codes < 0] = UNKNOWN_CODE
+    return codes.astype(np.uint8)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def records_from_dicts(dicts, schema):
+    """
+    Build records from an iterable of patient dicts (e.g. app.py's user_input).
+    Never raises on bad values: they become UNKNOWN_CODE / NaN.
+    """
+    dicts = list(dicts)
+    records = np.empty(len(dicts), dtype=record_dtype(schema))
+    for col in schema.columns:
+        values = [d.get(col) for d in dicts]
+        if col in schema.categories:
+            code_map = schema.code_map(col)
+            records[col] = [
+                MISSING_CODE if v is None else code_map.get(str(v), UNKNOWN_CODE)
+                for v in values
+            ]
+        else:
+            records[col] = [_to_float(v) for v in values]
+    return records
+
+
+def records_from_frame(df, schema):
+    """
+    Vectorized conversion of a DataFrame of raw patient rows.
+    """
+    records = np.empty(len(df), dtype=record_dtype(schema))
+    for col in schema.columns:
+        if col not in df.columns:
+            records[col] = MISSING_CODE if col in schema.categories else np.nan
+        elif col in schema.categories:
+            codes = _codes_from_values(df[col].astype(str), schema.categories[col])
+            codes[df[col].isna().to_numpy()] = MISSING_CODE
+            records[col] = codes
+        else:
+            records[col] = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=np.float32)
+    return records
+
+
+def records_to_dicts(records, schema):
+    """
+    Decode records back into plain dicts with category strings.
+    """
+    columns = {}
+    for col in schema.columns:
+        values = records[col]
+        if col in schema.categories:
+            vocab = schema.categories[col]
+            columns[col] = [vocab[c] if c < len(vocab) else None for c in values.tolist()]
+        else:
+            columns[col] = [None if v != v else v for v in values.tolist()]
+    return [dict(zip(columns, row)) for row in zip(*columns.values())]
+
+
+def records_to_arrow(records, schema):
+    """
+    Convert records to a pyarrow Table. Categoricals become dictionary
+    arrays over the schema vocabulary, so the uint8 codes are reused as
+    indices instead of materializing strings.
+    """
+    import pyarrow as pa
+
+    arrays = []
+    for col in schema.columns:
+        values = np.ascontiguousarray(records[col])
+        if col in schema.categories:
+            arrays.append(pa.DictionaryArray.from_arrays(
+                pa.array(values, mask=values >= UNKNOWN_CODE),
+                pa.array(schema.categories[col], type=pa.string()),
+            ))
+        else:
+            arrays.append(pa.array(values, from_pandas=True))
+    return pa.Table.from_arrays(arrays, names=schema.columns)
+
+
+_VOCAB_ARRAYS = {}
+
+
+def _vocab_array(vocab):
+    import pyarrow as pa
+
+    key = tuple(vocab)
+    if key not in _VOCAB_ARRAYS:
+        _VOCAB_ARRAYS[key] = pa.array(list(key), type=pa.string())
+    return _VOCAB_ARRAYS[key]
+
+
+def _codes_from_arrow(values, vocab):
+    """
+    Codes for an Arrow array of category values. The lookup runs inside
+    Arrow (index_in against the vocabulary), so no Python strings are made.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if not pa.types.is_string(values.type):
+        values = values.cast(pa.string())
+    codes = pc.index_in(values, value_set=_vocab_array(vocab)).fill_null(UNKNOWN_CODE)
+    codes = codes.to_numpy(zero_copy_only=False).astype(np.uint8)
+    if values.null_count:
+        codes[values.is_null().to_numpy(zero_copy_only=False)] = MISSING_CODE
+    return codes
+
+
+def _fill_from_arrow(records, batch, schema):
+    import pyarrow as pa
+
+    for col in schema.columns:
+        if col not in batch.schema.names:
+            records[col] = MISSING_CODE if col in schema.categories else np.nan
+            continue
+        column = batch.column(col)
+        if col in schema.categories:
+            if pa.types.is_dictionary(column.type):
+                # Remap the (small) dictionary once, then gather by the index buffer in place
+                lookup = _codes_from_arrow(column.dictionary, schema.categories[col])
+                indices = column.indices
+                if indices.null_count:
+                    indices = indices.fill_null(0)
+                codes = lookup[indices.to_numpy(zero_copy_only=False)]
+                if column.null_count:
+                    codes[column.is_null().to_numpy(zero_copy_only=False)] = MISSING_CODE
+            else:
+                codes = _codes_from_arrow(column, schema.categories[col])
+            records[col] = codes
+        else:
+            # float32 without nulls is read straight from the value buffer
+            if column.type != pa.float32():
+                column = column.cast(pa.float32())
+            records[col] = column.to_numpy(zero_copy_only=False)
+
+
+def records_from_arrow(table, schema):
+    """
+    Build records from a pyarrow Table or RecordBatch. Arrow buffers are
+    read in place (batch by batch for a chunked Table); the only copy is
+    into the record layout itself. Dictionary-encoded and plain string
+    columns are mapped to codes inside Arrow.
+    """
+    records = np.empty(table.num_rows, dtype=record_dtype(schema))
+    batches = table.to_batches() if hasattr(table, "to_batches") else [table]
+    offset = 0
+    for batch in batches:
+        _fill_from_arrow(records[offset:offset + batch.num_rows], batch, schema)
+        offset += batch.num_rows
+    return records
+
+
+def records_to_matrix(records, schema, dtype=np.float32):
+    """
+    Model input matrix (n, n_features) in training column order.
+    Missing values get the schema fill values; unknown categories raise
+    ValueError because the model has no code for them.
+    """
+    X = np.empty((len(records), schema.n_features), dtype=dtype)
+    for i, col in enumerate(schema.columns):
+        values = records[col]
+        if col in schema.categories:
+            if (values == UNKNOWN_CODE).any():
+                raise ValueError(f"Unknown value for '{col}'")
+            X[:, i] = np.where(values == MISSING_CODE, schema.fill_values[col], values)
+        else:
+            X[:, i] = np.where(np.isnan(values), schema.fill_values[col], values)
+    return X
@@ -1,7 +1,12 @@
 import streamlit as st
 import pandas as pd
-from sklearn.preprocessing import LabelEncoder
+import numpy as np
 import os
+import json
+
+from feature_schema import FeatureSchema
+from patient_record import records_from_dicts, records_to_matrix
+from validation import RecordValidator
 
 
 # Load sample data for feature names
@@ -25,60 +30,39 @@ def load_sample_data():
         st.error(f"Error loading dataset: {e}")
         return None
 
+# Feature schema (column order, category codes, fill values) built once per process
+@st.cache_resource
+def load_feature_schema():
+    df = load_sample_data()
+    if df is None:
+        return None
+    return FeatureSchema.from_dataframe(df)
+
+# Validator compiled once per schema; missing fields are imputed downstream, so only present values are checked
+@st.cache_resource(hash_funcs={FeatureSchema: lambda schema: json.dumps(schema.to_dict(), sort_keys=True)})
+def load_validator(schema):
+    return RecordValidator(schema, allow_missing=True)
+
 # Enhanced preprocessing function with standard scaling---------------------
-def preprocess_input_with_scaling(user_input):
+def preprocess_input_with_scaling(user_input, schema=None):
     """
     Prepare a single-row DataFrame for the trained LightGBM model.
     - Drop target column
-    - Label-encode categorical features (fitted on sample_df)
+    - Label-encode categorical features (codes from the feature schema)
     - Keep exact feature order the model was trained on
-    """
-    df = load_sample_data()
-    sample_df = df.copy()
-    if sample_df is None or not isinstance(sample_df, pd.DataFrame):
-        raise ValueError("sample_df is required and must be a DataFrame")
-
-    # 1) Training-time feature frame (X) = sample_df without target
-    if "Heart_Disease" in sample_df.columns:
-        X_sample = sample_df.drop(columns=['Heart_Disease'])
-    else:
-        X_sample = sample_df.copy()
+    - Raise ValueError naming every failed check (unknown category, bad or
+      out-of-range numeric, BMI inconsistent with height and weight);
+      missing fields are filled with the schema's fill values
 
-    # 2) Build the single-row input
-    user_df = pd.DataFrame([user_input])
-
-    # 3) Categorical columns (object dtype) from X_sample only
-    cat_cols = X_sample.select_dtypes(include=["object"]).columns.tolist()
-
-    # 4) Label-encode each categorical col using the mapping from sample data
-    for col in cat_cols:
-        le = LabelEncoder()
-        # fit on sample
-        X_sample[col] = X_sample[col].astype(str)
-        le.fit(X_sample[col])
-
-        # transform only if user provided that column
-        if col in user_df.columns:
-            user_df[col] = le.transform(user_df[col].astype(str))
-        else:
-            mode_val = X_sample[col].mode(dropna=True)
-            fill_val = le.transform([str(mode_val.iloc[0])])[0] if not mode_val.empty else 0
-            user_df[col] = fill_val
-
-    # 5) Numeric columns → surerity check numeric dtype
-    num_cols = [c for c in X_sample.columns if c not in cat_cols]
-    for col in num_cols:
-        if col in user_df.columns:
-            user_df[col] = pd.to_numeric(user_df[col], errors="coerce")
-        else:
-            user_df[col] = pd.to_numeric(X_sample[col], errors="coerce").median()
-
-    # 6) Missing numeric impute (median)
-    for col in num_cols:
-        if user_df[col].isna().any():
-            user_df[col] = user_df[col].fillna(pd.to_numeric(X_sample[col], errors="coerce").median())
-
-    # 7) Ensure exact training column order
-    user_df = user_df[X_sample.columns.tolist()]
+    Pass the schema of an attached model host to skip loading the dataset.
+    """
+    if schema is None:
+        schema = load_feature_schema()
+    if schema is None:
+        raise ValueError("sample data is required to build the feature schema")
 
-    return user_df
+    records = records_from_dicts([user_input], schema)
+    result = load_validator(schema).validate(records)
+    if not result.valid[0]:
+        raise ValueError(f"Invalid patient data: {', '.join(result.row_errors(0))}")
+    return pd.DataFrame(records_to_matrix(records, schema, dtype=np.float64), columns=schema.columns)
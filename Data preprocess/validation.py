@@ -0,0 +1,151 @@
+"""
+Vectorized validation of patient records.
+
+The Streamlit widgets bound what a user can type, but API and batch inputs
+arrive unchecked. The validator's plausibility limits are the clinical
+ranges below (which also cover every value the widgets allow), extended to
+each numeric column's observed range in the training set (recorded in the
+schema) widened by a margin. RecordValidator compiles the schema and these limits
+into flat arrays once, then checks a whole batch of records with a handful of
+NumPy comparisons. It never raises on bad data: the result is a per-row,
+per-rule error mask so invalid rows can be dropped or reported while the rest
+of the batch is scored.
+"""
+
+import numpy as np
+
+from patient_record import MISSING_CODE, UNKNOWN_CODE, records_from_dicts, records_from_frame
+
+
+# Observed ranges are widened by this share of their span on each side
+RANGE_MARGIN = 0.1
+
+# Clinically plausible limits; per-week counts match the app's sliders
+CLINICAL_RANGES = {
+    'Height_(cm)': (100.0, 250.0),
+    'Weight_(kg)': (30.0, 300.0),
+    'Alcohol_Consumption': (0.0, 100.0),
+    'Fruit_Consumption': (0.0, 120.0),
+    'Green_Vegetables_Consumption': (0.0, 120.0),
+    'FriedPotato_Consumption': (0.0, 120.0),
+}
+# Any BMI the height and weight limits allow; BMI:consistency does the real check
+CLINICAL_RANGES['BMI'] = (CLINICAL_RANGES['Weight_(kg)'][0] / (CLINICAL_RANGES['Height_(cm)'][1] / 100) ** 2,
+                          CLINICAL_RANGES['Weight_(kg)'][1] / (CLINICAL_RANGES['Height_(cm)'][0] / 100) ** 2)
+
+# Allowed gap between the reported BMI and weight / height² (kg/m²)
+BMI_TOLERANCE = 1.0
+
+
+class ValidationResult:
+    """
+    Outcome of validating a batch.
+    - errors: bool array (n_rows, n_rules), True where a row breaks a rule
+    - rules: rule names, e.g. 'Sex:unknown', 'Height_(cm):range', 'BMI:consistency'
+    - valid: bool array (n_rows,), True for rows with no errors
+    """
+
+    def __init__(self, errors, rules):
+        self.errors = errors
+        self.rules = rules
+        self.valid = ~errors.any(axis=1)
+
+    @property
+    def n_invalid(self):
+        return int((~self.valid).sum())
+
+    def row_errors(self, i):
+        """
+        Names of the rules broken by row i.
+        """
+        return [self.rules[j] for j in np.flatnonzero(self.errors[i])]
+
+    def summary(self):
+        """
+        Count of failing rows per rule (rules with no failures omitted).
+        """
+        counts = self.errors.sum(axis=0)
+        return {rule: int(c) for rule, c in zip(self.rules, counts) if c}
+
+
+def plausible_ranges(schema, margin=RANGE_MARGIN, clinical=CLINICAL_RANGES):
+    """
+    Plausibility limits per numeric column: the union of the clinical range
+    and the observed training range widened by margin x span on each side
+    (never below zero for columns that are never negative). Columns with
+    neither are not range-checked.
+    """
+    ranges = {col: clinical[col] for col in schema.numeric_columns if col in clinical}
+    for col, (low, high) in schema.numeric_ranges.items():
+        pad = margin * (high - low)
+        low, high = (max(low - pad, 0.0) if low >= 0 else low - pad), high + pad
+        if col in ranges:
+            low, high = min(low, ranges[col][0]), max(high, ranges[col][1])
+        ranges[col] = (low, high)
+    return ranges
+
+
+class RecordValidator:
+    """
+    Validator compiled once per feature schema.
+    """
+
+    def __init__(self, schema, ranges=None, bmi_tolerance=BMI_TOLERANCE, allow_missing=False):
+        self.schema = schema
+        self.allow_missing = allow_missing
+        self.bmi_tolerance = bmi_tolerance
+        ranges = plausible_ranges(schema) if ranges is None else ranges
+
+        self.categorical_columns = list(schema.categorical_columns)
+        self.numeric_columns = list(schema.numeric_columns)
+        self.lower = np.array([ranges.get(c, (-np.inf, np.inf))[0] for c in self.numeric_columns], dtype=np.float32)
+        self.upper = np.array([ranges.get(c, (-np.inf, np.inf))[1] for c in self.numeric_columns], dtype=np.float32)
+        self.check_bmi = all(c in self.numeric_columns for c in ('Height_(cm)', 'Weight_(kg)', 'BMI'))
+
+        self.rules = (
+            [f"{c}:unknown" for c in self.categorical_columns]
+            + [f"{c}:missing" for c in self.categorical_columns + self.numeric_columns]
+            + [f"{c}:range" for c in self.numeric_columns]
+            + (["BMI:consistency"] if self.check_bmi else [])
+        )
+
+    def validate(self, records):
+        """
+        Validate a structured array of patient records.
+        """
+        n = len(records)
+        n_cat = len(self.categorical_columns)
+        n_num = len(self.numeric_columns)
+        errors = np.zeros((n, len(self.rules)), dtype=bool)
+
+        if n_cat:
+            codes = np.column_stack([records[c] for c in self.categorical_columns])
+            errors[:, :n_cat] = codes == UNKNOWN_CODE
+            if not self.allow_missing:
+                errors[:, n_cat:2 * n_cat] = codes == MISSING_CODE
+
+        offset = 2 * n_cat
+        if n_num:
+            values = np.column_stack([records[c] for c in self.numeric_columns])
+            missing = np.isnan(values)
+            if not self.allow_missing:
+                errors[:, offset:offset + n_num] = missing
+            offset += n_num
+            with np.errstate(invalid='ignore'):
+                errors[:, offset:offset + n_num] = ~missing & ((values < self.lower) | (values > self.upper))
+            offset += n_num
+
+        if self.check_bmi:
+            height_m = records['Height_(cm)'].astype(np.float64) / 100
+            with np.errstate(invalid='ignore', divide='ignore'):
+                expected = records['Weight_(kg)'] / (height_m ** 2)
+                gap = np.abs(records['BMI'] - expected)
+            errors[:, offset] = gap > self.bmi_tolerance
+
+        return ValidationResult(errors, self.rules)
+
+    def validate_dicts(self, dicts):
+        return self.validate(records_from_dicts(dicts, self.schema))
+
+    def validate_frame(self, df):
+        return self.validate(records_from_frame(df, self.schema))
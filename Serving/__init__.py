@@ -0,0 +1,31 @@
+"""
+Heart Disease Serving Module
+
+This module contains the inference-side infrastructure shared by the
+Streamlit app and offline jobs.
+
+Available functions:
+- attach_host(): Attach to (building if needed) the shared model/data host
+- build_host(): Build the shared host directory from the model and dataset
+- ModelRegistry: Versioned model store with active/shadow state
+- ModelRouter: Serve the active version with hot-swap and shadow scoring
+- Calibrator: Map raw model scores to calibrated probabilities
+- Cascade: Tier-1 pre-screen in front of the full model
+- Ensemble: Bag of boosters for per-prediction uncertainty
+- LivePreview: Debounced background scoring of in-progress inputs
+- PatientHistory: Indexed per-patient assessment history with bulk rescoring
+- score_arrow(): Score Arrow record batches without leaving Arrow
+"""
+
+from .model_host import ModelHost, attach_host, build_host
+from .model_registry import ModelRegistry, ModelRouter
+from .calibration import Calibrator
+from .cascade import Cascade
+from .ensemble import Ensemble
+from .live_preview import LivePreview
+from .patient_history import PatientHistory
+from .arrow_io import score_arrow, score_file
+
+__all__ = ['ModelHost', 'attach_host', 'build_host', 'ModelRegistry', 'ModelRouter', 'Calibrator', 'Cascade',
+           'Ensemble', 'LivePreview', 'PatientHistory', 'score_arrow', 'score_file']
+__version__ = '1.0.0'
@@ -0,0 +1,145 @@
+"""
+Arrow-native scoring.
+
+Upstream pipelines hand over patient extracts as Arrow record batches or
+Parquet. score_arrow() scores a batch or table without going through Python
+dicts or DataFrames:
+
+- columns are read from the Arrow buffers in place (records_from_arrow);
+  dictionary-encoded and string category columns are mapped to the model's
+  codes inside Arrow, by remapping each (small) dictionary once and
+  gathering by its index buffer
+- rows are validated and scored through the shared batch path
+- the probabilities come back as a RecordBatch whose value buffer is the
+  NumPy score array itself, with pass-through columns (e.g. a patient ID)
+  referencing the input buffers, not copies
+
+Invalid rows get a null probability. score_file() streams an Arrow IPC or
+Parquet file batch by batch (IPC files are memory-mapped) and writes the
+results as Arrow IPC or Parquet.
+
+    python Serving/arrow_io.py extract.parquet --output scores.arrow --id-column Patient_ID
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Data preprocess'))
+
+from model_host import HOST_DIR, attach_host
+from inference import score_batch
+from patient_record import records_from_arrow
+
+
+PROBABILITY_COLUMN = "probability"
+HIGH_RISK_COLUMN = "high_risk"
+BATCH_ROWS = 65536
+
+
+def score_arrow(model, schema, batch, validator=None, monitor=None, pass_through=(), threshold=None):
+    """
+    Score an Arrow RecordBatch or Table. Returns the same kind, with the
+    pass-through columns, the positive-class probability (null for rows
+    that failed validation) and the high/low risk decision.
+    """
+    import pyarrow as pa
+
+    records = records_from_arrow(batch, schema)
+    scores, _ = score_batch(model, schema, records, validator=validator, monitor=monitor)
+    invalid = np.isnan(scores)
+    if threshold is None:
+        threshold = getattr(model, 'threshold', 0.5)
+
+    mask = invalid if invalid.any() else None
+    arrays = [batch.column(name) for name in pass_through]
+    arrays.append(pa.array(scores, mask=mask))
+    arrays.append(pa.array(scores > threshold, mask=mask))
+    names = [*pass_through, PROBABILITY_COLUMN, HIGH_RISK_COLUMN]
+    if isinstance(batch, pa.Table):
+        return pa.Table.from_arrays(arrays, names=names)
+    return pa.RecordBatch.from_arrays(arrays, names=names)
+
+
+def read_batches(path, batch_rows=BATCH_ROWS):
+    """
+    Record batches of an Arrow IPC (file or stream) or Parquet file.
+    """
+    import pyarrow as pa
+
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        yield from pq.ParquetFile(path).iter_batches(batch_size=batch_rows)
+        return
+    source = pa.memory_map(path, "r")
+    try:
+        reader = pa.ipc.open_file(source)
+        batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    except pa.ArrowInvalid:
+        source.seek(0)
+        batches = pa.ipc.open_stream(source)
+    for batch in batches:
+        # Large IPC batches are sliced (zero-copy) to bound the model input matrix
+        for start in range(0, batch.num_rows, batch_rows):
+            yield batch.slice(start, batch_rows)
+
+
+def score_file(model, schema, input_path, output_path, validator=None, pass_through=(), batch_rows=BATCH_ROWS):
+    """
+    Stream a patient extract through score_arrow into an Arrow IPC
+    (.arrow) or Parquet (.parquet) file. Returns (rows, invalid rows).
+    """
+    import pyarrow as pa
+
+    writer = None
+    rows = invalid = 0
+    try:
+        for batch in read_batches(input_path, batch_rows):
+            result = score_arrow(model, schema, batch, validator=validator, pass_through=pass_through)
+            if writer is None:
+                if output_path.endswith(".parquet"):
+                    import pyarrow.parquet as pq
+
+                    writer = pq.ParquetWriter(output_path, result.schema, compression="zstd")
+                else:
+                    writer = pa.ipc.new_file(output_path, result.schema)
+            if output_path.endswith(".parquet"):
+                writer.write_batch(result)
+            else:
+                writer.write(result)
+            rows += result.num_rows
+            invalid += result.column(PROBABILITY_COLUMN).null_count
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows, invalid
+
+
+def main():
+    import argparse
+
+    from validation import RecordValidator
+
+    parser = argparse.ArgumentParser(description="Score an Arrow IPC or Parquet patient extract.")
+    parser.add_argument("input", help=".arrow/.feather (IPC) or .parquet")
+    parser.add_argument("--output", default="scores.arrow", help=".arrow (IPC) or .parquet")
+    parser.add_argument("--id-column", action="append", default=[], help="column copied to the output (repeatable)")
+    parser.add_argument("--batch-rows", type=int, default=BATCH_ROWS)
+    parser.add_argument("--host-dir", default=HOST_DIR)
+    args = parser.parse_args()
+
+    host = attach_host(args.host_dir)
+    started = time.perf_counter()
+    rows, invalid = score_file(host, host.schema, args.input, args.output, validator=RecordValidator(host.schema),
+                               pass_through=args.id_column, batch_rows=args.batch_rows)
+    elapsed = time.perf_counter() - started
+    print(f"✅ {rows:,} patients scored in {elapsed:.2f}s ({rows / max(elapsed, 1e-9):,.0f}/s), "
+          f"{invalid:,} invalid; results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+Append-only prediction audit log.
+
+Every prediction (input record, probability, model version, latency) is
+handed to a bounded in-memory queue and returns immediately. The probability
+is NaN for patients decided by the cascade pre-screen, which the full model
+never scored. A background
+thread batches entries into Parquet row groups, compressed with zstd.
+It rotates to a new file when the current one reaches a size or age limit.
+
+Files are written as audit-<time>-<pid>-<seq>.parquet.inprogress and renamed on
+close. Readers therefore only ever see complete files. If the queue is full
+the entry is dropped and its rows are counted rather than blocking the
+request path.
+
+A process that crashes leaves its current file .inprogress. When a log is
+opened, such files of processes that are no longer running are recovered:
+renamed into place if their Parquet footer is intact, otherwise (the rows
+cannot be read back) renamed to .corrupt so they are not retried.
+"""
+
+import atexit
+import glob
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Data preprocess'))
+
+from patient_record import records_to_arrow
+
+
+# Set HEART_AUDIT_DIR to an empty string to disable auditing
+AUDIT_DIR = os.environ.get("HEART_AUDIT_DIR", os.path.join("logs", "audit"))
+
+IN_PROGRESS_SUFFIX = ".inprogress"
+CORRUPT_SUFFIX = ".corrupt"
+_STOP = object()
+
+logger = logging.getLogger(__name__)
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def recover_in_progress(directory=AUDIT_DIR):
+    """
+    Finalize .inprogress files left behind by processes that died. Files
+    whose footer is readable are renamed into place; unreadable ones are
+    renamed to .corrupt. Returns (recovered, corrupt) file counts.
+    """
+    import pyarrow.parquet as pq
+
+    recovered = corrupt = 0
+    for path in glob.glob(os.path.join(directory, f"audit-*.parquet{IN_PROGRESS_SUFFIX}")):
+        # audit-<date>-<time>-<pid>-<seq>.parquet.inprogress
+        try:
+            pid = int(os.path.basename(path).split("-")[3])
+        except (IndexError, ValueError):
+            continue
+        if pid == os.getpid() or _process_alive(pid):
+            continue
+        try:
+            pq.ParquetFile(path).metadata
+        except Exception:
+            os.replace(path, path[:-len(IN_PROGRESS_SUFFIX)] + CORRUPT_SUFFIX)
+            logger.warning("Audit file %s was left incomplete by process %d and cannot be read", path, pid)
+            corrupt += 1
+            continue
+        os.replace(path, path[:-len(IN_PROGRESS_SUFFIX)])
+        recovered += 1
+    return recovered, corrupt
+
+
+class AuditLog:
+    """
+    Asynchronous, append-only Parquet log of predictions.
+    """
+
+    def __init__(self, schema, model_version="unknown", directory=AUDIT_DIR,
+                 row_group_size=1024, flush_seconds=5.0,
+                 max_file_bytes=64 * 1024 * 1024, max_file_seconds=900, queue_size=10000):
+        self.schema = schema
+        self.model_version = model_version
+        self.directory = directory
+        self.row_group_size = row_group_size
+        self.flush_seconds = flush_seconds
+        self.max_file_bytes = max_file_bytes
+        self.max_file_seconds = max_file_seconds
+        self.dropped = 0
+        self.written = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self.recovered, self.corrupt = recover_in_progress(directory)
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._writer = None
+        self._path = None
+        self._opened_at = 0.0
+        self._sequence = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def log(self, records, probabilities, latency_ms, model_version=None):
+        """
+        Queue a batch of scored records. Never blocks: returns False (and
+        counts the dropped rows) if the writer has fallen too far behind or
+        has been closed.
+        """
+        entry = (
+            time.time(),
+            np.array(records, copy=True),
+            np.asarray(probabilities, dtype=np.float32),
+            float(latency_ms),
+            model_version or self.model_version,
+        )
+        if self._closed:
+            self.dropped += len(entry[1])
+            return False
+        try:
+            self._queue.put_nowait(entry)
+            return True
+        except queue.Full:
+            self.dropped += len(entry[1])
+            return False
+
+    def close(self):
+        """
+        Flush pending entries and finalize the current file.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self):
+        pending = []
+        pending_rows = 0
+        last_flush = time.monotonic()
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_seconds)
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                if pending:
+                    self._write(pending)
+                self._close_file()
+                return
+            if item is not None:
+                pending.append(item)
+                pending_rows += len(item[1])
+
+            now = time.monotonic()
+            if pending and (pending_rows >= self.row_group_size or now - last_flush >= self.flush_seconds):
+                self._write(pending)
+                pending, pending_rows, last_flush = [], 0, now
+            elif self._writer is not None and time.time() - self._opened_at >= self.max_file_seconds:
+                self._close_file()
+
+    def _to_table(self, entries):
+        import pyarrow as pa
+
+        counts = [len(e[1]) for e in entries]
+        table = records_to_arrow(np.concatenate([e[1] for e in entries]), self.schema)
+        timestamps = np.repeat((np.array([e[0] for e in entries]) * 1000).astype(np.int64), counts).astype("datetime64[ms]")
+        table = table.append_column("probability", pa.array(np.concatenate([e[2] for e in entries])))
+        table = table.append_column("latency_ms", pa.array(np.repeat([e[3] for e in entries], counts).astype(np.float32)))
+        table = table.append_column("model_version", pa.array(np.repeat([e[4] for e in entries], counts)).dictionary_encode())
+        return table.add_column(0, "timestamp", pa.array(timestamps, type=pa.timestamp("ms", tz="UTC")))
+
+    def _write(self, entries):
+        import pyarrow.parquet as pq
+
+        try:
+            table = self._to_table(entries)
+            if self._writer is not None and (
+                os.path.getsize(self._path) >= self.max_file_bytes
+                or time.time() - self._opened_at >= self.max_file_seconds
+            ):
+                self._close_file()
+            if self._writer is None:
+                stamp = time.strftime("%Y%m%d-%H%M%S")
+                self._sequence += 1
+                name = f"audit-{stamp}-{os.getpid()}-{self._sequence:04d}.parquet{IN_PROGRESS_SUFFIX}"
+                self._path = os.path.join(self.directory, name)
+                self._writer = pq.ParquetWriter(self._path, table.schema, compression="zstd")
+                self._opened_at = time.time()
+            self._writer.write_table(table, row_group_size=len(table))
+            self.written += len(table)
+        except Exception:
+            # Auditing must never take the app down; the rows are counted as lost
+            self.dropped += sum(len(entry[1]) for entry in entries)
+
+    def _close_file(self):
+        if self._writer is None:
+            return
+        self._writer.close()
+        os.replace(self._path, self._path[:-len(IN_PROGRESS_SUFFIX)])
+        self._writer = None
+        self._path = None
+
+
+def audit_files(directory=AUDIT_DIR):
+    """
+    Completed audit files, oldest first.
+    """
+    return sorted(glob.glob(os.path.join(directory, "audit-*.parquet")))
+
+
+def read_audit_log(directory=AUDIT_DIR, columns=None, since=None, until=None, model_version=None):
+    """
+    Read the audit log back as a pyarrow Table.
+    - columns: only these columns are read from disk (column pruning)
+    - since / until: datetime bounds on the prediction timestamp
+    - model_version: restrict to one model version
+    Filters are pushed down to the Parquet row groups.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    files = audit_files(directory)
+    if not files:
+        return pa.table({})
+
+    dataset = ds.dataset(files, format="parquet")
+    condition = None
+    for expr in (
+        ds.field("timestamp") >= pa.scalar(since, type=pa.timestamp("ms", tz="UTC")) if since is not None else None,
+        ds.field("timestamp") < pa.scalar(until, type=pa.timestamp("ms", tz="UTC")) if until is not None else None,
+        ds.field("model_version") == model_version if model_version is not None else None,
+    ):
+        if expr is not None:
+            condition = expr if condition is None else condition & expr
+    return dataset.to_table(columns=columns, filter=condition)
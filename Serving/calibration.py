@@ -0,0 +1,202 @@
+"""
+Probability calibration.
+
+Raw LightGBM scores on the imbalanced BRFSS data are not probabilities. A
+calibration map (isotonic regression or Platt scaling) is fitted offline on
+one half of a labelled validation CSV of patients the model never saw and
+evaluated on the other half, then stored next to the model host as a compact
+piecewise-linear lookup:
+
+    calibration.npy    (2, K) float64 knots: raw score -> calibrated probability
+    calibration.json   method, data source, Brier scores before/after and
+                       reliability tables on the evaluation half (written last)
+
+Without a validation CSV the host's reference population is used instead.
+That is the model's own training data, on which its scores are optimistic,
+so the map and its Brier scores are in-sample and only a stopgap.
+
+Applying it is one np.interp over a whole batch.
+
+    python Serving/calibration.py --validation-csv holdout.csv --method isotonic
+"""
+
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from model_host import HOST_DIR, attach_host
+from inference import labelled_scores, load_reference_scores
+
+
+CALIBRATION_FILE = "calibration.npy"
+REPORT_FILE = "calibration.json"
+METHODS = ('isotonic', 'platt')
+N_BINS = 10
+PLATT_KNOTS = 257
+
+
+def brier_score(probabilities, y):
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    return float(np.mean((probabilities - np.asarray(y, dtype=np.float64)) ** 2))
+
+
+def reliability_table(probabilities, y, n_bins=N_BINS):
+    """
+    Equal-width probability bins with the mean predicted probability, the
+    observed positive rate and the row count of each.
+    """
+    probabilities = np.asarray(probabilities, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    bins = np.minimum((probabilities * n_bins).astype(np.int64), n_bins - 1)
+    counts = np.bincount(bins, minlength=n_bins)
+    predicted = np.bincount(bins, weights=probabilities, minlength=n_bins)
+    observed = np.bincount(bins, weights=y, minlength=n_bins)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {
+            "bin_lower": (np.arange(n_bins) / n_bins).tolist(),
+            "bin_upper": (np.arange(1, n_bins + 1) / n_bins).tolist(),
+            "mean_predicted": np.where(counts > 0, predicted / counts, np.nan).tolist(),
+            "observed_rate": np.where(counts > 0, observed / counts, np.nan).tolist(),
+            "count": counts.tolist(),
+        }
+
+
+def _fit_knots(scores, y, method):
+    scores = np.asarray(scores, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if method == 'isotonic':
+        from sklearn.isotonic import IsotonicRegression
+
+        iso = IsotonicRegression(y_min=0.0, y_max=1.0, out_of_bounds='clip').fit(scores, y)
+        return np.vstack([iso.X_thresholds_, iso.y_thresholds_])
+    if method == 'platt':
+        from sklearn.linear_model import LogisticRegression
+
+        def logit(p):
+            p = np.clip(p, 1e-6, 1 - 1e-6)
+            return np.log(p / (1 - p))
+
+        platt = LogisticRegression(C=1e6).fit(logit(scores)[:, None], y)
+        # Sample the sigmoid densely where the scores actually are
+        xs = np.unique(np.concatenate([
+            np.linspace(0.0, 1.0, PLATT_KNOTS),
+            np.quantile(scores, np.linspace(0.0, 1.0, PLATT_KNOTS)),
+        ]))
+        return np.vstack([xs, platt.predict_proba(logit(xs)[:, None])[:, 1]])
+    raise ValueError(f"Unknown calibration method {method!r}; expected one of {METHODS}")
+
+
+class Calibrator:
+    """
+    Piecewise-linear map from raw model scores to calibrated probabilities.
+    """
+
+    def __init__(self, knots, method, report=None):
+        self.knots = np.asarray(knots, dtype=np.float64)
+        self.method = method
+        self.report = report or {}
+
+    @classmethod
+    def fit(cls, scores, y, method='isotonic'):
+        return cls(_fit_knots(scores, y, method), method)
+
+    def transform(self, scores):
+        """
+        Calibrated probabilities for a batch of raw scores.
+        """
+        return np.interp(np.asarray(scores, dtype=np.float64), self.knots[0], self.knots[1])
+
+    @classmethod
+    def build(cls, host, method='isotonic', validation_csv=None, fit_fraction=0.5, seed=0):
+        """
+        Fit on a fixed random part of the validation CSV (the reference
+        population if none is given), report on the rest, and save the
+        result in the host directory.
+        """
+        if validation_csv is None:
+            scores = np.asarray(load_reference_scores(host), dtype=np.float64)
+            y = np.asarray(host.reference_y, dtype=np.float64)
+        else:
+            scores, y = labelled_scores(host, host.schema, validation_csv)
+            y = y.astype(np.float64)
+        order = np.random.default_rng(seed).permutation(len(scores))
+        n_fit = int(len(scores) * fit_fraction)
+        fit_rows, eval_rows = order[:n_fit], order[n_fit:]
+
+        calibrator = cls.fit(scores[fit_rows], y[fit_rows], method)
+        raw, calibrated = scores[eval_rows], calibrator.transform(scores[eval_rows])
+        calibrator.report = {
+            "method": method,
+            "validation": validation_csv or "reference",
+            "in_sample": validation_csv is None,
+            "n_fit": int(n_fit),
+            "n_eval": int(len(eval_rows)),
+            "n_knots": int(calibrator.knots.shape[1]),
+            "brier_raw": brier_score(raw, y[eval_rows]),
+            "brier_calibrated": brier_score(calibrated, y[eval_rows]),
+            "reliability_raw": reliability_table(raw, y[eval_rows]),
+            "reliability_calibrated": reliability_table(calibrated, y[eval_rows]),
+        }
+        calibrator.save(host.host_dir)
+        return calibrator
+
+    def save(self, host_dir):
+        path = os.path.join(host_dir, CALIBRATION_FILE)
+        tmp_path = f"{path}.tmp-{os.getpid()}.npy"
+        np.save(tmp_path, self.knots)
+        os.replace(tmp_path, path)
+        # report goes last: its presence marks the calibration as complete
+        report_path = os.path.join(host_dir, REPORT_FILE)
+        with open(f"{report_path}.tmp-{os.getpid()}", "w") as f:
+            json.dump(self.report, f, indent=2)
+        os.replace(f"{report_path}.tmp-{os.getpid()}", report_path)
+
+    @classmethod
+    def load(cls, host, method='isotonic'):
+        """
+        Calibration stored with the host, or None if none was fitted
+        (fitting is an offline step, see main()).
+        """
+        report_path = os.path.join(host.host_dir, REPORT_FILE)
+        if not os.path.exists(report_path):
+            return None
+        with open(report_path) as f:
+            report = json.load(f)
+        return cls(np.load(os.path.join(host.host_dir, CALIBRATION_FILE)), report["method"], report)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fit and evaluate probability calibration for the model host.")
+    parser.add_argument("--host-dir", default=HOST_DIR)
+    parser.add_argument("--method", choices=METHODS, default='isotonic')
+    parser.add_argument("--validation-csv",
+                        help="labelled patients the model was not trained on (default: reference population, in-sample)")
+    args = parser.parse_args()
+
+    host = attach_host(args.host_dir)
+    if args.validation_csv is None:
+        print("⚠️  WARNING: no --validation-csv given. Fitting and evaluating on the reference population, which is\n"
+              "   the model's training data: the calibration map and Brier scores below are IN-SAMPLE and\n"
+              "   will flatter the model. Pass a labelled hold-out CSV for a calibration you can trust.\n")
+    calibrator = Calibrator.build(host, args.method, args.validation_csv)
+    report = calibrator.report
+    source = "in-sample reference" if report["in_sample"] else "validation"
+    print(f"Brier score on {report['n_eval']:,} {source} patients: "
+          f"{report['brier_raw']:.4f} raw -> {report['brier_calibrated']:.4f} {args.method}")
+    print(f"\n{'bin':>11}{'raw n':>9}{'predicted':>11}{'observed':>10}{'cal n':>9}{'predicted':>11}{'observed':>10}")
+    raw, cal = report["reliability_raw"], report["reliability_calibrated"]
+    for i in range(len(raw["count"])):
+        print(f"{raw['bin_lower'][i]:>5.1f}-{raw['bin_upper'][i]:<5.1f}"
+              f"{raw['count'][i]:>9}{raw['mean_predicted'][i]:>11.3f}{raw['observed_rate'][i]:>10.3f}"
+              f"{cal['count'][i]:>9}{cal['mean_predicted'][i]:>11.3f}{cal['observed_rate'][i]:>10.3f}")
+    print(f"\n✅ {calibrator.knots.shape[1]}-knot {args.method} calibration written to {args.host_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+"""
+Tiered cascade inference.
+
+Tier 1 is a shallow regression tree distilled from the full model: it is
+fitted on the reference population to reproduce the full model's scores, so
+each leaf carries the mean full-model score of the patients that land in it.
+Patients whose tier-1 score falls outside a confidence band (clearly low or
+clearly high risk) are answered by the tree; only the uncertain middle band
+goes on to the full LightGBM model.
+
+The band is tuned on one half of the reference population to skip as much
+traffic as possible while the cascade's high/low decision still agrees with
+the full model on at least `min_parity` of patients, and that parity is then
+checked on the other half. Both halves are the model's own training data, so
+the reported parity is in-sample. A pre-screened patient gets a decision
+only: the tier-1 score is a leaf average, not that patient's risk, so it is
+never passed on as one and no full-model score exists for the row. decide()
+is what every caller that labels a patient high or low risk goes through;
+its scores are NaN for pre-screened rows, and consumers of the score
+(calibration, percentiles, logging, history) skip or mark those rows.
+
+The cascade is built with the host for its decision threshold, rebuilt by
+threshold_optimizer.py when the operating point changes, and stored as:
+
+    cascade.npz     tier-1 tree as flat node arrays (evaluated with NumPy)
+    cascade.json    band, decision threshold and parity/skip report (written last)
+
+    python Serving/cascade.py --min-parity 0.995
+    python Serving/cascade.py --low 0.2 --high 0.8
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Data preprocess'))
+
+from model_host import HOST_DIR, attach_host
+from inference import load_reference_scores, score_records
+from patient_record import records_to_matrix
+
+
+TREE_FILE = "cascade.npz"
+REPORT_FILE = "cascade.json"
+THRESHOLD = 0.5
+MIN_PARITY = 0.99
+MAX_DEPTH = 6
+MIN_SAMPLES_LEAF = 100
+TREE_FIELDS = ('left', 'right', 'feature', 'threshold', 'value')
+
+
+def _fit_tree(X, scores, max_depth=MAX_DEPTH, min_samples_leaf=MIN_SAMPLES_LEAF):
+    from sklearn.tree import DecisionTreeRegressor
+
+    tree = DecisionTreeRegressor(max_depth=max_depth, min_samples_leaf=min_samples_leaf, random_state=0)
+    tree.fit(X, scores)
+    t = tree.tree_
+    return {
+        'left': t.children_left.astype(np.int32),
+        'right': t.children_right.astype(np.int32),
+        'feature': np.maximum(t.feature, 0).astype(np.int32),
+        'threshold': t.threshold.astype(np.float64),
+        'value': t.value[:, 0, 0].astype(np.float64),
+    }
+
+
+def _tune_band(leaf_values, leaf_rows, leaf_disagree, n_rows, min_parity, threshold):
+    """
+    Widest band (fewest rows sent to the full model) whose disagreements
+    stay within the parity budget. Leaves below the threshold can only be
+    skipped from the lowest value up, leaves above from the highest down,
+    so both sides are prefix sums over the leaves sorted by value.
+    """
+    budget = (1.0 - min_parity) * n_rows
+    low_side = leaf_values < threshold
+    candidates = []
+    for side, sign in ((low_side, 1), (~low_side, -1)):
+        order = np.argsort(sign * leaf_values[side], kind='stable')
+        values = leaf_values[side][order]
+        rows = np.concatenate([[0], np.cumsum(leaf_rows[side][order])])
+        disagree = np.concatenate([[0], np.cumsum(leaf_disagree[side][order])])
+        # Entry k: skip the first k leaves of this side
+        candidates.append((rows, disagree, values))
+
+    (low_rows, low_dis, low_values), (high_rows, high_dis, high_values) = candidates
+    skipped = low_rows[:, None] + high_rows[None, :]
+    disagree = low_dis[:, None] + high_dis[None, :]
+    skipped = np.where(disagree <= budget, skipped, -1)
+    i, j = np.unravel_index(np.argmax(skipped), skipped.shape)
+    # Place each edge halfway between the last skipped leaf and the first kept one
+    low = threshold if i == 0 else float(
+        (low_values[i - 1] + (low_values[i] if i < len(low_values) else threshold)) / 2)
+    high = threshold if j == 0 else float(
+        (high_values[j - 1] + (high_values[j] if j < len(high_values) else threshold)) / 2)
+    return low, high
+
+
+class Cascade:
+    """
+    Tier-1 pre-screen in front of a full model, with a confidence band.
+    """
+
+    def __init__(self, tree, low, high, threshold=THRESHOLD, report=None):
+        self.tree = {name: np.asarray(tree[name]) for name in TREE_FIELDS}
+        self.low = float(low)
+        self.high = float(high)
+        self.threshold = threshold
+        self.report = report or {}
+        self._depth = self._tree_depth()
+        self._lock = threading.Lock()
+        self.total = 0
+        self.skipped = 0
+
+    def _tree_depth(self):
+        depth, nodes = 0, np.array([0])
+        while True:
+            nodes = nodes[self.tree['left'][nodes] >= 0]
+            if not len(nodes):
+                return depth
+            nodes = np.concatenate([self.tree['left'][nodes], self.tree['right'][nodes]])
+            depth += 1
+
+    def _leaves(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        left, right, feature, threshold = (self.tree[name] for name in TREE_FIELDS[:4])
+        rows = np.arange(len(X))
+        nodes = np.zeros(len(X), dtype=np.int32)
+        for _ in range(self._depth):
+            go_left = X[rows, feature[nodes]] <= threshold[nodes]
+            nodes = np.where(left[nodes] < 0, nodes, np.where(go_left, left[nodes], right[nodes]))
+        return nodes
+
+    def prescreen(self, X):
+        """
+        (tier-1 scores, confident mask) for a model input matrix. Rows with
+        missing values are never confident.
+        """
+        X = np.asarray(X, dtype=np.float64)
+        scores = self.tree['value'][self._leaves(np.nan_to_num(X))]
+        confident = ((scores < self.low) | (scores > self.high)) & ~np.isnan(X).any(axis=1)
+        return scores, confident
+
+    def score_records(self, model, schema, records, cache=None):
+        """
+        Score records through the cascade. Returns (scores, skipped) where
+        skipped marks the rows answered by the pre-screen.
+        """
+        scores, confident = self.prescreen(records_to_matrix(records, schema))
+        todo = np.flatnonzero(~confident)
+        if len(todo):
+            scores[todo] = score_records(model, schema, records[todo], cache)
+        with self._lock:
+            self.total += len(records)
+            self.skipped += int(confident.sum())
+        return scores, confident
+
+    def stats(self):
+        with self._lock:
+            return {
+                "total": self.total,
+                "skipped": self.skipped,
+                "skip_fraction": self.skipped / self.total if self.total else 0.0,
+            }
+
+    def evaluate(self, X, full_scores):
+        """
+        Parity of the cascade with the full model on a scored population.
+        """
+        full_scores = np.asarray(full_scores, dtype=np.float64)
+        tier1, confident = self.prescreen(X)
+        cascade = np.where(confident, tier1, full_scores)
+        agree = (cascade > self.threshold) == (full_scores > self.threshold)
+        return {
+            "rows": int(len(full_scores)),
+            "skip_fraction": float(confident.mean()),
+            "decision_parity": float(agree.mean()),
+            "skipped_parity": float(agree[confident].mean()) if confident.any() else 1.0,
+            "skipped_mean_abs_diff": float(np.abs(tier1 - full_scores)[confident].mean()) if confident.any() else 0.0,
+        }
+
+    @classmethod
+    def build(cls, host, min_parity=MIN_PARITY, band=None, max_depth=MAX_DEPTH,
+              min_samples_leaf=MIN_SAMPLES_LEAF, fit_fraction=0.5, seed=0, threshold=None):
+        """
+        Distil the tier-1 tree from the full model's reference scores, tune
+        the band (unless one is given) on the fit half, check parity on the
+        other half and save the result in the host directory. Parity is
+        measured at the host's decision threshold unless one is given.
+        """
+        if threshold is None:
+            threshold = getattr(host, 'threshold', THRESHOLD)
+        X = np.asarray(host.reference_X, dtype=np.float64)
+        full_scores = np.asarray(load_reference_scores(host), dtype=np.float64)
+        order = np.random.default_rng(seed).permutation(len(X))
+        n_fit = int(len(X) * fit_fraction)
+        fit_rows, eval_rows = order[:n_fit], order[n_fit:]
+
+        tree = _fit_tree(X[fit_rows], full_scores[fit_rows], max_depth, min_samples_leaf)
+        cascade = cls(tree, threshold, threshold, threshold)
+        if band is None:
+            leaves = cascade._leaves(X[fit_rows])
+            is_leaf = tree['left'] < 0
+            n_nodes = len(tree['value'])
+            leaf_rows = np.bincount(leaves, minlength=n_nodes)
+            tier1_high = tree['value'][leaves] > threshold
+            leaf_disagree = np.bincount(leaves, weights=tier1_high != (full_scores[fit_rows] > threshold), minlength=n_nodes)
+            band = _tune_band(tree['value'][is_leaf], leaf_rows[is_leaf], leaf_disagree[is_leaf],
+                              n_fit, min_parity, threshold)
+        cascade.low, cascade.high = band
+
+        started = time.perf_counter()
+        cascade.prescreen(X[eval_rows])
+        tier1_ns = (time.perf_counter() - started) / max(len(eval_rows), 1) * 1e9
+        started = time.perf_counter()
+        host.predict_proba(X[eval_rows])
+        full_ns = (time.perf_counter() - started) / max(len(eval_rows), 1) * 1e9
+
+        cascade.report = {
+            "low": cascade.low,
+            "high": cascade.high,
+            "threshold": threshold,
+            "min_parity": min_parity,
+            "max_depth": max_depth,
+            "n_leaves": int((tree['left'] < 0).sum()),
+            "n_fit": int(n_fit),
+            "fit": cascade.evaluate(X[fit_rows], full_scores[fit_rows]),
+            "eval": cascade.evaluate(X[eval_rows], full_scores[eval_rows]),
+            "tier1_ns_per_row": round(tier1_ns, 1),
+            "full_ns_per_row": round(full_ns, 1),
+        }
+        cascade.save(host.host_dir)
+        return cascade
+
+    def save(self, host_dir):
+        path = os.path.join(host_dir, TREE_FILE)
+        tmp_path = f"{path}.tmp-{os.getpid()}.npz"
+        np.savez(tmp_path, **self.tree)
+        os.replace(tmp_path, path)
+        # report goes last: its presence marks the cascade as complete
+        report_path = os.path.join(host_dir, REPORT_FILE)
+        with open(f"{report_path}.tmp-{os.getpid()}", "w") as f:
+            json.dump(self.report, f, indent=2)
+        os.replace(f"{report_path}.tmp-{os.getpid()}", report_path)
+
+    @classmethod
+    def load(cls, host):
+        """
+        Cascade stored with the host, or None if none was built or it was
+        tuned for a different decision threshold (building is an offline
+        step, see main(); every prediction then goes to the full model).
+        """
+        report_path = os.path.join(host.host_dir, REPORT_FILE)
+        if not os.path.exists(report_path):
+            return None
+        with open(report_path) as f:
+            report = json.load(f)
+        if report["threshold"] != getattr(host, 'threshold', THRESHOLD):
+            return None
+        with np.load(os.path.join(host.host_dir, TREE_FILE)) as tree:
+            return cls(tree, report["low"], report["high"], report["threshold"], report)
+
+
+def decide(model, schema, records, threshold=THRESHOLD, cascade=None, cache=None):
+    """
+    Full-model risk scores and high/low decisions for records. With a
+    cascade, rows tier 1 is confident about are decided by tier 1 alone
+    and never reach the full model: their score is NaN. The rest are
+    scored and decided by the full model. Returns (scores, high_risk,
+    prescreened) arrays.
+    """
+    if cascade is None:
+        scores = np.asarray(score_records(model, schema, records, cache), dtype=np.float64)
+        return scores, scores > threshold, np.zeros(len(records), dtype=bool)
+    decision_scores, prescreened = cascade.score_records(model, schema, records, cache)
+    high_risk = np.asarray(decision_scores) > threshold
+    return np.where(prescreened, np.nan, decision_scores), high_risk, prescreened
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the tier-1 pre-screen and tune its confidence band.")
+    parser.add_argument("--host-dir", default=HOST_DIR)
+    parser.add_argument("--min-parity", type=float, default=MIN_PARITY,
+                        help="minimum agreement with the full model's decision")
+    parser.add_argument("--low", type=float, help="fixed lower band edge (with --high) instead of tuning")
+    parser.add_argument("--high", type=float)
+    parser.add_argument("--max-depth", type=int, default=MAX_DEPTH)
+    args = parser.parse_args()
+
+    if (args.low is None) != (args.high is None):
+        parser.error("--low and --high go together")
+    band = (args.low, args.high) if args.low is not None else None
+
+    host = attach_host(args.host_dir)
+    cascade = Cascade.build(host, args.min_parity, band, args.max_depth)
+    report = cascade.report
+    print(f"Tier 1: depth-{args.max_depth} tree, {report['n_leaves']} leaves; "
+          f"band {report['low']:.3f}-{report['high']:.3f} goes to the full model")
+    print(f"\n{'half':<6}{'rows':>9}{'skipped':>10}{'parity':>9}{'skipped parity':>16}{'mean |diff|':>13}")
+    for half in ("fit", "eval"):
+        r = report[half]
+        print(f"{half:<6}{r['rows']:>9,}{r['skip_fraction']:>10.1%}{r['decision_parity']:>9.2%}"
+              f"{r['skipped_parity']:>16.2%}{r['skipped_mean_abs_diff']:>13.4f}")
+    print(f"\nPer-row cost: tier 1 {report['tier1_ns_per_row']:,.0f} ns, full model {report['full_ns_per_row']:,.0f} ns")
+    print(f"✅ Cascade written to {args.host_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+Streaming drift and data-quality monitor.
+
+Reference sketches (category frequencies and quantile-binned histograms of
+every feature) are computed once from the host's encoded reference table and
+cached next to it. The monitor keeps the same fixed-size sketches for the
+live scoring stream, updated per batch with bincount, so memory is constant
+and no raw rows are stored. PSI and a binned KS statistic per feature are
+derived on demand and exported as Prometheus text metrics.
+"""
+
+import json
+import os
+import sys
+import threading
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Data preprocess'))
+
+from patient_record import MISSING_CODE, UNKNOWN_CODE
+
+
+# Directory for exported .prom files (e.g. node_exporter's textfile collector)
+METRICS_DIR = os.environ.get("HEART_METRICS_DIR")
+
+REFERENCE_FILE = "drift_reference.json"
+N_BINS = 20
+PSI_EPSILON = 1e-4
+
+
+class ReferenceSketch:
+    """
+    Per-feature reference distribution.
+    - categorical: counts per code
+    - numeric: inner bin edges (reference quantiles) and counts per bin
+    """
+
+    def __init__(self, columns, categorical, edges, counts):
+        self.columns = list(columns)
+        self.categorical = set(categorical)
+        self.edges = {col: np.asarray(e, dtype=np.float64) for col, e in edges.items()}
+        self.counts = {col: np.asarray(c, dtype=np.float64) for col, c in counts.items()}
+
+    @classmethod
+    def from_matrix(cls, X, schema, n_bins=N_BINS):
+        """
+        Build sketches from an encoded (n, n_features) reference matrix.
+        """
+        edges, counts = {}, {}
+        for i, col in enumerate(schema.columns):
+            values = np.asarray(X[:, i], dtype=np.float64)
+            if col in schema.categories:
+                counts[col] = np.bincount(values.astype(np.int64), minlength=len(schema.categories[col]))
+            else:
+                quantiles = np.quantile(values, np.linspace(0, 1, n_bins + 1)[1:-1])
+                edges[col] = np.unique(quantiles)
+                counts[col] = np.bincount(np.searchsorted(edges[col], values, side='right'),
+                                          minlength=len(edges[col]) + 1)
+        return cls(schema.columns, schema.categories, edges, counts)
+
+    def to_dict(self):
+        return {
+            "columns": self.columns,
+            "categorical": sorted(self.categorical),
+            "edges": {col: e.tolist() for col, e in self.edges.items()},
+            "counts": {col: c.tolist() for col, c in self.counts.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["columns"], data["categorical"], data["edges"], data["counts"])
+
+
+def load_reference(host):
+    """
+    Reference sketch for a ModelHost, computed from its reference table on
+    first use and cached as drift_reference.json in the host directory.
+    """
+    path = os.path.join(host.host_dir, REFERENCE_FILE)
+    if os.path.exists(path):
+        with open(path) as f:
+            return ReferenceSketch.from_dict(json.load(f))
+
+    reference = ReferenceSketch.from_matrix(host.reference_X, host.schema)
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(reference.to_dict(), f)
+        os.replace(tmp_path, path)
+    except OSError:
+        # Read-only host directory: keep the in-memory sketch
+        pass
+    return reference
+
+
+def default_export_path():
+    """
+    Per-process metrics file under HEART_METRICS_DIR, or None when unset.
+    """
+    if not METRICS_DIR:
+        return None
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    return os.path.join(METRICS_DIR, f"heart_drift_{os.getpid()}.prom")
+
+
+def population_stability_index(expected, actual):
+    """
+    PSI between two count vectors over the same bins.
+    """
+    if expected.sum() == 0 or actual.sum() == 0:
+        return 0.0
+    p = np.maximum(expected / expected.sum(), PSI_EPSILON)
+    q = np.maximum(actual / actual.sum(), PSI_EPSILON)
+    return float(np.sum((q - p) * np.log(q / p)))
+
+
+def binned_ks(expected, actual):
+    """
+    Kolmogorov-Smirnov statistic evaluated at the bin boundaries.
+    """
+    if expected.sum() == 0 or actual.sum() == 0:
+        return 0.0
+    return float(np.max(np.abs(np.cumsum(expected) / expected.sum() - np.cumsum(actual) / actual.sum())))
+
+
+class DriftMonitor:
+    """
+    Constant-memory sketches of the scoring stream, compared against a
+    ReferenceSketch. Thread-safe; update() takes patient records and,
+    when export_path is set, rewrites the metrics file after each batch.
+    """
+
+    def __init__(self, reference, export_path=None):
+        self.reference = reference
+        self.export_path = export_path
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.rows = 0
+            self.invalid_rows = 0
+            self.counts = {col: np.zeros_like(c) for col, c in self.reference.counts.items()}
+            self.missing = {col: 0 for col in self.reference.columns}
+            self.unknown = {col: 0 for col in self.reference.categorical}
+            self.rule_failures = {}
+
+    def update(self, records, validation=None):
+        """
+        Fold one batch of patient records into the live sketches. Pass the
+        batch's ValidationResult to track rule failures as well.
+        """
+        partial = {}
+        missing = {}
+        unknown = {}
+        for col in self.reference.columns:
+            values = records[col]
+            if col in self.reference.categorical:
+                present = values < UNKNOWN_CODE
+                missing[col] = int((values == MISSING_CODE).sum())
+                unknown[col] = int((values == UNKNOWN_CODE).sum())
+                partial[col] = np.bincount(values[present], minlength=len(self.counts[col]))
+            else:
+                present = ~np.isnan(values)
+                missing[col] = int((~present).sum())
+                bins = np.searchsorted(self.reference.edges[col], values[present], side='right')
+                partial[col] = np.bincount(bins, minlength=len(self.counts[col]))
+
+        with self._lock:
+            self.rows += len(records)
+            for col, c in partial.items():
+                self.counts[col] += c[:len(self.counts[col])]
+                self.missing[col] += missing[col]
+            for col, n in unknown.items():
+                self.unknown[col] += n
+            if validation is not None:
+                self.invalid_rows += validation.n_invalid
+                for rule, n in validation.summary().items():
+                    self.rule_failures[rule] = self.rule_failures.get(rule, 0) + n
+
+        if self.export_path:
+            self.export(self.export_path)
+
+    def psi(self):
+        with self._lock:
+            return {col: population_stability_index(self.reference.counts[col], c)
+                    for col, c in self.counts.items()}
+
+    def ks(self):
+        with self._lock:
+            return {col: binned_ks(self.reference.counts[col], c)
+                    for col, c in self.counts.items() if col not in self.reference.categorical}
+
+    def metrics(self):
+        """
+        Flat snapshot of all monitor statistics.
+        """
+        psi, ks = self.psi(), self.ks()
+        with self._lock:
+            return {
+                "rows": self.rows,
+                "invalid_rows": self.invalid_rows,
+                "psi": psi,
+                "ks": ks,
+                "missing": dict(self.missing),
+                "unknown": dict(self.unknown),
+                "rule_failures": dict(self.rule_failures),
+            }
+
+    def to_prometheus(self):
+        """
+        Metrics in Prometheus text exposition format.
+        """
+        m = self.metrics()
+        lines = [
+            "# TYPE heart_drift_rows_total counter",
+            f"heart_drift_rows_total {m['rows']}",
+            "# TYPE heart_invalid_rows_total counter",
+            f"heart_invalid_rows_total {m['invalid_rows']}",
+        ]
+        for name, kind, values in (
+            ("heart_drift_psi", "gauge", m["psi"]),
+            ("heart_drift_ks", "gauge", m["ks"]),
+            ("heart_missing_values_total", "counter", m["missing"]),
+            ("heart_unknown_categories_total", "counter", m["unknown"]),
+        ):
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f'{name}{{feature="{col}"}} {value:g}' for col, value in values.items())
+        lines.append("# TYPE heart_rule_failures_total counter")
+        lines.extend(f'heart_rule_failures_total{{rule="{rule}"}} {n}' for rule, n in m["rule_failures"].items())
+        return "\n".join(lines) + "\n"
+
+    def export(self, path):
+        """
+        Atomically write the Prometheus metrics to path (textfile-collector style).
+        """
+        tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        with open(tmp_path, "w") as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
@@ -0,0 +1,319 @@
+"""
+Bagged ensemble for per-prediction uncertainty.
+
+A small bag of LightGBM models is trained on bootstrap resamples of the
+host's reference population with the served model's training setup: its
+parameters and number of boosting rounds, and the same class balance. The
+served model was trained on rebalanced data (its scores run well above the
+observed heart-disease rate), and that rebalancing is not recorded with the
+model, so it is recovered from the model itself: the positive-class weight
+whose prior shift maps the served scores back onto the observed rate. Each
+member's bootstrap counts are multiplied by that weight for positive rows,
+so the members score on the same scale as the served model; this is the
+only class weighting (is_unbalance / scale_pos_weight are not carried over,
+the recovered weight already includes them). If the bag
+still does not reproduce the served model (mean |ensemble - model| above
+MAX_MEAN_ABS_DIFF, e.g. because the reference data is not what the model
+was trained on), its spread says nothing about the served prediction: it is
+saved for inspection but not loaded.
+
+The members' trees are then packed into ONE booster, laid out like a
+multiclass model with one "class" per member (tree i * n_members + k is
+iteration i of member k), so a single predict(raw_score=True) call
+traverses every member's trees in one pass and returns one raw score per
+member. No softmax is applied to raw scores, so each column is exactly that
+member's binary log-odds. The latency report also times scoring the members
+one by one: full-size members make the packed model large, and for big
+batches the one-pass layout can lose its edge once the trees no longer fit
+in cache.
+
+Each prediction comes back as the mean member score, its standard deviation
+and an interval over the members. These are raw model scores, like the
+served model's: the served model's calibration map is fitted to its own
+scores and is not applied to the members. The spread on the reference
+population is kept as a yardstick for flagging unusual inputs, and the
+latency of the ensemble is measured against the single model. Stored with
+the host:
+
+    ensemble.txt     packed booster in LightGBM text format
+    ensemble.json    members, training settings, spread and latency report (written last)
+
+    python Serving/ensemble.py --members 8
+"""
+
+import json
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Data preprocess'))
+
+from model_host import HOST_DIR, attach_host
+from inference import load_reference_scores
+from patient_record import records_to_matrix
+
+
+BOOSTER_FILE = "ensemble.txt"
+REPORT_FILE = "ensemble.json"
+MEMBERS = 8
+INTERVAL = (0.1, 0.9)
+MAX_MEAN_ABS_DIFF = 0.05
+# Parameters of the served model carried over to every member
+TRAIN_PARAMS = ('learning_rate', 'num_leaves', 'max_depth', 'min_data_in_leaf', 'min_sum_hessian_in_leaf',
+                'feature_fraction', 'lambda_l1', 'lambda_l2', 'min_gain_to_split', 'max_bin',
+                'boost_from_average')
+# A member that stopped early is padded with trees that add nothing
+EMPTY_TREE = ("num_leaves=1\nnum_cat=0\nsplit_feature=\nsplit_gain=\nthreshold=\ndecision_type=\n"
+              "left_child=\nright_child=\nleaf_value=0\nleaf_weight=\nleaf_count=\ninternal_value=\n"
+              "internal_weight=\ninternal_count=\nis_linear=0\nshrinkage=1")
+
+
+def _split_model(text):
+    """
+    (header, tree blocks without their "Tree=i" line) of a LightGBM model string.
+    """
+    header, rest = text.split("\nTree=0\n", 1)
+    trees = rest.split("end of trees", 1)[0]
+    blocks = [block.strip("\n") for block in ("Tree=0\n" + trees).split("\n\n") if block.strip()]
+    return header, [block.split("\n", 1)[1] for block in blocks]
+
+
+def pack_boosters(boosters):
+    """
+    One LightGBM model string evaluating every (binary) booster at once:
+    predict(raw_score=True) returns an (n, len(boosters)) array of the
+    members' raw scores.
+    """
+    parts = [_split_model(booster.model_to_string()) for booster in boosters]
+    n_members, rounds = len(parts), max(len(trees) for _, trees in parts)
+    blocks = []
+    for i in range(rounds):
+        for k, (_, trees) in enumerate(parts):
+            body = trees[i] if i < len(trees) else EMPTY_TREE
+            blocks.append(f"Tree={i * n_members + k}\n{body}\n\n\n")
+
+    header = parts[0][0]
+    for key, value in (("num_class", n_members), ("num_tree_per_iteration", n_members),
+                       ("objective", f"multiclass num_class:{n_members}"),
+                       ("tree_sizes", " ".join(str(len(block.encode("utf-8"))) for block in blocks))):
+        header = re.sub(rf"^{key}=.*$", f"{key}={value}", header, count=1, flags=re.MULTILINE)
+    return f"{header}\n\n{''.join(blocks)}end of trees\n\npandas_categorical:null\n"
+
+
+def _sigmoid(raw):
+    return 1.0 / (1.0 + np.exp(-raw))
+
+
+def positive_weight(scores, y, iterations=60):
+    """
+    Weight of a positive row in the data a model was trained on, estimated
+    from its scores on data with the true class balance: the odds ratio k
+    for which shifting every score's log-odds by -log(k) makes the mean
+    score equal the observed positive rate (k = 1 for a model trained on
+    the observed balance).
+    """
+    scores = np.clip(np.asarray(scores, dtype=np.float64), 1e-9, 1 - 1e-9)
+    logits = np.log(scores / (1 - scores))
+    rate = float(np.mean(y))
+    low, high = -20.0, 20.0
+    # The mean shifted score falls as log(k) grows; bisect for the observed rate
+    for _ in range(iterations):
+        mid = (low + high) / 2
+        if _sigmoid(logits - mid).mean() > rate:
+            low = mid
+        else:
+            high = mid
+    return float(np.exp((low + high) / 2))
+
+
+def _per_row_us(predict, X, repeats):
+    """
+    Median microseconds per row of predict(X) over a few repeats.
+    """
+    predict(X)
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        predict(X)
+        timings.append(time.perf_counter() - started)
+    return float(np.median(timings)) / len(X) * 1e6
+
+
+class Ensemble:
+    """
+    Packed bag of boosters trained like the served model, scored in one traversal.
+    """
+
+    def __init__(self, booster, n_members, report=None):
+        self.booster = booster
+        self.n_members = n_members
+        self.report = report or {}
+
+    def member_scores(self, X):
+        """
+        (n, n_members) raw positive-class score of every member.
+        """
+        raw = self.booster.predict(np.asarray(X, dtype=np.float64), raw_score=True)
+        return _sigmoid(np.asarray(raw).reshape(len(X), self.n_members))
+
+    def predict(self, X, interval=INTERVAL):
+        """
+        Mean member score with its spread for each row: a dict of 'mean',
+        'std', 'low' and 'high' arrays (low/high are the interval quantiles
+        over the members).
+        """
+        members = self.member_scores(X)
+        low, high = np.quantile(members, interval, axis=1)
+        return {"mean": members.mean(axis=1), "std": members.std(axis=1), "low": low, "high": high}
+
+    def score_records(self, schema, records, interval=INTERVAL):
+        return self.predict(records_to_matrix(records, schema), interval)
+
+    def unusual(self, std):
+        """
+        True where the members disagree more than on 95% of the reference population.
+        """
+        return np.asarray(std) > self.report.get("spread", {}).get("p95", np.inf)
+
+    @classmethod
+    def build(cls, host, members=MEMBERS, seed=0, latency_rows=2000):
+        """
+        Train the members on class-weighted bootstrap resamples of the
+        reference population, pack them, measure the spread and the latency
+        overhead and save the result in the host directory.
+        """
+        import lightgbm as lgb
+
+        X = np.asarray(host.reference_X, dtype=np.float64)
+        y = np.asarray(host.reference_y, dtype=np.float64)
+        served = host.booster.params
+        params = {key: served[key] for key in TRAIN_PARAMS if key in served}
+        params.update({"objective": "binary", "verbose": -1})
+        rounds = int(served.get("num_iterations", host.booster.current_iteration()))
+        model_scores = np.asarray(load_reference_scores(host), dtype=np.float64)
+        weight = positive_weight(model_scores, y)
+        class_weights = np.where(y == 1, weight, 1.0)
+
+        rng = np.random.default_rng(seed)
+        started = time.perf_counter()
+        boosters = []
+        for k in range(members):
+            # Bootstrap as row weights: each row counts as often as it was drawn, positives rebalanced
+            counts = np.bincount(rng.integers(0, len(X), len(X)), minlength=len(X))
+            boosters.append(lgb.train({**params, "seed": seed + k}, lgb.Dataset(X, y, weight=counts * class_weights),
+                                      num_boost_round=rounds))
+        train_seconds = time.perf_counter() - started
+        ensemble = cls(lgb.Booster(model_str=pack_boosters(boosters)), members)
+
+        summary = ensemble.predict(X)
+        sample = X[rng.choice(len(X), min(latency_rows, len(X)), replace=False)]
+        latency = {
+            "single_row": {
+                "model": _per_row_us(host.predict_proba, sample[:1], 200),
+                "ensemble": _per_row_us(ensemble.member_scores, sample[:1], 200),
+                "members_one_by_one": _per_row_us(lambda x: [b.predict(x) for b in boosters], sample[:1], 200),
+            },
+            "batch_per_row": {
+                "model": _per_row_us(host.predict_proba, sample, 5),
+                "ensemble": _per_row_us(ensemble.member_scores, sample, 5),
+                "members_one_by_one": _per_row_us(lambda x: [b.predict(x) for b in boosters], sample, 5),
+            },
+        }
+        for timings in latency.values():
+            timings["overhead"] = timings["ensemble"] / timings["model"]
+
+        ensemble.report = {
+            "model_version": host.version,
+            "members": members,
+            "rounds": rounds,
+            "trees": int(ensemble.booster.num_trees()),
+            "params": params,
+            "positive_weight": weight,
+            "seed": seed,
+            "interval": list(INTERVAL),
+            "train_seconds": round(train_seconds, 1),
+            "spread": {
+                "median": float(np.median(summary["std"])),
+                "p95": float(np.quantile(summary["std"], 0.95)),
+                "max": float(summary["std"].max()),
+            },
+            "mean_score": {"model": float(model_scores.mean()), "ensemble": float(summary["mean"].mean()),
+                           "observed_rate": float(y.mean())},
+            "mean_abs_diff_vs_model": float(np.abs(summary["mean"] - model_scores).mean()),
+            "max_mean_abs_diff": MAX_MEAN_ABS_DIFF,
+            "latency_us": latency,
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        ensemble.report["matches_model"] = ensemble.report["mean_abs_diff_vs_model"] <= MAX_MEAN_ABS_DIFF
+        ensemble.save(host.host_dir)
+        return ensemble
+
+    def save(self, host_dir):
+        path = os.path.join(host_dir, BOOSTER_FILE)
+        self.booster.save_model(f"{path}.tmp-{os.getpid()}")
+        os.replace(f"{path}.tmp-{os.getpid()}", path)
+        # report goes last: its presence marks the ensemble as complete
+        report_path = os.path.join(host_dir, REPORT_FILE)
+        with open(f"{report_path}.tmp-{os.getpid()}", "w") as f:
+            json.dump(self.report, f, indent=2)
+        os.replace(f"{report_path}.tmp-{os.getpid()}", report_path)
+
+    @classmethod
+    def load(cls, host):
+        """
+        Ensemble stored with the host, or None if none was trained for the
+        host's model version or it does not reproduce the model (training
+        is an offline step, see main()).
+        """
+        import lightgbm as lgb
+
+        report_path = os.path.join(host.host_dir, REPORT_FILE)
+        if not os.path.exists(report_path):
+            return None
+        with open(report_path) as f:
+            report = json.load(f)
+        if report.get("model_version") != host.version or not report.get("matches_model"):
+            return None
+        booster = lgb.Booster(model_file=os.path.join(host.host_dir, BOOSTER_FILE))
+        return cls(booster, report["members"], report)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Train the bagged ensemble used for prediction uncertainty.")
+    parser.add_argument("--host-dir", default=HOST_DIR)
+    parser.add_argument("--members", type=int, default=MEMBERS)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.members < 2:
+        parser.error("--members must be at least 2")
+
+    host = attach_host(args.host_dir)
+    ensemble = Ensemble.build(host, args.members, args.seed)
+    report = ensemble.report
+    print(f"{report['members']} members x {report['rounds']} rounds = {report['trees']:,} trees, "
+          f"positive rows weighted {report['positive_weight']:.2f}x, trained in {report['train_seconds']:.1f}s")
+    mean_score = report["mean_score"]
+    print(f"Mean score on the reference population: model {mean_score['model']:.4f}, "
+          f"ensemble {mean_score['ensemble']:.4f} (observed rate {mean_score['observed_rate']:.4f})")
+    spread = report["spread"]
+    print(f"Member spread (std): median {spread['median']:.4f}, 95th percentile {spread['p95']:.4f}; "
+          f"mean |ensemble - model| {report['mean_abs_diff_vs_model']:.4f}")
+    print(f"\n{'latency':<16}{'model':>10}{'packed':>11}{'one by one':>13}{'overhead':>10}")
+    for name, timings in report["latency_us"].items():
+        print(f"{name:<16}{timings['model']:>8.1f}µs{timings['ensemble']:>9.1f}µs"
+              f"{timings['members_one_by_one']:>11.1f}µs{timings['overhead']:>9.1f}x")
+    if not report["matches_model"]:
+        print(f"⚠️  The members do not reproduce the served model (mean |diff| above {MAX_MEAN_ABS_DIFF}); "
+              f"was it trained on this reference data? The ensemble is saved but the app will not use it.")
+        return
+    print(f"✅ Ensemble written to {args.host_dir}")
+
+
+if __name__ == "__main__":
+    main()
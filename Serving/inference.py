@@ -0,0 +1,167 @@
+"""
+Shared inference path.
+
+Scores compact patient records (see patient_record.py) with either a
+ModelHost or a plain LGBMClassifier. Single-patient calls from the app go
+through a small LRU result cache keyed on the raw record bytes, so reruns
+with unchanged sidebar inputs never touch the model.
+"""
+
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Data preprocess'))
+
+from patient_record import records_from_dicts, records_to_matrix
+
+
+REFERENCE_SCORES_FILE = "reference_scores.npy"
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache of positive-class probabilities keyed by
+    model version and record bytes.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def predict_positive(model, X):
+    """
+    Positive-class probability for each row of a model input matrix.
+    """
+    return np.asarray(model.predict_proba(X))[:, 1]
+
+
+def score_records(model, schema, records, cache=None):
+    """
+    Score a structured array of patient records in one model call.
+    Rows already in the cache are not rescored.
+    """
+    if cache is None:
+        return predict_positive(model, records_to_matrix(records, schema))
+
+    # Keys carry the model version so a hot-swapped model never serves stale scores
+    version = getattr(model, 'version', '')
+    keys = [(version, r.tobytes()) for r in records]
+    scores = np.empty(len(records), dtype=np.float64)
+    todo = []
+    for i, key in enumerate(keys):
+        cached = cache.get(key)
+        if cached is None:
+            todo.append(i)
+        else:
+            scores[i] = cached
+    if todo:
+        fresh = predict_positive(model, records_to_matrix(records[todo], schema))
+        scores[todo] = fresh
+        for i, value in zip(todo, fresh.tolist()):
+            cache.put(keys[i], value)
+    return scores
+
+
+def score_batch(model, schema, records, validator=None, monitor=None, chunk_size=65536):
+    """
+    Score a large batch, chunk by chunk so the model input matrix stays
+    bounded. With a validator, invalid rows are skipped instead of aborting
+    the job: their score is NaN and the ValidationResult says why. A
+    DriftMonitor, if given, is updated with the whole batch.
+    Returns (scores, validation_result_or_None).
+    """
+    result = validator.validate(records) if validator is not None else None
+    if monitor is not None:
+        monitor.update(records, result)
+    valid_idx = np.flatnonzero(result.valid) if result is not None else np.arange(len(records))
+
+    scores = np.full(len(records), np.nan, dtype=np.float64)
+    for start in range(0, len(valid_idx), chunk_size):
+        idx = valid_idx[start:start + chunk_size]
+        scores[idx] = predict_positive(model, records_to_matrix(records[idx], schema))
+    return scores, result
+
+
+def score_matrix(model, X, chunk_size=65536):
+    """
+    Positive-class probabilities for an already-encoded matrix, in chunks.
+    """
+    scores = np.empty(len(X), dtype=np.float64)
+    for start in range(0, len(X), chunk_size):
+        scores[start:start + chunk_size] = predict_positive(model, X[start:start + chunk_size])
+    return scores
+
+
+def load_reference_scores(host):
+    """
+    Model scores for the whole reference population, computed once and
+    cached as reference_scores.npy in the host directory (memory-mapped on
+    later calls). The host directory is rebuilt when the model changes, so
+    the cache can never outlive the model that produced it.
+    """
+    path = os.path.join(host.host_dir, REFERENCE_SCORES_FILE)
+    if not os.path.exists(path):
+        scores = score_matrix(host, host.reference_X).astype(np.float32)
+        tmp_path = f"{path}.tmp-{os.getpid()}.npy"
+        try:
+            np.save(tmp_path, scores)
+            os.replace(tmp_path, path)
+        except OSError:
+            # Read-only host directory: serve the in-memory copy
+            return scores
+    return np.load(path, mmap_mode='r')
+
+
+def labelled_scores(model, schema, csv_path):
+    """
+    (scores, labels) of a labelled patient CSV scored through the batch
+    path. Rows failing validation are dropped.
+    """
+    import pandas as pd
+
+    from feature_schema import TARGET_COLUMN
+    from patient_record import records_from_frame
+    from validation import RecordValidator
+
+    df = pd.read_csv(csv_path)
+    scores, _ = score_batch(model, schema, records_from_frame(df, schema), validator=RecordValidator(schema))
+    valid = ~np.isnan(scores)
+    return scores[valid], (df[TARGET_COLUMN] == "Yes").to_numpy()[valid]
+
+
+def score_patient(model, schema, user_input, cache=None):
+    """
+    Score one patient dict, returning its positive-class probability.
+    """
+    return float(score_records(model, schema, records_from_dicts([user_input], schema), cache)[0])
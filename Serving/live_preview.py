@@ -0,0 +1,172 @@
+"""
+Debounced live risk preview.
+
+While a user drags sliders, every change reruns the app script. In live
+mode the script only hands the current inputs to a LivePreview and returns;
+a background worker scores them once the inputs have been still for the
+debounce interval. Inputs superseded before then are dropped unscored, and
+inputs identical to the last ones scored for a session are not resubmitted.
+Everything ready at once (across sessions) is scored in one model call through
+the shared inference path, with the shared result cache, so a later press of
+"Predict" for the same inputs never touches the model again. The high/low
+call is made by cascade.decide(), with the same cascade and threshold as
+Predict, so the live gauge and the prediction never disagree.
+
+The app polls result() from a fragment that reruns on its own, so the
+preview updates without blocking or rerunning the rest of the page.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Data preprocess'))
+
+from cascade import THRESHOLD, decide
+from patient_record import records_from_dicts
+
+
+DEBOUNCE_SECONDS = 0.4
+MAX_SESSIONS = 1024
+
+
+class LivePreview:
+    """
+    Latest-wins background scoring of in-progress inputs, per session key.
+    """
+
+    def __init__(self, model, schema, cache=None, validator=None, cascade=None, threshold=THRESHOLD,
+                 debounce=DEBOUNCE_SECONDS, max_sessions=MAX_SESSIONS):
+        self.model = model
+        self.schema = schema
+        self.cache = cache
+        self.validator = validator
+        self.cascade = cascade
+        self.threshold = threshold
+        self.debounce = debounce
+        self.max_sessions = max_sessions
+        self.submitted = 0
+        self.scored = 0
+        self.dropped = 0
+
+        self._pending = {}              # key -> (seq, submitted_at, inputs)
+        self._results = OrderedDict()   # key -> latest result, least recently updated first
+        self._seq = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="live-preview", daemon=True)
+        self._thread.start()
+
+    def submit(self, key, user_input):
+        """
+        Queue a session's current inputs, replacing any not yet scored.
+        Returns immediately.
+        """
+        user_input = dict(user_input)
+        with self._condition:
+            if self._closed:
+                return
+            last = self._results.get(key)
+            if key not in self._pending and last is not None and last["input"] == user_input:
+                return
+            if key in self._pending:
+                self.dropped += 1
+            self._seq += 1
+            self.submitted += 1
+            self._pending[key] = (self._seq, time.monotonic(), user_input)
+            self._condition.notify()
+
+    def result(self, key):
+        """
+        Latest scored result of a session: a dict with 'high_risk' (None if
+        the inputs were invalid), 'risk' (raw model score, None if invalid
+        or decided by the pre-screen alone), 'errors', 'input' and
+        'latency_ms', or None if nothing has been scored yet.
+        """
+        with self._condition:
+            return self._results.get(key)
+
+    def is_pending(self, key):
+        with self._condition:
+            return key in self._pending
+
+    def stats(self):
+        with self._condition:
+            return {"submitted": self.submitted, "scored": self.scored, "dropped": self.dropped,
+                    "pending": len(self._pending)}
+
+    def close(self):
+        """
+        Stop the worker; inputs not yet scored are discarded.
+        """
+        with self._condition:
+            self._closed = True
+            self._pending.clear()
+            self._condition.notify()
+        self._thread.join()
+
+    def _ready(self):
+        # Sessions whose inputs have been still for the debounce interval, or the wait until the next one is
+        now = time.monotonic()
+        ready = [key for key, (_, submitted_at, _) in self._pending.items() if now - submitted_at >= self.debounce]
+        if ready:
+            return [(key, *self._pending.pop(key)) for key in ready], 0.0
+        return [], min(submitted_at for _, submitted_at, _ in self._pending.values()) + self.debounce - now
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if self._closed:
+                        return
+                    if not self._pending:
+                        self._condition.wait()
+                        continue
+                    batch, wait = self._ready()
+                    if batch:
+                        break
+                    self._condition.wait(timeout=wait)
+            results = self._score(batch)
+            with self._condition:
+                for key, result in results.items():
+                    self._results[key] = result
+                    self._results.move_to_end(key)
+                while len(self._results) > self.max_sessions:
+                    self._results.popitem(last=False)
+                self.scored += len(results)
+
+    def _score(self, batch):
+        started = time.perf_counter()
+        risks, errors = np.full(len(batch), np.nan), [[] for _ in batch]
+        high_risk, decided = np.zeros(len(batch), dtype=bool), np.zeros(len(batch), dtype=bool)
+        try:
+            records = records_from_dicts([user_input for _, _, _, user_input in batch], self.schema)
+            validation = self.validator.validate(records) if self.validator is not None else None
+            valid = np.flatnonzero(validation.valid) if validation is not None else np.arange(len(batch))
+            if validation is not None:
+                errors = [validation.row_errors(i) for i in range(len(batch))]
+            if len(valid):
+                risks[valid], high_risk[valid], _ = decide(self.model, self.schema, records[valid], self.threshold,
+                                                           self.cascade, self.cache)
+                decided[valid] = True
+        except Exception as e:
+            # A failed preview must not kill the worker; the session sees the error
+            errors = [[str(e)] for _ in batch]
+        latency_ms = (time.perf_counter() - started) * 1000
+        return {
+            key: {
+                "seq": seq,
+                "input": user_input,
+                "risk": None if np.isnan(risk) else float(risk),
+                "high_risk": bool(high) if done else None,
+                "errors": row_errors,
+                "latency_ms": latency_ms,
+            }
+            for (key, seq, _, user_input), risk, high, done, row_errors
+            in zip(batch, risks.tolist(), high_risk.tolist(), decided.tolist(), errors)
+        }
@@ -0,0 +1,239 @@
+"""
+Load generator for sizing replicas.
+
+Two modes, both running N concurrent simulated users in one process (which
+is how a single Streamlit container serves sessions: one script thread per
+rerun):
+
+    app        each user opens its own app session through Streamlit's
+               AppTest, changes a few sidebar widgets (one rerun each, as in
+               the browser) and presses predict
+    inference  each user scores random reference patients directly through
+               the shared scoring path, without the UI
+
+Reported: throughput, latency percentiles per action, errors, and a
+per-second timeline of completed requests, process CPU and RSS.
+
+    python Serving/load_test.py app --users 8 --duration 60
+    python Serving/load_test.py inference --users 16 --duration 30 --output load.json
+"""
+
+import json
+import os
+import random
+import resource
+import sys
+import threading
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'Data preprocess'))
+
+from model_host import HOST_DIR, attach_host
+from inference import score_records
+from patient_record import record_dtype
+
+APP_PATH = os.path.join(ROOT, "app.py")
+PERCENTILES = [50, 90, 95, 99]
+
+
+def _rss_mb():
+    # Current RSS from /proc where available, peak RSS elsewhere
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+class LoadRecorder:
+    """
+    Thread-safe latency samples per action plus a resource timeline.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.completed = 0
+        self.timeline = []
+
+    def record(self, action, seconds, error=None):
+        with self._lock:
+            self.latencies.setdefault(action, []).append(seconds * 1000)
+            self.completed += 1
+            if error is not None:
+                self.errors[action] = self.errors.get(action, 0) + 1
+
+    def sample_resources(self, stop, interval=1.0):
+        started = last_wall = time.perf_counter()
+        last_cpu = sum(os.times()[:2])
+        last_completed = 0
+        while not stop.wait(interval):
+            wall, cpu = time.perf_counter(), sum(os.times()[:2])
+            with self._lock:
+                completed = self.completed
+            self.timeline.append({
+                "t": round(wall - started, 2),
+                "requests_per_s": round((completed - last_completed) / (wall - last_wall), 2),
+                "cpu_percent": round((cpu - last_cpu) / (wall - last_wall) * 100, 1),
+                "rss_mb": round(_rss_mb(), 1),
+            })
+            last_wall, last_cpu, last_completed = wall, cpu, completed
+
+    def summary(self, elapsed):
+        actions = {}
+        for action, values in self.latencies.items():
+            values = np.asarray(values)
+            actions[action] = {
+                "count": len(values),
+                "errors": self.errors.get(action, 0),
+                "throughput_per_s": round(len(values) / elapsed, 2),
+                "mean_ms": round(float(values.mean()), 2),
+                **{f"p{p}_ms": round(float(np.percentile(values, p)), 2) for p in PERCENTILES},
+                "max_ms": round(float(values.max()), 2),
+            }
+        return {
+            "elapsed_s": round(elapsed, 2),
+            "throughput_per_s": round(self.completed / elapsed, 2) if elapsed else 0.0,
+            "actions": actions,
+            "peak_rss_mb": max((s["rss_mb"] for s in self.timeline), default=round(_rss_mb(), 1)),
+            "mean_cpu_percent": round(float(np.mean([s["cpu_percent"] for s in self.timeline])), 1) if self.timeline else 0.0,
+            "timeline": self.timeline,
+        }
+
+
+def _random_widget_change(at, rng):
+    """
+    Change one random sidebar widget of an AppTest session.
+    """
+    widgets = list(at.sidebar.selectbox) + list(at.sidebar.slider) + list(at.sidebar.number_input)
+    if not widgets:
+        widgets = list(at.selectbox) + list(at.slider) + list(at.number_input)
+    widget = rng.choice(widgets)
+    if getattr(widget, "options", None):
+        widget.set_value(rng.choice(widget.options))
+    else:
+        widget.set_value(type(widget.value)(rng.uniform(widget.min, widget.max)))
+
+
+def app_user(recorder, stop, seed, changes_per_predict=2, timeout=120):
+    from streamlit.testing.v1 import AppTest
+
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout).run()
+    recorder.record("session_start", time.perf_counter() - started, at.exception[0].value if at.exception else None)
+
+    while not stop.is_set():
+        action, started = "widget_change", time.perf_counter()
+        try:
+            for _ in range(changes_per_predict):
+                _random_widget_change(at, rng)
+                started = time.perf_counter()
+                at.run()
+                recorder.record(action, time.perf_counter() - started, at.exception[0].value if at.exception else None)
+            action, started = "predict", time.perf_counter()
+            at.button[0].click().run()
+            error = at.exception[0].value if at.exception else (at.error[0].value if at.error else None)
+            recorder.record(action, time.perf_counter() - started, error)
+        except Exception as e:
+            # A timed-out or broken session counts as an error; keep the user going
+            recorder.record(action, time.perf_counter() - started, str(e))
+
+
+def inference_user(recorder, stop, seed, host, batch_size=1):
+    rng = np.random.default_rng(seed)
+    schema = host.schema
+    X = host.reference_X
+    dtype = record_dtype(schema)
+    while not stop.is_set():
+        rows = np.asarray(X[rng.integers(0, len(X), batch_size)])
+        records = np.empty(batch_size, dtype=dtype)
+        for i, col in enumerate(schema.columns):
+            records[col] = rows[:, i]
+        started = time.perf_counter()
+        try:
+            score_records(host, schema, records)
+            error = None
+        except Exception as e:
+            error = str(e)
+        recorder.record("score", time.perf_counter() - started, error)
+
+
+def run_load(mode, users=4, duration=30.0, ramp=0.0, host_dir=HOST_DIR, batch_size=1, changes_per_predict=2):
+    """
+    Run the load test and return the summary dictionary.
+    """
+    recorder = LoadRecorder()
+    stop = threading.Event()
+    if mode == "inference":
+        host = attach_host(host_dir)
+        target, extra = inference_user, {"host": host, "batch_size": batch_size}
+    else:
+        target, extra = app_user, {"changes_per_predict": changes_per_predict}
+
+    sampler = threading.Thread(target=recorder.sample_resources, args=(stop,), daemon=True)
+    sampler.start()
+    started = time.perf_counter()
+    threads = []
+    for i in range(users):
+        thread = threading.Thread(target=target, args=(recorder, stop, i), kwargs=extra, name=f"load-user-{i}", daemon=True)
+        thread.start()
+        threads.append(thread)
+        if ramp:
+            time.sleep(ramp / users)
+    time.sleep(max(0.0, duration - (time.perf_counter() - started)))
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    sampler.join()
+
+    summary = recorder.summary(elapsed)
+    summary.update({"mode": mode, "users": users, "duration_s": duration})
+    return summary
+
+
+def print_summary(summary):
+    print(f"{summary['mode']}: {summary['users']} users, {summary['elapsed_s']} s, "
+          f"{summary['throughput_per_s']} requests/s, mean CPU {summary['mean_cpu_percent']}%, "
+          f"peak RSS {summary['peak_rss_mb']} MB")
+    header = f"{'action':<15}{'count':>8}{'errors':>8}{'req/s':>9}" + "".join(f"{f'p{p} ms':>10}" for p in PERCENTILES) + f"{'max ms':>10}"
+    print(header)
+    for action, stats in summary["actions"].items():
+        print(f"{action:<15}{stats['count']:>8}{stats['errors']:>8}{stats['throughput_per_s']:>9}"
+              + "".join(f"{stats[f'p{p}_ms']:>10}" for p in PERCENTILES) + f"{stats['max_ms']:>10}")
+    print(f"\n{'t (s)':>7}{'req/s':>9}{'CPU %':>8}{'RSS MB':>9}")
+    for sample in summary["timeline"]:
+        print(f"{sample['t']:>7}{sample['requests_per_s']:>9}{sample['cpu_percent']:>8}{sample['rss_mb']:>9}")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Simulate concurrent users against the app or the scoring path.")
+    parser.add_argument("mode", choices=["app", "inference"])
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument("--ramp", type=float, default=0.0, help="seconds to start all users")
+    parser.add_argument("--batch-size", type=int, default=1, help="records per call (inference mode)")
+    parser.add_argument("--changes", type=int, default=2, help="widget changes per predict (app mode)")
+    parser.add_argument("--host-dir", default=HOST_DIR)
+    parser.add_argument("--output", help="write the full summary as JSON")
+    args = parser.parse_args()
+
+    summary = run_load(args.mode, args.users, args.duration, args.ramp, args.host_dir, args.batch_size, args.changes)
+    print_summary(summary)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"✅ Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+"""
+Shared model/data host.
+
+Every Streamlit replica used to unpickle its own copy of best_lgb.pkl and read
+its own copy of CVD_2021_BRFSS.csv. The host builds a directory of read-only
+artifacts once per machine instead:
+
+    <host_dir>/
+        manifest.json      feature schema, dataset statistics, model version, source fingerprints
+        booster.txt        LightGBM model in native text format
+        reference_X.npy    encoded reference feature matrix (float32)
+        reference_y.npy    reference target (uint8)
+
+plus the artifacts derived from the model and reference data alone, built
+with the host so that no request ever has to: reference scores, risk
+percentiles, the cohort index, the population cube and the cascade
+pre-screen (see _build_derived). Calibration and the uncertainty ensemble
+are trained offline with their own scripts.
+
+The manifest may also carry the model's operating point (decision
+threshold and its expected sensitivity/specificity), written by
+threshold_optimizer.py; without one the threshold is 0.5. A rebuild for the
+same model version keeps the operating point, calibration and ensemble; a
+new model drops them with a warning.
+
+host_dir is a symlink to the current build (<host_dir>.v-<stamp>), so a
+rebuild replaces it with one atomic os.replace and a worker attaching
+meanwhile sees either the old build or the new one, never no host.
+
+Workers attach with np.load(mmap_mode='r'), so the reference tables live once
+in the page cache and are shared by every process on the host. Point
+HEART_HOST_DIR at /dev/shm to keep them in shared memory outright.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Data preprocess'))
+
+from feature_schema import TARGET_COLUMN, FeatureSchema
+from patient_record import records_from_frame, records_to_matrix
+
+
+MODEL_PATH = os.environ.get("HEART_MODEL_PATH", os.path.join("models", "best_lgb.pkl"))
+DATASET_PATH = os.environ.get("HEART_DATASET_PATH", os.path.join("dataset", "CVD_2021_BRFSS.csv"))
+HOST_DIR = os.environ.get("HEART_HOST_DIR", os.path.join("models", "host"))
+
+MANIFEST_FILE = "manifest.json"
+BOOSTER_FILE = "booster.txt"
+REFERENCE_X_FILE = "reference_X.npy"
+REFERENCE_Y_FILE = "reference_y.npy"
+DEFAULT_THRESHOLD = 0.5
+# Trained offline for one model version (calibration.py, ensemble.py)
+OFFLINE_FILES = ("calibration.npy", "calibration.json", "ensemble.txt", "ensemble.json")
+
+logger = logging.getLogger(__name__)
+
+
+def _fingerprint(path):
+    st = os.stat(path)
+    return {"path": os.path.abspath(path), "size": st.st_size, "mtime": int(st.st_mtime)}
+
+
+def _load_classifier(model_path):
+    """
+    Load the pickled LGBMClassifier, trying the same fallbacks as app.py.
+    """
+    import pickle
+
+    loaders = [
+        lambda: pickle.load(open(model_path, 'rb')),
+        lambda: pickle.load(open(model_path, 'rb'), encoding='latin1'),
+        lambda: __import__('joblib').load(model_path),
+    ]
+    last_error = None
+    for loader in loaders:
+        try:
+            return loader()
+        except Exception as e:
+            last_error = e
+    raise RuntimeError(f"Could not load model from {model_path}: {last_error}")
+
+
+def _build_derived(host_dir):
+    """
+    Build the derived artifacts into a host directory before it is swapped
+    into place. An artifact whose optional dependencies are missing is
+    skipped; the app then runs without that feature.
+    """
+    sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Analytics'))
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from inference import load_reference_scores
+
+    host = ModelHost(host_dir)
+    load_reference_scores(host)
+    for module, build in (
+        ("risk_percentile", lambda m: m.RiskPercentiles.build(host)),
+        ("cohort_index", lambda m: m.CohortIndex.build(host)),
+        ("population_cube", lambda m: m.save_cube(m.build_cube(host), host)),
+        ("cascade", lambda m: m.Cascade.build(host)),
+    ):
+        try:
+            build(__import__(module))
+        except ImportError:
+            pass
+
+
+def build_host(model_path=MODEL_PATH, dataset_path=DATASET_PATH, host_dir=HOST_DIR):
+    """
+    Build the host directory from the pickled model and the dataset.
+
+    The artifacts are written to a private temporary directory and renamed
+    into place, so concurrent workers never see a half-written host.
+    Returns the manifest dict.
+    """
+    import pandas as pd
+
+    host_dir = os.path.normpath(host_dir)
+    tmp_dir = f"{host_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    try:
+        df = pd.read_csv(dataset_path)
+        schema = FeatureSchema.from_dataframe(df)
+
+        reference_X = records_to_matrix(records_from_frame(df, schema), schema, dtype=np.float32)
+        np.save(os.path.join(tmp_dir, REFERENCE_X_FILE), reference_X)
+        np.save(os.path.join(tmp_dir, REFERENCE_Y_FILE), (df[TARGET_COLUMN] == "Yes").to_numpy(dtype=np.uint8))
+
+        model = _load_classifier(model_path)
+        booster = getattr(model, "booster_", model)
+        booster_path = os.path.join(tmp_dir, BOOSTER_FILE)
+        booster.save_model(booster_path)
+        with open(booster_path, 'rb') as f:
+            model_version = hashlib.sha256(f.read()).hexdigest()[:12]
+
+        heart_disease_cases = int((df[TARGET_COLUMN] == "Yes").sum())
+        manifest = {
+            "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "model_version": model_version,
+            "schema": schema.to_dict(),
+            "stats": {
+                "total_records": len(df),
+                "heart_disease_cases": heart_disease_cases,
+            },
+            "sources": {
+                "model": _fingerprint(model_path),
+                "dataset": _fingerprint(dataset_path),
+            },
+        }
+        _carry_over(host_dir, tmp_dir, manifest)
+        # manifest goes last: its presence marks the directory as complete
+        with open(os.path.join(tmp_dir, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f, indent=2)
+        _build_derived(tmp_dir)
+
+        _swap_into_place(tmp_dir, host_dir)
+        return manifest
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _carry_over(host_dir, tmp_dir, manifest):
+    """
+    Keep what was produced offline for the previous build when the model
+    version is unchanged: the operating point (added to manifest) and the
+    calibration and ensemble files (copied to tmp_dir). For a new model they
+    no longer apply and are dropped, with a warning.
+    """
+    try:
+        with open(os.path.join(host_dir, MANIFEST_FILE)) as f:
+            previous = json.load(f)
+    except (OSError, ValueError):
+        return
+    offline = [name for name in OFFLINE_FILES if os.path.exists(os.path.join(host_dir, name))]
+    if previous.get("model_version") != manifest["model_version"]:
+        if previous.get("operating_point") or offline:
+            logger.warning("Model changed (%s -> %s): its operating point, calibration and ensemble were dropped; "
+                           "the threshold is %.2f until threshold_optimizer.py is re-run",
+                           previous.get("model_version"), manifest["model_version"], DEFAULT_THRESHOLD)
+        return
+    if previous.get("operating_point"):
+        manifest["operating_point"] = previous["operating_point"]
+    for name in offline:
+        shutil.copy2(os.path.join(host_dir, name), os.path.join(tmp_dir, name))
+    logger.info("Kept the operating point and %d offline artifact(s) of model %s",
+                len(offline), manifest["model_version"])
+
+
+def _swap_into_place(tmp_dir, host_dir):
+    """
+    Point the host_dir symlink at the freshly built tmp_dir in one atomic
+    os.replace. Attached workers keep their mmaps to the old files after the
+    old build is removed.
+    """
+    target = f"{host_dir}.v-{time.strftime('%Y%m%d%H%M%S')}-{time.time_ns() % 10**9:09d}-{os.getpid()}"
+    os.rename(tmp_dir, target)
+    previous = os.path.realpath(host_dir) if os.path.islink(host_dir) else None
+    if os.path.isdir(host_dir) and previous is None:
+        # A host built before the symlink layout: move it aside once
+        legacy = f"{host_dir}.old-{os.getpid()}"
+        os.rename(host_dir, legacy)
+        previous = legacy
+    link = f"{host_dir}.link-{os.getpid()}"
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(os.path.basename(target), link)
+    os.replace(link, host_dir)
+    if previous is not None and previous != os.path.realpath(target):
+        shutil.rmtree(previous, ignore_errors=True)
+
+
+def _is_stale(manifest, model_path, dataset_path):
+    sources = manifest.get("sources", {})
+    for key, path in (("model", model_path), ("dataset", dataset_path)):
+        if not os.path.exists(path):
+            continue
+        current = _fingerprint(path)
+        recorded = sources.get(key, {})
+        if (current["size"], current["mtime"]) != (recorded.get("size"), recorded.get("mtime")):
+            return True
+    return False
+
+
+class ModelHost:
+    """
+    Read-only view of a host directory. Exposes predict/predict_proba with
+    the same shape as the sklearn LGBMClassifier it replaces.
+    """
+
+    def __init__(self, host_dir=HOST_DIR):
+        import lightgbm as lgb
+
+        self.host_dir = host_dir
+        with open(os.path.join(host_dir, MANIFEST_FILE)) as f:
+            self.manifest = json.load(f)
+        self.schema = FeatureSchema.from_dict(self.manifest["schema"])
+        self.stats = self.manifest["stats"]
+        self.version = self.manifest.get("model_version", "unknown")
+        self.operating_point = self.manifest.get("operating_point") or {}
+        self.threshold = float(self.operating_point.get("threshold", DEFAULT_THRESHOLD))
+        self.booster = lgb.Booster(model_file=os.path.join(host_dir, BOOSTER_FILE))
+        self._reference_X = None
+        self._reference_y = None
+
+    @property
+    def reference_X(self):
+        if self._reference_X is None:
+            self._reference_X = np.load(os.path.join(self.host_dir, REFERENCE_X_FILE), mmap_mode='r')
+        return self._reference_X
+
+    @property
+    def reference_y(self):
+        if self._reference_y is None:
+            self._reference_y = np.load(os.path.join(self.host_dir, REFERENCE_Y_FILE), mmap_mode='r')
+        return self._reference_y
+
+    def predict_proba(self, X):
+        positive = self.booster.predict(np.asarray(X, dtype=np.float64))
+        return np.column_stack([1.0 - positive, positive])
+
+    def predict(self, X):
+        return (self.predict_proba(X)[:, 1] > self.threshold).astype(int)
+
+
+def save_operating_point(host_dir, operating_point):
+    """
+    Record the decision threshold (and its metrics) in the host manifest.
+    Workers pick it up the next time they attach.
+    """
+    manifest_path = os.path.join(host_dir, MANIFEST_FILE)
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    manifest["operating_point"] = operating_point
+    tmp_path = f"{manifest_path}.tmp-{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+    return manifest
+
+
+def attach_host(host_dir=HOST_DIR, model_path=MODEL_PATH, dataset_path=DATASET_PATH, build=True):
+    """
+    Attach to the shared host, building it first if it is missing or its
+    source files have changed since it was built.
+    """
+    manifest_path = os.path.join(host_dir, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if not (build and _is_stale(manifest, model_path, dataset_path)):
+            return ModelHost(host_dir)
+    if not build:
+        raise FileNotFoundError(f"No model host at {host_dir}")
+    build_host(model_path, dataset_path, host_dir)
+    return ModelHost(host_dir)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the shared model/data host directory.")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--dataset", default=DATASET_PATH)
+    parser.add_argument("--host-dir", default=HOST_DIR)
+    args = parser.parse_args()
+
+    manifest = build_host(args.model, args.dataset, args.host_dir)
+    print(f"✅ Model host built at {args.host_dir} "
+          f"({manifest['stats']['total_records']:,} reference records)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,490 @@
+"""
+Versioned model registry with hot-swap and shadow scoring.
+
+    <registry>/
+        <version>/model.pkl     registered model (immutable)
+        <version>/meta.json     source, registration time
+        state.json              {"active": ..., "shadow": {"version": ..., "fraction": ...}}
+        shadow_stats/<primary>-<candidate>-<pid>.json
+                                per-process shadow latency/agreement statistics
+        load_errors/<pid>.json  versions a serving process failed to attach, and why
+
+Each version gets its own model host under HEART_VERSION_HOST_DIR/<version>
+(default: a sibling of HEART_HOST_DIR, so rebuilding the default host never
+removes them).
+ModelRouter polls state.json and, when the active version changes, attaches
+the new host on a background thread and swaps it in with a single reference
+assignment: requests already holding the old host finish on it, new requests
+get the new one, nothing is dropped. When a shadow candidate is configured, a
+fraction of traffic is re-scored with it on a background worker and compared
+with the primary score, without adding latency to the response.
+
+    python Serving/model_registry.py register models/new_lgb.pkl
+    python Serving/model_registry.py activate <version>
+    python Serving/model_registry.py shadow <version> --fraction 0.1
+    python Serving/model_registry.py status
+"""
+
+import atexit
+import glob
+import hashlib
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from model_host import DATASET_PATH, DEFAULT_THRESHOLD, HOST_DIR, MODEL_PATH, attach_host
+from inference import score_records
+
+
+REGISTRY_DIR = os.environ.get("HEART_REGISTRY_DIR", os.path.join("models", "registry"))
+VERSION_HOST_DIR = os.environ.get("HEART_VERSION_HOST_DIR", f"{HOST_DIR.rstrip(os.sep)}-versions")
+
+STATE_FILE = "state.json"
+MODEL_FILE = "model.pkl"
+META_FILE = "meta.json"
+SHADOW_STATS_DIR = "shadow_stats"
+LOAD_ERRORS_DIR = "load_errors"
+
+logger = logging.getLogger(__name__)
+
+# Candidate latency histogram bucket upper bounds (ms)
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, float("inf")]
+
+
+def _write_json(path, data):
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class ModelRegistry:
+    """
+    Directory of immutable model versions plus the serving state.
+    """
+
+    def __init__(self, root=REGISTRY_DIR):
+        self.root = root
+
+    @property
+    def state_path(self):
+        return os.path.join(self.root, STATE_FILE)
+
+    def exists(self):
+        return os.path.exists(self.state_path)
+
+    def versions(self):
+        return sorted(
+            name for name in os.listdir(self.root)
+            if os.path.exists(os.path.join(self.root, name, META_FILE))
+        ) if os.path.isdir(self.root) else []
+
+    def model_path(self, version):
+        return os.path.join(self.root, version, MODEL_FILE)
+
+    def register(self, model_path, version=None):
+        """
+        Copy a pickled model into the registry. The version defaults to a
+        content hash, so registering the same file twice is a no-op.
+        """
+        with open(model_path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()[:12]
+        version = version or digest
+        target = os.path.join(self.root, version)
+        if os.path.exists(os.path.join(target, META_FILE)):
+            return version
+
+        tmp_dir = f"{target}.tmp-{os.getpid()}"
+        os.makedirs(tmp_dir, exist_ok=True)
+        shutil.copyfile(model_path, os.path.join(tmp_dir, MODEL_FILE))
+        _write_json(os.path.join(tmp_dir, META_FILE), {
+            "version": version,
+            "sha256": digest,
+            "source": os.path.abspath(model_path),
+            "registered": time.strftime("%Y-%m-%d %H:%M:%S"),
+        })
+        os.rename(tmp_dir, target)
+        if not self.exists():
+            self.write_state({"active": version, "shadow": None})
+        return version
+
+    def read_state(self):
+        with open(self.state_path) as f:
+            return json.load(f)
+
+    def write_state(self, state):
+        os.makedirs(self.root, exist_ok=True)
+        _write_json(self.state_path, state)
+
+    def activate(self, version):
+        if version not in self.versions():
+            raise ValueError(f"Unknown model version {version!r}")
+        state = self.read_state() if self.exists() else {}
+        state["active"] = version
+        if (state.get("shadow") or {}).get("version") == version:
+            state["shadow"] = None
+        self.write_state(state)
+
+    def set_shadow(self, version, fraction):
+        if version is not None and version not in self.versions():
+            raise ValueError(f"Unknown model version {version!r}")
+        if not 0.0 <= fraction <= 1.0:
+            raise ValueError("Shadow fraction must be between 0 and 1")
+        state = self.read_state()
+        state["shadow"] = {"version": version, "fraction": fraction} if version else None
+        self.write_state(state)
+
+    def shadow_stats(self, candidate, primary=None):
+        """
+        Shadow statistics for one candidate (against one primary version,
+        if given), summed over every serving process.
+        """
+        total = None
+        for path in glob.glob(os.path.join(self.root, SHADOW_STATS_DIR, "*.json")):
+            with open(path) as f:
+                stats = json.load(f)
+            if stats["candidate"] != candidate or (primary is not None and stats["primary"] != primary):
+                continue
+            if total is None:
+                total = stats
+                continue
+            for key in ("count", "agreements", "abs_diff_sum", "latency_ms_sum"):
+                total[key] += stats[key]
+            total["abs_diff_max"] = max(total["abs_diff_max"], stats["abs_diff_max"])
+            total["latency_histogram"] = [a + b for a, b in zip(total["latency_histogram"], stats["latency_histogram"])]
+        return total
+
+    def load_errors(self):
+        """
+        {version: [error, ...]} of versions serving processes failed to attach.
+        """
+        errors = {}
+        for path in glob.glob(os.path.join(self.root, LOAD_ERRORS_DIR, "*.json")):
+            try:
+                with open(path) as f:
+                    for version, error in json.load(f).items():
+                        errors.setdefault(version, []).append(error)
+            except (OSError, ValueError):
+                continue
+        return errors
+
+
+class ShadowStats:
+    """
+    Running agreement and latency statistics for one shadow candidate.
+    """
+
+    def __init__(self, primary, candidate):
+        self.primary = primary
+        self.candidate = candidate
+        self.count = 0
+        self.agreements = 0
+        self.abs_diff_sum = 0.0
+        self.abs_diff_max = 0.0
+        self.latency_ms_sum = 0.0
+        self.latency_histogram = [0] * len(LATENCY_BUCKETS_MS)
+
+    def add(self, primary_scores, candidate_scores, latency_ms, threshold=DEFAULT_THRESHOLD, candidate_threshold=None):
+        """
+        Record one shadowed batch. Decisions are compared at each model's
+        own operating point (candidate_threshold defaults to threshold).
+        """
+        if candidate_threshold is None:
+            candidate_threshold = threshold
+        diff = np.abs(np.asarray(primary_scores) - np.asarray(candidate_scores))
+        self.count += len(diff)
+        self.agreements += int(((np.asarray(primary_scores) > threshold) ==
+                                (np.asarray(candidate_scores) > candidate_threshold)).sum())
+        self.abs_diff_sum += float(diff.sum())
+        self.abs_diff_max = max(self.abs_diff_max, float(diff.max(initial=0.0)))
+        self.latency_ms_sum += latency_ms
+        self.latency_histogram[int(np.searchsorted(LATENCY_BUCKETS_MS, latency_ms))] += 1
+
+    def to_dict(self):
+        return {
+            "primary": self.primary,
+            "candidate": self.candidate,
+            "count": self.count,
+            "agreements": self.agreements,
+            "abs_diff_sum": self.abs_diff_sum,
+            "abs_diff_max": self.abs_diff_max,
+            "latency_ms_sum": self.latency_ms_sum,
+            "latency_histogram": self.latency_histogram,
+        }
+
+
+class ModelRouter:
+    """
+    Per-process access point for the active model. Without a registry it
+    serves the single host built from HEART_MODEL_PATH, as before.
+    """
+
+    def __init__(self, registry=None, host_dir=HOST_DIR, version_host_dir=VERSION_HOST_DIR,
+                 dataset_path=DATASET_PATH, refresh_seconds=2.0):
+        self.registry = registry or ModelRegistry()
+        self.version_host_dir = version_host_dir
+        self.dataset_path = dataset_path
+        self.refresh_seconds = refresh_seconds
+
+        self._lock = threading.Lock()
+        self._state_mtime = None
+        self._last_check = 0.0
+        self._loading = set()
+        self.active_version = None
+        self._shadow = None  # (version, host, fraction, stats)
+        self._shadow_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shadow-scorer")
+        self._shadow_pending = 0
+        self._stats_written = 0.0
+        self._closed = False
+        self.load_errors = {}
+
+        if self.registry.exists():
+            state = self.registry.read_state()
+            self._state_mtime = os.stat(self.registry.state_path).st_mtime
+            self.active_version = state["active"]
+            self._host = self._attach(self.active_version)
+            self._apply_shadow(state.get("shadow"))
+        else:
+            self._host = attach_host(host_dir, MODEL_PATH, dataset_path)
+        atexit.register(self.close)
+
+    def _attach(self, version):
+        return attach_host(os.path.join(self.version_host_dir, version), self.registry.model_path(version), self.dataset_path)
+
+    def current(self):
+        """
+        The host to use for this request. Cheap: at most one stat() call
+        every refresh_seconds.
+        """
+        now = time.monotonic()
+        if self.registry.exists() and now - self._last_check >= self.refresh_seconds:
+            self._last_check = now
+            self._check_state()
+        return self._host
+
+    def _check_state(self):
+        try:
+            mtime = os.stat(self.registry.state_path).st_mtime
+            if mtime == self._state_mtime:
+                return
+            state = self.registry.read_state()
+        except (OSError, ValueError):
+            return
+        self._state_mtime = mtime
+        if state["active"] != self.active_version:
+            self._load_in_background(state["active"], self._swap_in)
+        self._apply_shadow(state.get("shadow"))
+
+    def _load_in_background(self, version, on_ready):
+        """
+        Attach (building if needed) a version's host off the request path,
+        then hand it to on_ready. Until then the current host keeps serving.
+        """
+        with self._lock:
+            if version in self._loading:
+                return
+            self._loading.add(version)
+
+        def load():
+            try:
+                host = self._attach(version)
+            except Exception as e:
+                # Keep serving the current host; the failure shows up in `status`
+                logger.exception("Could not attach model version %s", version)
+                self._record_load_error(version, f"{type(e).__name__}: {e}")
+            else:
+                self._record_load_error(version, None)
+                on_ready(version, host)
+            finally:
+                with self._lock:
+                    self._loading.discard(version)
+
+        threading.Thread(target=load, name=f"model-load-{version}", daemon=True).start()
+
+    def _record_load_error(self, version, error):
+        with self._lock:
+            if error is None and version not in self.load_errors:
+                return
+            if error is None:
+                del self.load_errors[version]
+            else:
+                self.load_errors[version] = {"error": error, "time": time.strftime("%Y-%m-%d %H:%M:%S")}
+            errors = dict(self.load_errors)
+        path = os.path.join(self.registry.root, LOAD_ERRORS_DIR, f"{os.getpid()}.json")
+        try:
+            if errors:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                _write_json(path, errors)
+            elif os.path.exists(path):
+                os.remove(path)
+        except OSError:
+            pass
+
+    def _swap_in(self, version, host):
+        # A single reference assignment: in-flight requests keep the old host
+        self._host = host
+        self.active_version = version
+        shadow = self._shadow
+        if shadow is not None:
+            # Statistics are per (primary, candidate): finish the old pair, start the new one
+            self._flush_shadow_stats(shadow[3])
+            self._shadow = (shadow[0], shadow[1], shadow[2], ShadowStats(version, shadow[0]))
+
+    def _apply_shadow(self, shadow):
+        if not shadow or not shadow.get("version"):
+            if self._shadow is not None:
+                self._flush_shadow_stats(self._shadow[3])
+            self._shadow = None
+            return
+        version, fraction = shadow["version"], float(shadow.get("fraction", 0.0))
+        if self._shadow is not None and self._shadow[0] == version:
+            self._shadow = (version, self._shadow[1], fraction, self._shadow[3])
+            return
+
+        def ready(version, host):
+            if self._shadow is not None:
+                self._flush_shadow_stats(self._shadow[3])
+            self._shadow = (version, host, fraction, ShadowStats(self.active_version, version))
+
+        self._load_in_background(version, ready)
+
+    def shadow(self, schema, records, primary_scores, max_pending=8):
+        """
+        Maybe re-score this batch with the shadow candidate in the
+        background. Returns immediately; drops the sample if the shadow
+        worker is saturated.
+        """
+        shadow = self._shadow
+        if shadow is None or self._closed or random.random() >= shadow[2]:
+            return False
+        with self._lock:
+            if self._shadow_pending >= max_pending:
+                return False
+            self._shadow_pending += 1
+
+        _, host, _, stats = shadow
+        # Rows without a primary score (decided by the pre-screen) have nothing to compare
+        scored = ~np.isnan(np.asarray(primary_scores, dtype=np.float64))
+        if not scored.any():
+            with self._lock:
+                self._shadow_pending -= 1
+            return False
+        records = np.array(records, copy=True)[scored]
+        primary_scores = np.array(primary_scores, dtype=np.float64)[scored]
+        primary_threshold = getattr(self._host, 'threshold', DEFAULT_THRESHOLD)
+
+        def run():
+            try:
+                started = time.perf_counter()
+                candidate_scores = score_records(host, schema, records)
+                stats.add(primary_scores, candidate_scores, (time.perf_counter() - started) * 1000,
+                          primary_threshold, getattr(host, 'threshold', primary_threshold))
+                self._write_shadow_stats(stats)
+            finally:
+                with self._lock:
+                    self._shadow_pending -= 1
+
+        try:
+            self._shadow_pool.submit(run)
+        except RuntimeError:
+            # Closed while this sample was being prepared
+            with self._lock:
+                self._shadow_pending -= 1
+            return False
+        return True
+
+    def _write_shadow_stats(self, stats, min_interval=1.0, force=False):
+        now = time.monotonic()
+        if not force and now - self._stats_written < min_interval:
+            return
+        self._stats_written = now
+        directory = os.path.join(self.registry.root, SHADOW_STATS_DIR)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            _write_json(os.path.join(directory, f"{stats.primary}-{stats.candidate}-{os.getpid()}.json"), stats.to_dict())
+        except OSError:
+            pass
+
+    def _flush_shadow_stats(self, stats):
+        # Queued behind any pending samples on the (single) shadow worker
+        if stats.count and not self._closed:
+            self._shadow_pool.submit(self._write_shadow_stats, stats, force=True)
+
+    def close(self):
+        """
+        Finish pending shadow samples and write the final statistics.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._shadow_pool.shutdown(wait=True)
+        shadow = self._shadow
+        if shadow is not None and shadow[3].count:
+            self._write_shadow_stats(shadow[3], force=True)
+
+    def shadow_stats(self):
+        shadow = self._shadow
+        return shadow[3].to_dict() if shadow is not None else None
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Manage the model registry.")
+    parser.add_argument("--registry", default=REGISTRY_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+    register = sub.add_parser("register", help="Add a pickled model as a new version")
+    register.add_argument("model_path")
+    register.add_argument("--version")
+    activate = sub.add_parser("activate", help="Hot-swap the active model")
+    activate.add_argument("version")
+    shadow = sub.add_parser("shadow", help="Shadow-score a fraction of traffic with a candidate")
+    shadow.add_argument("version", nargs="?")
+    shadow.add_argument("--fraction", type=float, default=0.1)
+    shadow.add_argument("--off", action="store_true")
+    sub.add_parser("status", help="Show versions, state and shadow statistics")
+    args = parser.parse_args()
+
+    registry = ModelRegistry(args.registry)
+    if args.command == "register":
+        version = registry.register(args.model_path, args.version)
+        print(f"✅ Registered model version {version}")
+    elif args.command == "activate":
+        registry.activate(args.version)
+        print(f"✅ Active model is now {args.version}")
+    elif args.command == "shadow":
+        registry.set_shadow(None if args.off else args.version, args.fraction)
+        print("✅ Shadow scoring disabled" if args.off else f"✅ Shadowing {args.version} on {args.fraction:.0%} of traffic")
+    else:
+        state = registry.read_state() if registry.exists() else {}
+        for version in registry.versions():
+            marker = "*" if version == state.get("active") else " "
+            print(f" {marker} {version}")
+        print(f"Shadow: {state.get('shadow')}")
+        stats = registry.shadow_stats((state.get("shadow") or {}).get("version"), state.get("active"))
+        if stats and stats["count"]:
+            print(f"Shadow samples: {stats['count']}, "
+                  f"agreement: {stats['agreements'] / stats['count']:.2%}, "
+                  f"mean |diff|: {stats['abs_diff_sum'] / stats['count']:.4f}, "
+                  f"max |diff|: {stats['abs_diff_max']:.4f}, "
+                  f"mean latency: {stats['latency_ms_sum'] / stats['count']:.2f} ms")
+            for bound, n in zip(LATENCY_BUCKETS_MS, stats["latency_histogram"]):
+                if n:
+                    print(f"   <= {bound:g} ms: {n}")
+        for version, errors in registry.load_errors().items():
+            print(f"⚠️  {version} failed to load in {len(errors)} process(es); last error ({errors[-1]['time']}): "
+                  f"{errors[-1]['error']}")
+
+
+if __name__ == "__main__":
+    main()
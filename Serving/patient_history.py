@@ -0,0 +1,313 @@
+"""
+Longitudinal patient history.
+
+Assessments made under a patient ID are kept in an embedded SQLite database
+so a returning patient's earlier inputs and risk scores are available:
+
+    assessments   one row per visit: patient ID, time, the compact patient
+                  record (patient_record bytes) and the schema it was encoded with
+    scores        risk of an assessment under a model version
+
+Lookups go through indexes on (patient_id, assessed_at) and on the scores'
+(assessment_id, model_version) key, so a patient's risk over time is a range
+scan, never a table scan. Writes from the prediction path are queued and
+committed in batches by a background thread, like the audit log. When the
+model version changes, rescore() scores every stored assessment under the
+new version in bulk (as it does for assessments recorded without a score,
+e.g. decided by the cascade pre-screen), so trends always compare like with like while the
+scores from earlier versions are kept.
+
+    python Serving/patient_history.py rescore
+    python Serving/patient_history.py trend P-0001
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Data preprocess'))
+
+from inference import score_records
+from patient_record import record_dtype, records_to_dicts
+
+
+# Set HEART_HISTORY_DB to an empty string to disable the history store
+HISTORY_DB = os.environ.get("HEART_HISTORY_DB", os.path.join("data", "patient_history.sqlite"))
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS assessments (
+    id            INTEGER PRIMARY KEY,
+    patient_id    TEXT    NOT NULL,
+    assessed_at   REAL    NOT NULL,
+    record        BLOB    NOT NULL,
+    schema_hash   TEXT    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS assessments_patient ON assessments (patient_id, assessed_at);
+CREATE TABLE IF NOT EXISTS scores (
+    assessment_id INTEGER NOT NULL REFERENCES assessments (id),
+    model_version TEXT    NOT NULL,
+    risk          REAL    NOT NULL,
+    PRIMARY KEY (assessment_id, model_version)
+) WITHOUT ROWID;
+"""
+
+_STOP = object()
+
+
+def schema_hash(schema):
+    """
+    Fingerprint of the record layout; records are only decoded (and
+    rescored) with the schema they were written with.
+    """
+    # Observed numeric ranges describe the data, not the layout
+    layout = {key: value for key, value in schema.to_dict().items() if key != "numeric_ranges"}
+    return hashlib.sha256(json.dumps(layout, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def _connect(path):
+    connection = sqlite3.connect(path, timeout=30.0, check_same_thread=False)
+    # WAL lets readers (other sessions, other workers) run alongside the writer
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    return connection
+
+
+class PatientHistory:
+    """
+    Per-patient assessment history with batched writes.
+    """
+
+    def __init__(self, schema, path=HISTORY_DB, batch_size=256, flush_seconds=1.0, queue_size=10000):
+        self.schema = schema
+        self.schema_hash = schema_hash(schema)
+        self.dtype = record_dtype(schema)
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.written = 0
+        self.dropped = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with _connect(path) as connection:
+            connection.executescript(SCHEMA_SQL)
+        self._local = threading.local()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._closed = False
+        self._stop_rescore = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="patient-history-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _reader(self):
+        # One read connection per thread (Streamlit runs each session in its own)
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = _connect(self.path)
+        return connection
+
+    def record(self, patient_id, records, risks, model_version, assessed_at=None):
+        """
+        Queue scored records of one patient. Never blocks: returns False
+        (and counts the drop) if the writer has fallen too far behind or
+        has been closed.
+        """
+        entry = (
+            str(patient_id),
+            time.time() if assessed_at is None else float(assessed_at),
+            np.array(records, dtype=self.dtype, copy=True),
+            np.asarray(risks, dtype=np.float64),
+            str(model_version),
+        )
+        if self._closed:
+            self.dropped += len(entry[2])
+            return False
+        try:
+            self._queue.put_nowait(entry)
+            return True
+        except queue.Full:
+            self.dropped += len(entry[2])
+            return False
+
+    def flush(self):
+        """
+        Wait until everything queued so far is committed.
+        """
+        self._queue.join()
+
+    def close(self):
+        """
+        Commit what is queued, stop the writer and end a background rescore
+        after its current chunk.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._stop_rescore.set()
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _run(self):
+        connection = _connect(self.path)
+        pending = []
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_seconds)
+            except queue.Empty:
+                item = None
+            stop = item is _STOP
+            if item is not None and not stop:
+                pending.append(item)
+            # Commit once the burst has been drained (or the batch is full)
+            if pending and (stop or len(pending) >= self.batch_size or self._queue.empty()):
+                self._write(connection, pending)
+                for _ in pending:
+                    self._queue.task_done()
+                pending = []
+            if stop:
+                self._queue.task_done()
+                connection.close()
+                return
+
+    def _write(self, connection, entries):
+        if not entries:
+            return
+        rows = 0
+        try:
+            with connection:
+                for patient_id, assessed_at, records, risks, model_version in entries:
+                    for record, risk in zip(records, risks.tolist()):
+                        cursor = connection.execute(
+                            "INSERT INTO assessments (patient_id, assessed_at, record, schema_hash) VALUES (?, ?, ?, ?)",
+                            (patient_id, assessed_at, record.tobytes(), self.schema_hash),
+                        )
+                        # An unscored assessment (NaN) is left for rescore()
+                        if risk == risk:
+                            connection.execute(
+                                "INSERT INTO scores (assessment_id, model_version, risk) VALUES (?, ?, ?)",
+                                (cursor.lastrowid, model_version, risk),
+                            )
+                        rows += 1
+            self.written += rows
+        except sqlite3.Error:
+            # History must never take the app down; the rows are counted as lost
+            self.dropped += sum(len(entry[2]) for entry in entries)
+
+    def trend(self, patient_id, model_version, since=None):
+        """
+        (assessed_at, risk) arrays for one patient under one model version,
+        oldest first.
+        """
+        query = ("SELECT a.assessed_at, s.risk FROM assessments a "
+                 "JOIN scores s ON s.assessment_id = a.id AND s.model_version = ? "
+                 "WHERE a.patient_id = ?")
+        params = [str(model_version), str(patient_id)]
+        if since is not None:
+            query += " AND a.assessed_at >= ?"
+            params.append(float(since))
+        rows = self._reader().execute(query + " ORDER BY a.assessed_at", params).fetchall()
+        if not rows:
+            return np.empty(0), np.empty(0)
+        times, risks = np.array(rows, dtype=np.float64).T
+        return times, risks
+
+    def assessments(self, patient_id, limit=None):
+        """
+        A patient's stored inputs as dicts (newest first), with 'assessed_at'.
+        """
+        query = ("SELECT assessed_at, record FROM assessments WHERE patient_id = ? AND schema_hash = ? "
+                 "ORDER BY assessed_at DESC")
+        params = [str(patient_id), self.schema_hash]
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(int(limit))
+        rows = self._reader().execute(query, params).fetchall()
+        if not rows:
+            return []
+        records = np.frombuffer(b"".join(blob for _, blob in rows), dtype=self.dtype)
+        dicts = records_to_dicts(records, self.schema)
+        for d, (assessed_at, _) in zip(dicts, rows):
+            d['assessed_at'] = assessed_at
+        return dicts
+
+    def rescore(self, model, model_version, chunk_size=50000):
+        """
+        Score every stored assessment that has no score under model_version
+        yet, chunk by chunk (keyset pagination on the assessment id).
+        Assessments written with another schema are left alone. Stops
+        between chunks once the history is closed. Returns the number of
+        assessments scored.
+        """
+        connection = _connect(self.path)
+        scored, last_id = 0, 0
+        try:
+            while not self._stop_rescore.is_set():
+                rows = connection.execute(
+                    "SELECT a.id, a.record FROM assessments a WHERE a.id > ? AND a.schema_hash = ? "
+                    "AND NOT EXISTS (SELECT 1 FROM scores s WHERE s.assessment_id = a.id AND s.model_version = ?) "
+                    "ORDER BY a.id LIMIT ?",
+                    (last_id, self.schema_hash, str(model_version), chunk_size),
+                ).fetchall()
+                if not rows:
+                    return scored
+                records = np.frombuffer(b"".join(blob for _, blob in rows), dtype=self.dtype)
+                risks = score_records(model, self.schema, records)
+                with connection:
+                    # OR IGNORE: another worker may be rescoring the same rows
+                    connection.executemany(
+                        "INSERT OR IGNORE INTO scores (assessment_id, model_version, risk) VALUES (?, ?, ?)",
+                        [(assessment_id, str(model_version), risk) for (assessment_id, _), risk in zip(rows, risks.tolist())],
+                    )
+                scored += len(rows)
+                last_id = rows[-1][0]
+            return scored
+        finally:
+            connection.close()
+
+    def rescore_in_background(self, model, model_version):
+        thread = threading.Thread(target=self.rescore, args=(model, model_version),
+                                  name="patient-history-rescore", daemon=True)
+        thread.start()
+        return thread
+
+
+def main():
+    import argparse
+
+    from model_host import HOST_DIR, attach_host
+
+    parser = argparse.ArgumentParser(description="Maintain and query the patient history store.")
+    parser.add_argument("--db", default=HISTORY_DB)
+    parser.add_argument("--host-dir", default=HOST_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rescore", help="score all history under the host's model version")
+    trend = sub.add_parser("trend", help="print a patient's risk over time")
+    trend.add_argument("patient_id")
+    args = parser.parse_args()
+
+    host = attach_host(args.host_dir)
+    history = PatientHistory(host.schema, args.db)
+    if args.command == "rescore":
+        started = time.perf_counter()
+        count = history.rescore(host, host.version)
+        print(f"✅ {count:,} assessments scored under {host.version} in {time.perf_counter() - started:.1f}s")
+    else:
+        times, risks = history.trend(args.patient_id, host.version)
+        if not len(times):
+            print(f"No assessments for {args.patient_id} under model {host.version}")
+        for t, risk in zip(times, risks):
+            print(f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(t))}  {risk:.1%}")
+    history.close()
+
+
+if __name__ == "__main__":
+    main()
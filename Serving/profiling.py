@@ -0,0 +1,185 @@
+"""
+Opt-in request profiling.
+
+A sampled fraction of requests is run under a low-overhead stack sampler
+and tracemalloc. For each profiled request two files are written to
+HEART_PROFILE_DIR:
+
+    <stamp>-<label>-<pid>-<seq>.folded      collapsed stacks ("a;b;c 12"), the
+                                             input format of flamegraph.pl and
+                                             speedscope
+    <stamp>-<label>-<pid>-<seq>.alloc.txt   top allocation sites with tracebacks
+
+    HEART_PROFILE=0.01              profile 1% of requests (0 = off, the default)
+    HEART_PROFILE_INTERVAL_MS=2     stack sampling interval
+    HEART_PROFILE_MAX_FILES=200     oldest reports are pruned beyond this
+    HEART_PROFILE_MEMORY=0          stack samples only, no allocation report
+
+Unsampled requests cost a few microseconds. tracemalloc, however, is
+process-wide: while a profiled request runs, every allocation in every
+concurrent session is traced and slowed down. Set HEART_PROFILE_MEMORY=0
+when profiling a busy process. A tracer started by someone else (e.g.
+python -X tracemalloc) is used as is and never stopped here.
+"""
+
+import collections
+import contextlib
+import glob
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+
+
+PROFILE_FRACTION = float(os.environ.get("HEART_PROFILE", "0") or 0)
+PROFILE_DIR = os.environ.get("HEART_PROFILE_DIR", os.path.join("logs", "profiles"))
+INTERVAL_MS = float(os.environ.get("HEART_PROFILE_INTERVAL_MS", "2"))
+MAX_FILES = int(os.environ.get("HEART_PROFILE_MAX_FILES", "200"))
+TRACE_MEMORY = os.environ.get("HEART_PROFILE_MEMORY", "1") != "0"
+TOP_ALLOCATIONS = 25
+TRACEBACK_FRAMES = 10
+
+_sequence = itertools.count()
+_active = threading.local()
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+_tracemalloc_owned = False
+
+
+class StackSampler:
+    """
+    Samples one thread's Python stack from a background thread and counts
+    identical stacks.
+    """
+
+    def __init__(self, thread_id, interval_ms=INTERVAL_MS):
+        self.thread_id = thread_id
+        self.interval = interval_ms / 1000.0
+        self.stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _start_tracemalloc():
+    global _tracemalloc_users, _tracemalloc_owned
+    with _tracemalloc_lock:
+        _tracemalloc_users += 1
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEBACK_FRAMES)
+            _tracemalloc_owned = True
+
+
+def _stop_tracemalloc():
+    # Concurrent profiled requests share the global tracer: the last one out
+    # stops it, and only if it was started here
+    global _tracemalloc_users, _tracemalloc_owned
+    with _tracemalloc_lock:
+        snapshot = tracemalloc.take_snapshot()
+        peak = tracemalloc.get_traced_memory()[1]
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0 and _tracemalloc_owned:
+            tracemalloc.stop()
+            _tracemalloc_owned = False
+    return snapshot, peak
+
+
+def _allocation_report(label, snapshot, peak, elapsed_ms, samples):
+    snapshot = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ])
+    stats = snapshot.statistics("traceback")
+    lines = [
+        f"request: {label}",
+        f"wall time: {elapsed_ms:.1f} ms, stack samples: {samples}",
+        f"traced peak: {peak / 1024:.1f} KiB, still allocated: {sum(s.size for s in stats) / 1024:.1f} KiB",
+        "",
+    ]
+    for rank, stat in enumerate(stats[:TOP_ALLOCATIONS], 1):
+        lines.append(f"#{rank}: {stat.size / 1024:.1f} KiB in {stat.count} blocks")
+        lines.extend(f"    {line}" for line in stat.traceback.format())
+    return "\n".join(lines) + "\n"
+
+
+def _prune(directory, max_files=MAX_FILES):
+    reports = sorted(glob.glob(os.path.join(directory, "*.folded")))
+    for path in reports[:max(0, len(reports) - max_files)]:
+        for stale in (path, path[:-len(".folded")] + ".alloc.txt"):
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+
+
+def _write(path, text):
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+@contextlib.contextmanager
+def profile_request(label, force=False, fraction=None, directory=None):
+    """
+    Profile the enclosed block for a sampled fraction of requests (always
+    when force is set). Nested calls inside a profiled block are part of the
+    outer profile. Yields the report path prefix, or None when not sampled.
+    """
+    fraction = PROFILE_FRACTION if fraction is None else fraction
+    if getattr(_active, "on", False) or not (force or (fraction > 0 and random.random() < fraction)):
+        yield None
+        return
+
+    directory = directory or PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    prefix = os.path.join(
+        directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{label}-{os.getpid()}-{next(_sequence):04d}"
+    )
+
+    _active.on = True
+    if TRACE_MEMORY:
+        _start_tracemalloc()
+    sampler = StackSampler(threading.get_ident())
+    sampler.start()
+    started = time.perf_counter()
+    try:
+        yield prefix
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        sampler.stop()
+        snapshot, peak = _stop_tracemalloc() if TRACE_MEMORY else (None, 0)
+        _active.on = False
+        try:
+            samples = sum(sampler.stacks.values())
+            if snapshot is not None:
+                _write(f"{prefix}.alloc.txt", _allocation_report(label, snapshot, peak, elapsed_ms, samples))
+            _write(f"{prefix}.folded", sampler.folded())
+            _prune(directory)
+        except OSError:
+            pass
+
@@ -0,0 +1,188 @@
+"""
+Decision-threshold optimizer.
+
+Scores a validation set once and evaluates every distinct score as a
+candidate threshold in one pass: with the scores sorted in descending
+order, cumulative sums of the labels give the true positives flagged at
+every cut-off, so sensitivity, specificity, PPV and workload (the share of
+patients flagged for follow-up) for all thresholds come out of a few vector
+operations.
+
+An operating point is then chosen by one policy:
+
+    youden             maximise sensitivity + specificity - 1 (default)
+    min-sensitivity    the highest threshold that still catches the given
+                       share of heart-disease cases
+    max-workload       the lowest threshold that flags at most the given
+                       share of patients
+
+and saved into the host manifest, where ModelHost.threshold and the app
+pick it up. Pass a labelled CSV of patients the model was not trained on as
+the validation set. Without one the host's reference population is used:
+that is the model's training data, so the metrics are in-sample and
+optimistic, a warning is printed and the operating point is marked
+in_sample.
+
+    python Serving/threshold_optimizer.py --validation-csv holdout.csv --policy min-sensitivity --target 0.8
+    python Serving/threshold_optimizer.py --validation-csv holdout.csv --output thresholds.csv --dry-run
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Data preprocess'))
+
+from model_host import HOST_DIR, attach_host, save_operating_point
+from inference import labelled_scores, load_reference_scores
+
+
+POLICIES = ('youden', 'min-sensitivity', 'max-workload')
+METRICS = ('threshold', 'sensitivity', 'specificity', 'ppv', 'workload', 'flagged', 'true_positives')
+
+
+def threshold_sweep(scores, y):
+    """
+    Metrics for every distinct cut-off between scores, highest threshold
+    first. As in serving, a patient is flagged when score > threshold; each
+    threshold sits halfway between two adjacent distinct scores. Returns a
+    dict of equal-length arrays keyed by METRICS.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    order = np.argsort(-scores, kind='stable')
+    sorted_scores = scores[order]
+    true_positives = np.cumsum(y[order])
+    # Only the last row of each run of tied scores is a real cut-off
+    cut = np.flatnonzero(np.diff(sorted_scores, append=-np.inf))
+    flagged = cut + 1
+    # Next distinct score below each cut-off (just under the lowest score for the last)
+    next_lower = np.append(sorted_scores[cut[:-1] + 1], sorted_scores[-1] - 1e-6)
+    tp = true_positives[cut]
+    positives = true_positives[-1]
+    negatives = len(scores) - positives
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {
+            'threshold': (sorted_scores[cut] + next_lower) / 2,
+            'sensitivity': tp / positives if positives else np.zeros_like(tp),
+            'specificity': 1.0 - (flagged - tp) / negatives if negatives else np.ones_like(tp),
+            'ppv': tp / flagged,
+            'workload': flagged / len(scores),
+            'flagged': flagged,
+            'true_positives': tp.astype(np.int64),
+        }
+
+
+def choose_operating_point(sweep, policy='youden', target=None):
+    """
+    Index into the sweep of the threshold the policy selects.
+    """
+    if policy == 'youden':
+        return int(np.argmax(sweep['sensitivity'] + sweep['specificity'] - 1.0))
+    if target is None:
+        raise ValueError(f"The {policy} policy needs a target")
+    if policy == 'min-sensitivity':
+        # Thresholds descend, so sensitivity rises along the sweep
+        reaching = np.flatnonzero(sweep['sensitivity'] >= target)
+        if not len(reaching):
+            raise ValueError(f"No threshold reaches a sensitivity of {target:.0%}")
+        return int(reaching[0])
+    if policy == 'max-workload':
+        within = np.flatnonzero(sweep['workload'] <= target)
+        if not len(within):
+            raise ValueError(f"Every threshold flags more than {target:.0%} of patients")
+        return int(within[-1])
+    raise ValueError(f"Unknown policy {policy!r}; expected one of {POLICIES}")
+
+
+def operating_point(sweep, index, policy, target=None, source="reference"):
+    point = {name: float(sweep[name][index]) for name in ('threshold', 'sensitivity', 'specificity', 'ppv', 'workload')}
+    point.update({
+        "policy": policy,
+        "target": target,
+        "validation": source,
+        "in_sample": source == "reference",
+        "validation_rows": int(sweep['flagged'][-1]),
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+    })
+    return point
+
+
+def validation_scores(host, validation_csv=None):
+    """
+    (scores, labels) of the validation set: a labelled CSV scored through
+    the shared batch path, or the host's cached reference scores.
+    """
+    if validation_csv is None:
+        return np.asarray(load_reference_scores(host), dtype=np.float64), np.asarray(host.reference_y)
+    return labelled_scores(host, host.schema, validation_csv)
+
+
+def write_sweep(sweep, path):
+    import csv
+
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(METRICS)
+        writer.writerows(zip(*(sweep[name].tolist() for name in METRICS)))
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Sweep decision thresholds and save the model's operating point.")
+    parser.add_argument("--host-dir", default=HOST_DIR)
+    parser.add_argument("--validation-csv", help="labelled patients to evaluate on (default: reference population)")
+    parser.add_argument("--policy", choices=POLICIES, default='youden')
+    parser.add_argument("--target", type=float, help="sensitivity or workload target for the policy")
+    parser.add_argument("--output", help="write the full sweep as CSV")
+    parser.add_argument("--dry-run", action="store_true", help="report without saving to the manifest")
+    args = parser.parse_args()
+
+    host = attach_host(args.host_dir)
+    if args.validation_csv is None:
+        print("⚠️  WARNING: no --validation-csv given. Sweeping thresholds on the reference population, which is\n"
+              "   the model's training data: the sensitivity, specificity and PPV below are IN-SAMPLE and\n"
+              "   optimistic, and so is the operating point chosen from them. Pass a labelled hold-out CSV.\n")
+    started = time.perf_counter()
+    scores, y = validation_scores(host, args.validation_csv)
+    sweep = threshold_sweep(scores, y)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    try:
+        index = choose_operating_point(sweep, args.policy, args.target)
+    except ValueError as e:
+        parser.error(str(e))
+
+    print(f"{len(sweep['threshold']):,} candidate thresholds over {len(scores):,} patients "
+          f"({int(y.sum()):,} with heart disease) in {elapsed_ms:.0f} ms")
+    print(f"\n{'threshold':>10}{'sensitivity':>13}{'specificity':>13}{'PPV':>8}{'workload':>10}{'per 1,000':>11}")
+    shown = sorted({int(np.argmin(np.abs(sweep['threshold'] - t))) for t in np.arange(0.1, 1.0, 0.1)} | {index})
+    for i in shown:
+        marker = "  ← chosen" if i == index else ""
+        print(f"{sweep['threshold'][i]:>10.3f}{sweep['sensitivity'][i]:>13.1%}{sweep['specificity'][i]:>13.1%}"
+              f"{sweep['ppv'][i]:>8.1%}{sweep['workload'][i]:>10.1%}{sweep['workload'][i] * 1000:>11.0f}{marker}")
+    if args.output:
+        write_sweep(sweep, args.output)
+        print(f"\nFull sweep written to {args.output}")
+
+    point = operating_point(sweep, index, args.policy, args.target, args.validation_csv or "reference")
+    if args.dry_run:
+        print(f"\nDry run: threshold {point['threshold']:.3f} not saved")
+        return
+    save_operating_point(host.host_dir, point)
+    print(f"\n✅ Operating point {point['threshold']:.3f} ({args.policy}"
+          f"{', in-sample' if point['in_sample'] else ''}) saved to {host.host_dir}")
+    # The pre-screen band is tuned for one threshold; retune it here rather than in a request
+    try:
+        from cascade import Cascade
+        cascade = Cascade.build(attach_host(host.host_dir))
+    except ImportError:
+        return
+    print(f"✅ Cascade retuned: {cascade.report['eval']['skip_fraction']:.1%} of patients pre-screened")
+
+
+if __name__ == "__main__":
+    main()
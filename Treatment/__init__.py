@@ -7,9 +7,19 @@ for heart disease patients.
 Available functions:
 - get_treatment_recommendations(): Returns structured treatment directory
 - generate_treatment_plan_pdf(): Generates downloadable treatment plan
+- get_treatment_plan(): Returns the directory tailored to a patient's risk factors
+- write_report_archive(): Streams styled per-patient reports into an archive
+- PlanCache: Content-addressed, pre-compressed cache of generated plans
+- CounterfactualSearch: Smallest lifestyle changes that bring a patient below the high-risk threshold
 """
 
 from .treatment import get_treatment_recommendations, generate_treatment_plan_pdf
+from .treatment_rules import TreatmentRuleEngine, get_treatment_plan
+from .report_renderer import ReportRenderer, write_report_archive
+from .plan_cache import PlanCache, export_plans
+from .counterfactual import Counterfactual, CounterfactualSearch, plan_with_targets
 
-__all__ = ['get_treatment_recommendations', 'generate_treatment_plan_pdf']
+__all__ = ['get_treatment_recommendations', 'generate_treatment_plan_pdf', 'TreatmentRuleEngine',
+           'get_treatment_plan', 'ReportRenderer', 'write_report_archive', 'PlanCache', 'export_plans',
+           'Counterfactual', 'CounterfactualSearch', 'plan_with_targets']
 __version__ = '1.0.0'
@@ -0,0 +1,290 @@
+"""
+Counterfactual "path to lower risk" search.
+
+Finds the smallest sets of realistic lifestyle changes (start exercising,
+quit smoking, lose weight, drink less, eat fewer fried potatoes, more fruit
+and vegetables) that bring a patient's predicted risk below the high-risk
+threshold. Each change only ever moves a factor in the healthy direction
+and within plausible limits (weight loss of at most 20% and never below a
+BMI of 18.5).
+
+The search goes by number of changed factors. Every combination of factors
+and change sizes at one level is encoded into one structured record batch
+(copies of the patient's record with the changed fields overwritten) and
+scored in large chunks through the shared inference path. Pruning:
+
+- sets of factors containing a set that already worked are skipped;
+- for one set of factors, only changes not dominated by a smaller change
+  that also works are kept;
+- the search stops after the first level that yields enough results, or
+  when the time budget runs out (returning what it has).
+
+Results rank by number of changes, then by total effort. A result's patient
+dict and target list can be passed to generate_treatment_plan_pdf via
+plan_with_targets().
+
+    python Treatment/counterfactual.py patients.csv --row 0
+"""
+
+import itertools
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "Serving"))
+sys.path.append(os.path.join(ROOT, "Data preprocess"))
+
+from treatment_rules import RISK_THRESHOLD
+from inference import score_records
+from patient_record import records_from_dicts
+
+
+MIN_BMI = 18.5
+WEIGHT_LOSS = (0.05, 0.10, 0.15, 0.20)
+MAX_CHANGES = 3
+TIME_BUDGET = 0.5
+BATCH_SIZE = 8192
+
+
+def _weight_options(patient):
+    try:
+        weight, height = float(patient['Weight_(kg)']), float(patient['Height_(cm)']) / 100
+    except (KeyError, TypeError, ValueError):
+        return []
+    options = []
+    for loss in WEIGHT_LOSS:
+        target = round(weight * (1 - loss), 1)
+        bmi = target / height ** 2
+        if bmi < MIN_BMI:
+            break
+        options.append(({'Weight_(kg)': target, 'BMI': bmi}, loss * 10, f"Lose {weight - target:.1f} kg (to {target:.1f} kg, BMI {bmi:.1f})"))
+    return options
+
+
+def _reduce_options(field, unit, steps):
+    def options(patient):
+        current = float(patient.get(field, 0) or 0)
+        return [
+            ({field: value}, effort, f"{unit} {current:g} → {value:g} per week")
+            for value, effort in steps(current) if value < current
+        ]
+    return options
+
+
+def _increase_options(field, unit, steps=((7, 0.3), (14, 0.6), (28, 1.0)), cap=120):
+    def options(patient):
+        current = float(patient.get(field, 0) or 0)
+        result, last = [], current
+        for extra, effort in steps:
+            value = min(current + extra, cap)
+            if value > last:
+                result.append(({field: value}, effort, f"{unit} {current:g} → {value:g} servings per week"))
+                last = value
+        return result
+    return options
+
+
+# Each lever maps a patient to its options, weakest first:
+# (field updates, effort, description). No options: nothing to change.
+LEVERS = {
+    'exercise': lambda p: [({'Exercise': 'Yes'}, 1.0, "Start regular exercise")] if p.get('Exercise') == 'No' else [],
+    'smoking': lambda p: [({'Smoking_History': 'No'}, 1.5, "Quit smoking")] if p.get('Smoking_History') == 'Yes' else [],
+    'weight': _weight_options,
+    'alcohol': _reduce_options('Alcohol_Consumption', "Alcohol", lambda c: [(min(c, 7), 0.5), (0, 1.0)]),
+    'fried_potato': _reduce_options('FriedPotato_Consumption', "Fried potatoes", lambda c: [(c // 2, 0.3), (0, 0.6)]),
+    'fruit': _increase_options('Fruit_Consumption', "Fruit"),
+    'vegetables': _increase_options('Green_Vegetables_Consumption', "Green vegetables"),
+}
+
+
+class Counterfactual:
+    """
+    One set of changes with the patient dict it produces and its risk.
+    """
+
+    def __init__(self, patient, changes, risk):
+        self.changes = changes          # [(lever, description, effort)]
+        self.patient = patient
+        self.risk = risk
+        self.effort = sum(effort for _, _, effort in changes)
+
+    @property
+    def levers(self):
+        return [lever for lever, _, _ in self.changes]
+
+    def describe(self):
+        return "; ".join(description for _, description, _ in self.changes)
+
+    def __repr__(self):
+        return f"Counterfactual({self.describe()!r}, risk={self.risk:.3f}, effort={self.effort:.1f})"
+
+
+class CounterfactualSearch:
+    """
+    Batched counterfactual search over the lifestyle levers for one model.
+    """
+
+    def __init__(self, model, schema, threshold=RISK_THRESHOLD, levers=LEVERS, max_changes=MAX_CHANGES,
+                 time_budget=TIME_BUDGET, batch_size=BATCH_SIZE, scorer=None):
+        self.model = model
+        self.schema = schema
+        self.threshold = threshold
+        self.levers = levers
+        self.max_changes = max_changes
+        self.time_budget = time_budget
+        self.batch_size = batch_size
+        self.scorer = scorer or (lambda records: score_records(model, schema, records))
+        self.last_stats = {}
+
+    def _field_values(self, field, value):
+        # Categorical values as record codes, numerics as floats
+        if field in self.schema.categories:
+            return self.schema.code_map(field)[value]
+        return float(value)
+
+    def _candidates(self, base, names, options):
+        """
+        Records for every combination of options of the named levers, with
+        the option index of each lever per row.
+        """
+        sizes = [len(options[name]) for name in names]
+        picks = np.array(list(itertools.product(*[range(n) for n in sizes])), dtype=np.int16).reshape(-1, len(names))
+        records = np.repeat(base, len(picks))
+        for column, name in enumerate(names):
+            for field in {field for updates, _, _ in options[name] for field in updates}:
+                if field not in records.dtype.names:
+                    continue
+                values = np.array([self._field_values(field, updates[field]) for updates, _, _ in options[name]])
+                records[field] = values[picks[:, column]]
+        return records, picks
+
+    def _score(self, records, deadline):
+        scores = np.full(len(records), np.nan)
+        for start in range(0, len(records), self.batch_size):
+            if time.perf_counter() > deadline:
+                return scores, False
+            scores[start:start + self.batch_size] = self.scorer(records[start:start + self.batch_size])
+        return scores, True
+
+    def search(self, patient, top_n=5):
+        """
+        Ranked counterfactuals for one patient dict (empty when the patient
+        is already below the threshold or no allowed change gets there).
+        """
+        started = time.perf_counter()
+        deadline = started + self.time_budget
+        base = records_from_dicts([patient], self.schema)
+        risk = float(self.scorer(base)[0])
+        self.last_stats = {"risk": risk, "candidates": 0, "levels": 0, "complete": True, "elapsed_ms": 0.0}
+        # High risk is a score above the threshold, so a score at it is already low risk
+        if risk <= self.threshold:
+            return []
+        options = {name: opts for name, opts in ((n, lever(patient)) for n, lever in self.levers.items()) if opts}
+        stats = self.last_stats
+
+        results, working_sets = [], []
+        for k in range(1, min(self.max_changes, len(options)) + 1):
+            lever_sets = [names for names in itertools.combinations(options, k)
+                          if not any(set(found) <= set(names) for found in working_sets)]
+            if not lever_sets:
+                break
+            batches = [self._candidates(base, names, options) for names in lever_sets]
+            scores, finished = self._score(np.concatenate([records for records, _ in batches]), deadline)
+            stats["candidates"] += int(np.count_nonzero(~np.isnan(scores)))
+            stats["levels"] = k
+
+            offset = 0
+            for names, (records, picks) in zip(lever_sets, batches):
+                below = scores[offset:offset + len(picks)] <= self.threshold
+                risks = scores[offset:offset + len(picks)]
+                offset += len(picks)
+                hits = np.flatnonzero(below)
+                if not len(hits):
+                    continue
+                working_sets.append(names)
+                # Keep only changes no smaller working change dominates
+                minimal = [i for i in hits if not any(
+                    j != i and np.all(picks[j] <= picks[i]) for j in hits)]
+                for i in minimal:
+                    changes, updated = [], dict(patient)
+                    for column, name in enumerate(names):
+                        updates, effort, description = options[name][picks[i, column]]
+                        updated.update(updates)
+                        changes.append((name, description, effort))
+                    results.append(Counterfactual(updated, changes, float(risks[i])))
+
+            if not finished:
+                stats["complete"] = False
+                break
+            if len(results) >= top_n:
+                break
+
+        results.sort(key=lambda cf: (len(cf.changes), cf.effort, cf.risk))
+        stats["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return results[:top_n]
+
+
+def plan_with_targets(treatment_dir, counterfactuals, current_risk=None, calibrate=None, already_below=False):
+    """
+    Treatment plan with a 'risk_reduction' section listing the
+    counterfactuals, for generate_treatment_plan_pdf(). The plan itself is
+    not modified. calibrate, if given, maps raw scores to the probabilities
+    shown (e.g. Calibrator.transform). already_below marks a patient whose
+    full-model risk is already under the threshold, so there was nothing to
+    search for.
+    """
+    risks = [cf.risk for cf in counterfactuals]
+    if calibrate is not None and risks:
+        risks = [float(r) for r in calibrate(risks)]
+    return {
+        **treatment_dir,
+        'risk_reduction': {
+            'current_risk': current_risk,
+            'already_below': already_below,
+            'paths': [
+                {'changes': [description for _, description, _ in cf.changes], 'risk': risk}
+                for cf, risk in zip(counterfactuals, risks)
+            ],
+        },
+    }
+
+
+def main():
+    import argparse
+
+    import pandas as pd
+
+    from model_host import HOST_DIR, attach_host
+
+    parser = argparse.ArgumentParser(description="Search the smallest lifestyle changes that lower a patient's risk.")
+    parser.add_argument("patients_csv")
+    parser.add_argument("--row", type=int, default=0)
+    parser.add_argument("--top", type=int, default=5)
+    parser.add_argument("--max-changes", type=int, default=MAX_CHANGES)
+    parser.add_argument("--budget", type=float, default=TIME_BUDGET, help="seconds")
+    parser.add_argument("--host-dir", default=HOST_DIR)
+    args = parser.parse_args()
+
+    host = attach_host(args.host_dir)
+    patient = pd.read_csv(args.patients_csv, skiprows=range(1, args.row + 1), nrows=1).to_dict("records")[0]
+    search = CounterfactualSearch(host, host.schema, threshold=host.threshold, max_changes=args.max_changes, time_budget=args.budget)
+    results = search.search(patient, args.top)
+    stats = search.last_stats
+
+    print(f"Current risk: {stats['risk']:.1%} (threshold {search.threshold:.0%})")
+    print(f"Scored {stats['candidates']:,} candidates over {stats['levels']} level(s) in {stats['elapsed_ms']} ms"
+          f"{'' if stats['complete'] else ' (time budget reached)'}")
+    for rank, cf in enumerate(results, 1):
+        print(f"{rank}. {cf.risk:.1%}  effort {cf.effort:.1f}  {cf.describe()}")
+    if not results and stats['risk'] <= search.threshold:
+        print("The risk is already below the threshold.")
+    elif not results:
+        print("No combination of allowed changes brings the risk below the threshold.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""
+Content-addressed on-disk cache of generated treatment plans.
+
+A plan's text is fully determined by the five patient header fields it
+prints, the (tailored) treatment directory it was generated from and the
+generator code itself, so the SHA-256 of those inputs addresses it:
+
+    <cache>/<key[:2]>/<key>.txt       plain text (written last: marks the entry complete)
+    <cache>/<key[:2]>/<key>.txt.gz    gzip, pre-compressed once
+    <cache>/<key[:2]>/<key>.txt.br    brotli, when the brotli package is installed
+
+Each entry is generated and compressed once; later downloads and batch
+exports read the bytes back. Entries are evicted least-recently-used (by
+file mtime, refreshed on every hit) once the cache grows past its size
+bound. The "Generated on" line records when the entry was first created.
+
+    python Treatment/plan_cache.py patients.csv --output plans.tar
+"""
+
+import csv
+import gzip
+import hashlib
+import io
+import json
+import os
+import sys
+import tarfile
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from treatment import generate_treatment_plan_pdf
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+CACHE_DIR = os.environ.get("HEART_PLAN_CACHE_DIR", os.path.join("cache", "plans"))
+MAX_BYTES = int(float(os.environ.get("HEART_PLAN_CACHE_MB", "64")) * 2**20)
+HEADER_FIELDS = ['General_Health', 'Age_Category', 'BMI', 'Exercise', 'Smoking_History']
+ENCODINGS = {None: ".txt", "gzip": ".txt.gz", "br": ".txt.br"}
+# Evict down to this fraction of the bound so eviction does not run on every write
+EVICT_TO = 0.9
+
+_TREATMENT_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "treatment.py")
+
+
+def _generator_digest():
+    # Any change to the generator invalidates every entry
+    with open(_TREATMENT_SOURCE, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _header(patient_data):
+    header = {}
+    for field in HEADER_FIELDS:
+        value = patient_data.get(field)
+        # BMI is printed with one decimal, so that is all that can change the text
+        header[field] = f"{value:.1f}" if field == "BMI" and isinstance(value, (int, float)) else value
+    return header
+
+
+class PlanCache:
+    """
+    Size-bounded, content-addressed store of generated plans and their
+    pre-compressed variants.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.generator = _generator_digest()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Digest of each plan object seen; tailored plans are shared, read-only objects
+        self._plan_digests = {}
+        os.makedirs(directory, exist_ok=True)
+        self._size = self._scan_size()
+
+    def _plan_digest(self, treatment_dir):
+        cached = self._plan_digests.get(id(treatment_dir))
+        if cached is not None and cached[0] is treatment_dir:
+            return cached[1]
+        digest = hashlib.sha256(json.dumps(treatment_dir, sort_keys=True).encode("utf-8")).hexdigest()
+        if len(self._plan_digests) >= 1024:
+            self._plan_digests.clear()
+        self._plan_digests[id(treatment_dir)] = (treatment_dir, digest)
+        return digest
+
+    def key(self, patient_data, treatment_dir):
+        payload = json.dumps([self.generator, self._plan_digest(treatment_dir), _header(patient_data)], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def path(self, key, encoding=None):
+        return os.path.join(self.directory, key[:2], key + ENCODINGS[encoding])
+
+    def get(self, patient_data, treatment_dir, encoding=None):
+        """
+        Plan bytes in the requested encoding (None, "gzip" or "br"),
+        generating and compressing them on a miss.
+        """
+        if encoding == "br" and brotli is None:
+            raise ImportError("brotli encoding needs the brotli package: pip install brotli")
+        key = self.key(patient_data, treatment_dir)
+        marker = self.path(key)
+        try:
+            with open(self.path(key, encoding), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = None
+        if data is not None:
+            try:
+                os.utime(marker)
+            except OSError:
+                pass
+            with self._lock:
+                self.hits += 1
+            return data
+
+        with self._lock:
+            self.misses += 1
+        text = generate_treatment_plan_pdf(patient_data, treatment_dir).encode("utf-8")
+        variants = {None: text, "gzip": gzip.compress(text, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            variants["br"] = brotli.compress(text, quality=11)
+        self._store(key, variants)
+        return variants[encoding]
+
+    def get_text(self, patient_data, treatment_dir):
+        return self.get(patient_data, treatment_dir).decode("utf-8")
+
+    def _store(self, key, variants):
+        os.makedirs(os.path.dirname(self.path(key)), exist_ok=True)
+        written = 0
+        # Plain text goes last: its presence marks the entry as complete
+        for encoding in sorted(variants, key=lambda e: e is None):
+            path = self.path(key, encoding)
+            tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+            with open(tmp_path, "wb") as f:
+                f.write(variants[encoding])
+            os.replace(tmp_path, path)
+            written += len(variants[encoding])
+        with self._lock:
+            self._size += written
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def _entries(self):
+        """
+        (mtime, size, key) of every complete entry.
+        """
+        entries = []
+        for shard in os.listdir(self.directory):
+            shard_dir = os.path.join(self.directory, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for name in os.listdir(shard_dir):
+                if not name.endswith(".txt"):
+                    continue
+                key = name[:-len(".txt")]
+                try:
+                    mtime = os.stat(os.path.join(shard_dir, name)).st_mtime
+                    size = sum(os.path.getsize(self.path(key, e)) for e in ENCODINGS if os.path.exists(self.path(key, e)))
+                except OSError:
+                    continue
+                entries.append((mtime, size, key))
+        return entries
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """
+        Drop least-recently-used entries until the cache is under its bound.
+        """
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * EVICT_TO
+        for _, size, key in entries:
+            if total <= target:
+                break
+            # Marker first, so a half-removed entry is never served
+            for encoding in sorted(ENCODINGS, key=lambda e: e is not None):
+                try:
+                    os.remove(self.path(key, encoding))
+                except OSError:
+                    pass
+            total -= size
+        with self._lock:
+            self._size = total
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "bytes": self._size, "max_bytes": self.max_bytes}
+
+
+def export_plans(patients, output_path, cache=None, encoding="gzip", threshold=None):
+    """
+    Write one pre-compressed plan per (patient_id, patient dict, risk) into
+    an uncompressed tar: the members are already compressed, so the cached
+    bytes are copied as-is. Repeated or colliding patient IDs get a numeric
+    suffix and index.csv maps every row to its file, as in report archives.
+    threshold is the high-risk cut-off (the rule engine's default if None).
+    Returns the number of plans.
+    """
+    from report_renderer import INDEX_FILE, unique_namer
+    from treatment_rules import RISK_THRESHOLD, TreatmentRuleEngine
+
+    cache = cache or PlanCache()
+    engine = TreatmentRuleEngine(threshold=RISK_THRESHOLD if threshold is None else threshold)
+    unique_name = unique_namer("plans", ENCODINGS[encoding])
+    count = 0
+    mtime = time.time()
+
+    def add(name, data):
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = mtime
+        archive.addfile(info, io.BytesIO(data))
+
+    # Spooled to disk past 1 MB, like the report index
+    with tempfile.SpooledTemporaryFile(max_size=2**20, mode="w+", newline="") as index, \
+            tarfile.open(output_path, "w") as archive:
+        index_writer = csv.writer(index)
+        index_writer.writerow(["patient_id", "risk", "file"])
+        for patient_id, patient, risk in patients:
+            name = unique_name(patient_id)
+            add(name, cache.get(patient, engine.plan(patient, risk), encoding))
+            index_writer.writerow([patient_id, f"{risk:.6f}", name])
+            count += 1
+        index.seek(0)
+        add(INDEX_FILE, index.read().encode("utf-8"))
+    return count
+
+
+def main():
+    import argparse
+
+    from report_renderer import scored_patients, serving_host
+
+    parser = argparse.ArgumentParser(description="Export cached, pre-compressed treatment plans for a patient CSV.")
+    parser.add_argument("patients_csv")
+    parser.add_argument("--output", default="plans.tar")
+    parser.add_argument("--encoding", choices=["gzip", "br"], default="gzip")
+    parser.add_argument("--host-dir")
+    args = parser.parse_args()
+
+    host = serving_host(args.host_dir)
+    cache = PlanCache()
+    started = time.perf_counter()
+    count = export_plans(scored_patients(args.patients_csv, host=host), args.output, cache, args.encoding,
+                         host.threshold)
+    stats = cache.stats()
+    print(f"✅ {count:,} plans written to {args.output} in {time.perf_counter() - started:.1f}s "
+          f"({stats['hits']:,} from cache, {stats['misses']:,} generated)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,411 @@
+"""
+Batch patient reports (HTML or PDF) streamed into a compressed archive.
+
+Each patient gets the treatment plan selected by treatment_rules for their
+risk factors. There are at most 128 distinct plans, so each one is
+rendered to HTML once per worker; a report is the patient header, the risk
+box and the pre-rendered sections for the patient's risk-factor mask.
+
+The stylesheet (styles/style.css, with the same classes the app uses) is
+stored once per archive as assets/style.css and linked from every HTML
+document.
+
+Reports are produced in chunks by a process pool and written to the archive
+in input order with a bounded number of chunks in flight, so memory stays
+flat for any number of patients (apart from the set of file names used).
+Patient IDs that repeat, or that map to the same file name once unsafe
+characters are replaced, get a numeric suffix (P-1.html, P-1-2.html, ...);
+index.csv records which file belongs to which row. A .tar.gz archive
+compresses across documents (the repeated sections shrink to almost
+nothing); a .zip keeps every report individually extractable.
+
+    python Treatment/report_renderer.py patients.csv --output reports.tar.gz
+    python Treatment/report_renderer.py patients.csv --output reports.zip --format pdf --workers 8
+"""
+
+import collections
+import csv
+import html
+import io
+import os
+import re
+import sys
+import tarfile
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from string import Template
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from treatment_rules import RISK_THRESHOLD, TreatmentRuleEngine
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STYLE_PATH = os.path.join(ROOT, "styles", "style.css")
+STYLE_ASSET = "assets/style.css"
+INDEX_FILE = "index.csv"
+
+PATIENT_FIELDS = [
+    ("General Health", "General_Health"),
+    ("Age Category", "Age_Category"),
+    ("Sex", "Sex"),
+    ("BMI", "BMI"),
+    ("Exercise", "Exercise"),
+    ("Smoking History", "Smoking_History"),
+    ("Diabetes", "Diabetes"),
+]
+
+DOCUMENT = Template("""<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>Heart Disease Risk Report — $patient_id</title>
+$stylesheet
+</head>
+<body>
+<div class="block-container">
+<h2 class="title-text">❤️ Heart Disease Risk Report</h2>
+<p class="sub-header">Patient $patient_id</p>
+<table class="treatment-card">$patient_rows</table>
+$prediction
+$sections
+<div class="crit-box"><div class="crit-content"><strong>Disclaimer:</strong> This report is generated for
+educational purposes only. All medical decisions must be made in consultation with qualified
+healthcare professionals.<br>Generated on: $generated</div></div>
+</div>
+</body>
+</html>
+""")
+
+PREDICTION = Template(
+    '<div class="prediction-box $css_class">$label<br>Risk Probability: $risk</div>'
+)
+
+
+def _esc(value):
+    return html.escape(str(value))
+
+
+def _card(title, fields, css_class="treatment-card"):
+    rows = "".join(
+        f"<li><em>{_esc(label)}:</em> {_esc(', '.join(value) if isinstance(value, list) else value)}</li>"
+        for label, value in fields
+    )
+    return f'<div class="{css_class}"><strong>{_esc(title)}</strong><ul>{rows}</ul></div>'
+
+
+def _list_card(title, items):
+    rows = "".join(f"<li>{_esc(item)}</li>" for item in items)
+    return f'<div class="treatment-card"><strong>{_esc(title)}</strong><ul>{rows}</ul></div>'
+
+
+def _entries(items, title_key, css_class="treatment-card"):
+    """
+    One card per entry: the title field in bold, every other field listed.
+    """
+    return "".join(
+        _card(item[title_key], [(k.replace("_", " ").title(), v) for k, v in item.items() if k != title_key], css_class)
+        for item in items
+    )
+
+
+def _section(title, priority_class, meta, body):
+    header = f'<span class="{priority_class}">{_esc(meta["priority"])}</span> {_esc(meta["timeframe"])}'
+    return f'<div class="treatment-box"><h4>{_esc(title)}</h4><p>{header}</p>{body}</div>'
+
+
+def _category_entries(categories, title_keys):
+    return "".join(_entries(items, title_keys[key]) for key, items in categories.items())
+
+
+# Section renderers over a (possibly tailored) treatment plan
+SECTION_RENDERERS = {
+    "emergency": lambda section: _section(
+        "🚨 Emergency Actions", "priority-immediate", section,
+        _entries(section["actions"], "action", "emergency-card"),
+    ),
+    "diagnostic_tests": lambda section: _section(
+        "🔬 Diagnostic Tests", "priority-high", section,
+        _category_entries(section["categories"], {"cardiac_assessment": "test", "blood_work": "test"}),
+    ),
+    "medications": lambda section: _section(
+        "💊 Medications", "priority-high", section,
+        _category_entries(section["categories"], {"cardiovascular": "type", "preventive": "type"}),
+    ),
+    "lifestyle_interventions": lambda section: _section(
+        "🏃 Lifestyle", "priority-essential", section,
+        _category_entries(section["categories"], {"physical_activity": "activity", "smoking_cessation": "method"}),
+    ),
+    "nutrition_therapy": lambda section: _section(
+        "🥗 Nutrition", "priority-essential", section,
+        "".join(_card(approach["description"], [("Key Components", approach["key_components"]),
+                                                ("Benefits", approach["benefits"])])
+                for approach in section["dietary_approaches"].values())
+        + "".join(f"<h5>Foods to {key.title()}</h5>" + _entries(items, "food")
+                  for key, items in section["specific_recommendations"].items()),
+    ),
+    "monitoring_schedule": lambda section: _section(
+        "📊 Monitoring", "priority-ongoing", section,
+        _entries(section.get("vital_signs", []), "parameter") + _entries(section.get("laboratory_tests", []), "test"),
+    ),
+    "psychological_support": lambda section: _section(
+        "🧠 Psychological Support", "priority-ongoing", section,
+        _entries(section["interventions"], "type"),
+    ),
+    "emergency_planning": lambda section: _section(
+        "🚨 Emergency Action Plan", "priority-immediate", section,
+        "".join(_list_card(title, section["action_plan"][key]) for title, key in (
+            ("⚠️ Warning Signs", "warning_signs"),
+            ("📞 Immediate Response", "immediate_response"),
+            ("Preparation", "preparation"),
+        )),
+    ),
+}
+
+
+def compile_sections(plan):
+    """
+    Render the sections of a treatment plan to one HTML fragment, in plan order.
+    """
+    return "".join(SECTION_RENDERERS[key](section) for key, section in plan.items() if key in SECTION_RENDERERS)
+
+
+class ReportRenderer:
+    """
+    Per-patient report renderer with the treatment sections compiled once.
+    """
+
+    def __init__(self, treatment_dir=None, fmt="html", threshold=RISK_THRESHOLD):
+        self.fmt = fmt
+        self.threshold = threshold
+        self.engine = TreatmentRuleEngine(treatment_dir, threshold=threshold)
+        # Section HTML per risk-factor mask, rendered on first use
+        self._sections = {}
+        self.generated = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if fmt == "pdf":
+            try:
+                import weasyprint
+            except ImportError:
+                raise ImportError("PDF reports need weasyprint: pip install weasyprint")
+            self._weasyprint = weasyprint
+            # Stylesheet parsed once per worker, not once per document
+            self._css = weasyprint.CSS(filename=STYLE_PATH)
+            self.stylesheet = ""
+        else:
+            # HTML reports sit in reports/, the shared stylesheet in assets/
+            self.stylesheet = f'<link rel="stylesheet" href="../{STYLE_ASSET}">'
+
+    def render_html(self, patient_id, patient, risk):
+        high_risk = risk > self.threshold
+        bmi = patient.get("BMI")
+        fields = {label: (f"{bmi:.1f}" if key == "BMI" and isinstance(bmi, (int, float)) else patient.get(key, "N/A"))
+                  for label, key in PATIENT_FIELDS}
+        return DOCUMENT.substitute(
+            patient_id=_esc(patient_id),
+            stylesheet=self.stylesheet,
+            patient_rows="".join(f"<tr><th>{_esc(k)}</th><td>{_esc(v)}</td></tr>" for k, v in fields.items()),
+            prediction=PREDICTION.substitute(
+                css_class="positive-prediction" if high_risk else "negative-prediction",
+                label="⚠️ HIGH RISK: Potential Heart Disease Risk" if high_risk else "✅ LOW RISK: Lower Heart Disease Risk",
+                risk=f"{risk:.2%}",
+            ),
+            sections=self.sections_html(self.engine.mask(patient, risk)),
+            generated=self.generated,
+        )
+
+    def sections_html(self, mask):
+        html_fragment = self._sections.get(mask)
+        if html_fragment is None:
+            html_fragment = self._sections[mask] = compile_sections(self.engine.plan_for_mask(mask))
+        return html_fragment
+
+    def render(self, patient_id, patient, risk):
+        """
+        One report as bytes in the renderer's format.
+        """
+        document = self.render_html(patient_id, patient, risk)
+        if self.fmt == "pdf":
+            return self._weasyprint.HTML(string=document).write_pdf(stylesheets=[self._css])
+        return document.encode("utf-8")
+
+
+_worker_renderer = None
+
+
+def _init_worker(fmt, threshold):
+    global _worker_renderer
+    _worker_renderer = ReportRenderer(fmt=fmt, threshold=threshold)
+
+
+def _render_chunk(chunk):
+    return [(patient_id, risk, _worker_renderer.render(patient_id, patient, risk)) for patient_id, patient, risk in chunk]
+
+
+class _ArchiveWriter:
+    """
+    Minimal common interface over zip and tar.gz streaming writes.
+    """
+
+    def __init__(self, path):
+        self.is_zip = path.endswith(".zip")
+        if self.is_zip:
+            self._archive = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=6)
+        else:
+            self._archive = tarfile.open(path, "w:gz", compresslevel=6)
+        self._mtime = time.time()
+
+    def add(self, name, data):
+        if self.is_zip:
+            self._archive.writestr(name, data)
+        else:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = self._mtime
+            self._archive.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        self._archive.close()
+
+
+def _chunks(patients, chunk_size):
+    chunk = []
+    for patient in patients:
+        chunk.append(patient)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def unique_namer(directory, extension):
+    """
+    Archive member names for patient IDs: unsafe characters become '_', and
+    an ID that repeats, or collides with another once sanitized, gets a
+    numeric suffix (P-1.html, P-1-2.html, ...).
+    """
+    used_names = set()
+
+    def unique_name(patient_id):
+        stem = f"{directory}/{re.sub(r'[^\w.-]', '_', str(patient_id))}"
+        name, suffix = f"{stem}{extension}", 1
+        while name in used_names:
+            suffix += 1
+            name = f"{stem}-{suffix}{extension}"
+        used_names.add(name)
+        return name
+
+    return unique_name
+
+
+def write_report_archive(patients, output_path, fmt="html", workers=None, chunk_size=64,
+                         max_pending=None, threshold=RISK_THRESHOLD):
+    """
+    Render (patient_id, patient dict, risk) tuples into an archive at
+    output_path (.zip or .tar.gz). patients may be any iterable, including a
+    generator over a file larger than memory. Returns the number of reports.
+    """
+    # Fail fast (e.g. PDF without weasyprint) before starting the pool
+    ReportRenderer(fmt=fmt, threshold=threshold)
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or 2 * workers
+    extension = "pdf" if fmt == "pdf" else "html"
+    archive = _ArchiveWriter(output_path)
+    written = 0
+    # The index is spooled to disk past 1 MB so it never holds the batch in memory
+    index = tempfile.SpooledTemporaryFile(max_size=2**20, mode="w+", newline="")
+    index_writer = csv.writer(index)
+    index_writer.writerow(["patient_id", "risk", "file"])
+    unique_name = unique_namer("reports", f".{extension}")
+
+    def drain(future):
+        nonlocal written
+        for patient_id, risk, data in future.result():
+            name = unique_name(patient_id)
+            archive.add(name, data)
+            index_writer.writerow([patient_id, f"{risk:.6f}", name])
+            written += 1
+
+    try:
+        if fmt != "pdf":
+            with open(STYLE_PATH, "rb") as f:
+                archive.add(STYLE_ASSET, f.read())
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(fmt, threshold)) as pool:
+            pending = collections.deque()
+            for chunk in _chunks(patients, chunk_size):
+                pending.append(pool.submit(_render_chunk, chunk))
+                if len(pending) >= max_pending:
+                    drain(pending.popleft())
+            while pending:
+                drain(pending.popleft())
+        index.seek(0)
+        archive.add(INDEX_FILE, index.read().encode("utf-8"))
+    finally:
+        index.close()
+        archive.close()
+    return written
+
+
+def serving_host(host_dir=None):
+    """
+    Attach to the serving model host (HEART_HOST_DIR by default).
+    """
+    sys.path.append(os.path.join(ROOT, "Serving"))
+    sys.path.append(os.path.join(ROOT, "Data preprocess"))
+    from model_host import HOST_DIR, attach_host
+
+    return attach_host(host_dir or HOST_DIR)
+
+
+def scored_patients(csv_path, host_dir=None, chunk_size=10000, id_column="Patient_ID", host=None):
+    """
+    Stream (patient_id, patient dict, risk) from a patient CSV, scoring each
+    chunk through the shared serving path (with host if given, else the
+    host in host_dir). Rows that fail validation are skipped.
+    """
+    import pandas as pd
+
+    host = host or serving_host(host_dir)
+    from inference import score_batch
+    from patient_record import records_from_frame
+    from validation import RecordValidator
+
+    validator = RecordValidator(host.schema)
+    offset = 0
+    for frame in pd.read_csv(csv_path, chunksize=chunk_size):
+        scores, _ = score_batch(host, host.schema, records_from_frame(frame, host.schema), validator=validator)
+        ids = frame[id_column].astype(str).tolist() if id_column in frame else [str(offset + i) for i in range(len(frame))]
+        for patient_id, patient, risk in zip(ids, frame.to_dict("records"), scores.tolist()):
+            if risk == risk:
+                yield patient_id, patient, risk
+        offset += len(frame)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Render per-patient risk reports into a compressed archive.")
+    parser.add_argument("patients_csv")
+    parser.add_argument("--output", default="reports.tar.gz", help=".tar.gz or .zip")
+    parser.add_argument("--format", choices=["html", "pdf"], default="html")
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--chunk-size", type=int, default=64, help="reports per worker task")
+    parser.add_argument("--host-dir")
+    args = parser.parse_args()
+
+    host = serving_host(args.host_dir)
+    started = time.perf_counter()
+    # Reports call a patient high risk exactly where serving does: above the host's operating point
+    count = write_report_archive(
+        scored_patients(args.patients_csv, host=host), args.output,
+        fmt=args.format, workers=args.workers, chunk_size=args.chunk_size, threshold=host.threshold,
+    )
+    elapsed = time.perf_counter() - started
+    print(f"✅ {count:,} reports written to {args.output} in {elapsed:.1f}s "
+          f"({os.path.getsize(args.output) / 2**20:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
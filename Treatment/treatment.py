@@ -276,10 +276,15 @@ def get_treatment_recommendations():
 
 def generate_treatment_plan_pdf(patient_data, treatment_dir):
     """
-    Generate a personalized treatment plan text that can be downloaded
+    Generate a personalized treatment plan text that can be downloaded.
+    Sections missing from treatment_dir (e.g. a plan tailored by
+    treatment_rules) are left out.
     """
     from datetime import datetime
-    
+
+    bmi = patient_data.get('BMI')
+    bmi_text = f"{bmi:.1f}" if isinstance(bmi, (int, float)) else 'N/A'
+
     plan_text = f"""
         PERSONALIZED HEART DISEASE TREATMENT PLAN
         {'='*50}
@@ -287,142 +292,185 @@ def generate_treatment_plan_pdf(patient_data, treatment_dir):
         PATIENT INFORMATION:
         - General Health: {patient_data.get('General_Health', 'N/A')}
         - Age Category: {patient_data.get('Age_Category', 'N/A')}
-        - BMI: {patient_data.get('BMI', 'N/A'):.1f if 'BMI' in patient_data else 'N/A'}
+        - BMI: {bmi_text}
         - Exercise: {patient_data.get('Exercise', 'N/A')}
         - Smoking History: {patient_data.get('Smoking_History', 'N/A')}
-        
+    """
+
+    if 'emergency' in treatment_dir:
+        plan_text += f"""
         EMERGENCY ACTIONS (IMMEDIATE PRIORITY)
         {'='*40}
         Timeframe: {treatment_dir['emergency']['timeframe']}
         
         Emergency Actions:
     """
-    
-    for action in treatment_dir['emergency']['actions']:
-        plan_text += f"""
+        for action in treatment_dir['emergency']['actions']:
+            plan_text += f"""
         - {action['action']}
           Condition: {action['condition']}
           Urgency: {action['urgency']}
         """
-    
-    plan_text += f"""
+
+    if 'emergency_planning' in treatment_dir:
+        plan_text += f"""
 
         WARNING SIGNS TO WATCH FOR:
     """
-    for sign in treatment_dir['emergency_planning']['action_plan']['warning_signs']:
-        plan_text += f"• {sign}\n"
-    
-    plan_text += f"""
+        for sign in treatment_dir['emergency_planning']['action_plan']['warning_signs']:
+            plan_text += f"• {sign}\n"
+
+        plan_text += f"""
 
         IMMEDIATE RESPONSE IF SYMPTOMS OCCUR:
     """
-    for response in treatment_dir['emergency_planning']['action_plan']['immediate_response']:
-        plan_text += f"• {response}\n"
-    
-    plan_text += f"""
+        for response in treatment_dir['emergency_planning']['action_plan']['immediate_response']:
+            plan_text += f"• {response}\n"
+
+    if 'diagnostic_tests' in treatment_dir:
+        diagnostics = treatment_dir['diagnostic_tests']
+        plan_text += f"""
 
         DIAGNOSTIC TESTS (HIGH PRIORITY)
         {'='*35}
-        Timeframe: {treatment_dir['diagnostic_tests']['timeframe']}
-        
-        Cardiac Assessment Tests:
+        Timeframe: {diagnostics['timeframe']}
     """
-    
-    for test in treatment_dir['diagnostic_tests']['categories']['cardiac_assessment']:
-        plan_text += f"""
+        for title, key in (("Cardiac Assessment Tests", 'cardiac_assessment'), ("Blood Work Tests", 'blood_work')):
+            if key not in diagnostics['categories']:
+                continue
+            plan_text += f"""
+        {title}:
+    """
+            for test in diagnostics['categories'][key]:
+                plan_text += f"""
         - {test['test']}
           Purpose: {test['purpose']}
           Frequency: {test['frequency']}
         """
-    
-    plan_text += f"""
 
-        Blood Work Tests:
-    """
-    for test in treatment_dir['diagnostic_tests']['categories']['blood_work']:
+    if 'lifestyle_interventions' in treatment_dir:
+        lifestyle = treatment_dir['lifestyle_interventions']
         plan_text += f"""
-        - {test['test']}
-          Purpose: {test['purpose']}
-          Frequency: {test['frequency']}
-        """
-    
-    plan_text += f"""
 
         LIFESTYLE INTERVENTIONS (ESSENTIAL)
         {'='*35}
-        Timeframe: {treatment_dir['lifestyle_interventions']['timeframe']}
-        
-        Physical Activity Program:
+        Timeframe: {lifestyle['timeframe']}
+    """
+        if 'smoking_cessation' in lifestyle['categories']:
+            plan_text += f"""
+        Smoking Cessation:
     """
+            for method in lifestyle['categories']['smoking_cessation']:
+                plan_text += f"""
+        - {method['method']}
+          Options: {method['options']}
+        """
 
-    for activity in treatment_dir['lifestyle_interventions']['categories']['physical_activity']:
-        plan_text += f"""
+        if 'physical_activity' in lifestyle['categories']:
+            plan_text += f"""
+        Physical Activity Program:
+    """
+            for activity in lifestyle['categories']['physical_activity']:
+                plan_text += f"""
         - {activity.get('activity', 'Activity')}
           Recommendation: {activity.get('recommendation', 'As advised')}
           Examples: {activity.get('examples', '—')}
         """
-        if 'progression' in activity:
-            plan_text += f"      Progression: {activity['progression']}\n"
-        if 'benefits' in activity:
-            plan_text += f"      Benefits: {activity['benefits']}\n"
+                if 'progression' in activity:
+                    plan_text += f"      Progression: {activity['progression']}\n"
+                if 'benefits' in activity:
+                    plan_text += f"      Benefits: {activity['benefits']}\n"
 
-    plan_text += f"""
+    if 'nutrition_therapy' in treatment_dir:
+        nutrition = treatment_dir['nutrition_therapy']
+        plan_text += f"""
     
         NUTRITION PLAN:
-        Mediterranean Diet Benefits: {treatment_dir['nutrition_therapy']['dietary_approaches']['mediterranean_diet']['benefits']}
-        
+    """
+        for approach in nutrition['dietary_approaches'].values():
+            plan_text += f"        {approach['description']}: {approach['benefits']}\n"
+
+        recommendations = nutrition['specific_recommendations']
+        if 'increase' in recommendations:
+            plan_text += f"""
         Foods to Increase:
     """
-    for item in treatment_dir['nutrition_therapy']['specific_recommendations']['increase']:
-        plan_text += f"• {item['food']} - {item['frequency']} ({item['benefit']})\n"
-    
-    plan_text += f"""
+            for item in recommendations['increase']:
+                plan_text += f"• {item['food']} - {item['frequency']} ({item['benefit']})\n"
+
+        if 'limit' in recommendations:
+            plan_text += f"""
         Foods to Limit:
     """
-    for item in treatment_dir['nutrition_therapy']['specific_recommendations']['limit']:
-        plan_text += f"• {item['food']} - {item['limit']} ({item['reason']})\n"
-    
-    plan_text += f"""
+            for item in recommendations['limit']:
+                plan_text += f"• {item['food']} - {item['limit']} ({item['reason']})\n"
+
+    if 'monitoring_schedule' in treatment_dir:
+        monitoring = treatment_dir['monitoring_schedule']
+        plan_text += f"""
 
         MONITORING SCHEDULE (ONGOING)
         {'='*30}
         
         Vital Signs to Monitor:
     """
-    for vital in treatment_dir['monitoring_schedule']['vital_signs']:
-        plan_text += f"""
+        for vital in monitoring.get('vital_signs', []):
+            plan_text += f"""
         - {vital['parameter']}
           Frequency: {vital['frequency']}
           Target: {vital['target']}
         """
-        if 'device' in vital:
-            plan_text += f"  Device: {vital['device']}\n"
-    
-    plan_text += f"""
+            if 'device' in vital:
+                plan_text += f"  Device: {vital['device']}\n"
+
+        if 'laboratory_tests' in monitoring:
+            plan_text += f"""
         
         Laboratory Tests Schedule:
     """
-    for test in treatment_dir['monitoring_schedule']['laboratory_tests']:
-        plan_text += f"""
+            for test in monitoring['laboratory_tests']:
+                plan_text += f"""
         - {test['test']}
           Frequency: {test['frequency']}
           Targets: {test.get('targets', test.get('target', 'As per physician'))}
         """
-    
-    plan_text += f"""
+
+    if 'psychological_support' in treatment_dir:
+        plan_text += f"""
 
         PSYCHOLOGICAL SUPPORT
         {'='*20}
     """
-    for intervention in treatment_dir['psychological_support']['interventions']:
-        plan_text += f"""
+        for intervention in treatment_dir['psychological_support']['interventions']:
+            plan_text += f"""
             - {intervention['type']}
         """
-        if 'recommendation' in intervention:
-            plan_text += f"  Recommendation: {intervention['recommendation']}\n"
-        if 'apps' in intervention:
-            plan_text += f"  Recommended Apps: {intervention['apps']}\n"
-    
+            if 'recommendation' in intervention:
+                plan_text += f"  Recommendation: {intervention['recommendation']}\n"
+            if 'apps' in intervention:
+                plan_text += f"  Recommended Apps: {intervention['apps']}\n"
+
+    if 'risk_reduction' in treatment_dir:
+        reduction = treatment_dir['risk_reduction']
+        plan_text += f"""
+
+        PATH TO LOWER RISK
+        {'='*18}
+    """
+        if reduction.get('current_risk') is not None:
+            plan_text += f"Current predicted risk: {reduction['current_risk']:.1%}\n"
+        if reduction.get('already_below'):
+            plan_text += ("The full model already puts the predicted risk below the high-risk threshold; "
+                          "the high-risk call came from the quick pre-screen. Review this plan with your doctor.\n")
+        elif not reduction['paths']:
+            plan_text += "No small set of lifestyle changes alone brings the predicted risk below the high-risk threshold.\n"
+        for number, path in enumerate(reduction['paths'], 1):
+            plan_text += f"""
+        Option {number} (predicted risk {path['risk']:.1%}):
+    """
+            for change in path['changes']:
+                plan_text += f"• {change}\n"
+
     plan_text += f"""
         IMPORTANT DISCLAIMERS:
         {'='*20}
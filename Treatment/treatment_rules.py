@@ -0,0 +1,186 @@
+"""
+Risk-tailored treatment selection.
+
+The treatment directory from get_treatment_recommendations() is compiled
+once into a lookup table: a patient's risk factors form a small bitmask
+(high risk, smoker, diabetic, overweight, obese, inactive, depression) and
+the personalised plan for every possible mask is built up front. Selecting a
+plan at request time, or for a whole batch, is a bitmask computation and an
+index into that table.
+
+Plans have the same shape as the full directory, minus the sections,
+categories and items that do not apply; items motivated by the patient's
+own risk factors are moved to the front of their list.
+"""
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from treatment import get_treatment_recommendations
+
+
+FACTORS = ['high_risk', 'smoker', 'diabetic', 'overweight', 'obese', 'inactive', 'depression']
+FACTOR_BITS = {name: 1 << i for i, name in enumerate(FACTORS)}
+RISK_THRESHOLD = 0.5
+OVERWEIGHT_BMI = 25.0
+OBESE_BMI = 30.0
+DIABETES_VALUES = ('Yes', 'No, pre-diabetes or borderline diabetes')
+
+# Which risk factors make a node of the directory relevant. Keys are paths
+# into the directory (section, sub-keys, then an item's title); a node is
+# kept when any listed factor is present. Nodes without a rule inherit the
+# rule of their closest ancestor; nodes without any rule are always kept.
+RULES = {
+    ('emergency',): ['high_risk'],
+    ('emergency_planning',): ['high_risk'],
+    ('diagnostic_tests', 'categories', 'cardiac_assessment'): ['high_risk'],
+    ('diagnostic_tests', 'categories', 'blood_work', 'Lipid Panel'): ['high_risk', 'overweight'],
+    ('diagnostic_tests', 'categories', 'blood_work', 'HbA1c'): ['diabetic', 'obese'],
+    ('diagnostic_tests', 'categories', 'blood_work', 'C-Reactive Protein (CRP)'): ['high_risk'],
+    ('medications',): ['high_risk'],
+    ('lifestyle_interventions', 'categories', 'physical_activity', 'Strength Training'): ['inactive', 'overweight', 'high_risk'],
+    ('lifestyle_interventions', 'categories', 'physical_activity', 'Flexibility & Balance'): ['inactive', 'depression', 'high_risk'],
+    ('lifestyle_interventions', 'categories', 'smoking_cessation'): ['smoker'],
+    ('nutrition_therapy', 'dietary_approaches', 'dash_diet'): ['high_risk', 'overweight'],
+    ('nutrition_therapy', 'specific_recommendations', 'limit', 'Sodium'): ['high_risk', 'overweight'],
+    ('nutrition_therapy', 'specific_recommendations', 'limit', 'Saturated fats'): ['high_risk', 'overweight'],
+    ('nutrition_therapy', 'specific_recommendations', 'limit', 'Added sugars'): ['diabetic', 'overweight'],
+    ('monitoring_schedule', 'vital_signs', 'Weight'): ['overweight', 'diabetic'],
+    ('monitoring_schedule', 'vital_signs', 'Heart Rate'): ['high_risk', 'inactive'],
+    ('monitoring_schedule', 'laboratory_tests', 'Lipid Panel'): ['high_risk', 'overweight'],
+    ('monitoring_schedule', 'laboratory_tests', 'HbA1c'): ['diabetic'],
+    ('psychological_support',): ['high_risk', 'depression', 'smoker'],
+    ('psychological_support', 'interventions', 'Cognitive Behavioral Therapy'): ['depression'],
+}
+
+# Sections whose descendants keep the directory's own order
+_FIXED_ORDER_KEYS = ('action_plan', 'key_components', 'techniques', 'options')
+
+
+def _rule_mask(factors):
+    mask = 0
+    for name in factors:
+        mask |= FACTOR_BITS[name]
+    return mask
+
+
+def _item_title(item):
+    # Every directory item leads with its title field (action, test, type, ...)
+    return next(iter(item.values()))
+
+
+class TreatmentRuleEngine:
+    """
+    Directory compiled into one plan per risk-factor bitmask.
+    """
+
+    def __init__(self, treatment_dir=None, rules=RULES, threshold=RISK_THRESHOLD):
+        self.treatment_dir = treatment_dir or get_treatment_recommendations()
+        self.threshold = threshold
+        self._rules = {path: _rule_mask(factors) for path, factors in rules.items()}
+        self._plans = [self._select(self.treatment_dir, (), 0, mask)[0] for mask in range(1 << len(FACTORS))]
+
+    def _select(self, node, path, inherited, mask):
+        """
+        Filter one node of the directory for a mask.
+        Returns (node or None when dropped, targeted).
+        """
+        rule = self._rules.get(path, inherited)
+        if rule and not rule & mask:
+            return None, False
+        # Targeted: kept because of the patient's own factors, not just high risk
+        targeted = path in self._rules and bool(rule & mask & ~FACTOR_BITS['high_risk'])
+
+        if isinstance(node, dict):
+            children = [(key, *self._select(value, path + (key,), rule, mask)) for key, value in node.items()]
+            had_containers = any(isinstance(value, (dict, list)) for value in node.values())
+            kept = [(key, value, t) for key, value, t in children if value is not None]
+            if had_containers and not any(isinstance(value, (dict, list)) for _, value, _ in kept):
+                return None, False
+            if path and path[-1] not in _FIXED_ORDER_KEYS:
+                kept.sort(key=lambda child: not child[2])
+            return {key: value for key, value, _ in kept}, targeted
+
+        if isinstance(node, list) and node and isinstance(node[0], dict):
+            children = [self._select(item, path + (_item_title(item),), rule, mask) for item in node]
+            kept = [child for child in children if child[0] is not None]
+            if not kept:
+                return None, False
+            kept.sort(key=lambda child: not child[1])
+            return [item for item, _ in kept], targeted
+
+        return node, targeted
+
+    def mask(self, patient, risk=None):
+        """
+        Risk-factor bitmask for one patient dict. Without a risk score the
+        patient is treated as high risk (the app only asks for a plan then).
+        """
+        bmi = patient.get('BMI')
+        try:
+            bmi = float(bmi)
+        except (TypeError, ValueError):
+            bmi = float('nan')
+        flags = {
+            'high_risk': risk is None or risk > self.threshold,
+            'smoker': patient.get('Smoking_History') == 'Yes',
+            'diabetic': patient.get('Diabetes') in DIABETES_VALUES,
+            'overweight': bmi >= OVERWEIGHT_BMI,
+            'obese': bmi >= OBESE_BMI,
+            'inactive': patient.get('Exercise') == 'No',
+            'depression': patient.get('Depression') == 'Yes',
+        }
+        return sum(FACTOR_BITS[name] for name, on in flags.items() if on)
+
+    def masks(self, frame, risks):
+        """
+        Vectorized masks for a DataFrame of patients and their risk scores.
+        """
+        bmi = np.asarray(frame['BMI'], dtype=np.float64) if 'BMI' in frame else np.full(len(frame), np.nan)
+        columns = {
+            'high_risk': np.asarray(risks, dtype=np.float64) > self.threshold,
+            'smoker': (frame['Smoking_History'] == 'Yes').to_numpy(),
+            'diabetic': frame['Diabetes'].isin(DIABETES_VALUES).to_numpy(),
+            'overweight': bmi >= OVERWEIGHT_BMI,
+            'obese': bmi >= OBESE_BMI,
+            'inactive': (frame['Exercise'] == 'No').to_numpy(),
+            'depression': (frame['Depression'] == 'Yes').to_numpy(),
+        }
+        masks = np.zeros(len(frame), dtype=np.int64)
+        for name, on in columns.items():
+            masks |= np.where(on, FACTOR_BITS[name], 0)
+        return masks
+
+    def plan_for_mask(self, mask):
+        """
+        Shared, pre-built plan for a mask. Treat it as read-only.
+        """
+        return self._plans[mask]
+
+    def plan(self, patient, risk=None):
+        return self._plans[self.mask(patient, risk)]
+
+    def plans(self, frame, risks):
+        return [self._plans[mask] for mask in self.masks(frame, risks)]
+
+    @staticmethod
+    def factors(mask):
+        return [name for name in FACTORS if mask & FACTOR_BITS[name]]
+
+
+_default_engine = None
+
+
+def get_treatment_plan(patient_data, risk=None):
+    """
+    Personalised subset of get_treatment_recommendations() for one patient,
+    from an engine compiled on first use.
+    """
+    global _default_engine
+    if _default_engine is None:
+        _default_engine = TreatmentRuleEngine()
+    return _default_engine.plan(patient_data, risk)
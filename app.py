@@ -1,9 +1,12 @@
 import streamlit as st
 import pandas as pd
 import pickle
+import contextlib
 import numpy as np
 from datetime import datetime
 import os
+import time
+import uuid
 import warnings
 import sys
 warnings.filterwarnings('ignore')
@@ -15,6 +18,9 @@ sys.path.append(os.path.join(os.path.dirname(__file__), 'Treatment'))
 # Import treatment module
 try:
     from treatment import get_treatment_recommendations, generate_treatment_plan_pdf
+    from treatment_rules import get_treatment_plan
+    from plan_cache import PlanCache
+    from counterfactual import CounterfactualSearch, plan_with_targets
 except ImportError:
     # Fallback if module not found
     def get_treatment_recommendations():
@@ -23,17 +29,72 @@ except ImportError:
     def generate_treatment_plan_pdf(patient_data, treatment_dir):
         return "Treatment module not available - cannot generate plan"
 
+    def get_treatment_plan(patient_data, risk=None):
+        return get_treatment_recommendations()
+
+    PlanCache = None
+    CounterfactualSearch = None
+
 # Add Data preprocess directory to path-----------------------------------------------
 sys.path.append(os.path.join(os.path.dirname(__file__), 'Data preprocess'))
 # Import preprocess module function
 try:
-    from preprocess_scaler import preprocess_input_with_scaling
+    from preprocess_scaler import preprocess_input_with_scaling, load_feature_schema, load_validator
 
 except ImportError:
     # Fallback if module not found
     def preprocess_input_with_scaling(user_input, sample_df):
         return "preprocess_input_with_scaling module not available"
 
+    def load_feature_schema():
+        return None
+
+    def load_validator(schema):
+        raise ImportError("validation module not available")
+
+# Add Serving directory to path-----------------------------------------------
+sys.path.append(os.path.join(os.path.dirname(__file__), 'Serving'))
+# Import shared model host and inference path
+try:
+    from model_host import attach_host, ModelHost
+    from inference import ResultCache, score_records
+    from patient_record import records_from_dicts, records_to_matrix
+    from drift_monitor import DriftMonitor, default_export_path, load_reference
+    from audit_log import AUDIT_DIR, AuditLog
+    from model_registry import ModelRouter
+    from profiling import profile_request
+    from calibration import Calibrator
+    from cascade import Cascade, decide
+    from ensemble import Ensemble
+    from live_preview import LivePreview
+    from patient_history import HISTORY_DB, PatientHistory
+except ImportError:
+    # Fallback if module not found
+    ModelHost = None
+    ModelRouter = None
+    Calibrator = None
+    Cascade = None
+    Ensemble = None
+    LivePreview = None
+    PatientHistory = None
+
+    def profile_request(label, force=False):
+        return contextlib.nullcontext()
+
+    def attach_host():
+        raise ImportError("model_host module not available")
+
+# Add Analytics directory to path-----------------------------------------------
+sys.path.append(os.path.join(os.path.dirname(__file__), 'Analytics'))
+# Import cohort similarity search
+try:
+    from cohort_index import CohortIndex
+    from risk_percentile import RiskPercentiles
+except ImportError:
+    # Fallback if module not found
+    CohortIndex = None
+    RiskPercentiles = None
+
 # Page configuration------------------------------------------------
 st.set_page_config(
     page_title="Heart Disease Prediction System",
@@ -72,6 +133,14 @@ def load_model():
     """
     Load LightGBM model with proper error handling
     """
+    # Prefer the shared host: replicas on one machine mmap the same booster
+    # file and reference tables instead of each unpickling their own copy.
+    # The router serves the registry's active version when one is configured.
+    try:
+        return ModelRouter(), None
+    except Exception:
+        pass
+
     try:
         # Try different methods to load the corrupted pickle file
         loading_methods = [
@@ -102,6 +171,159 @@ def load_model():
         return None, f"Model loading error: {str(e)}"
 
 
+# On-disk cache of generated treatment plans and their compressed variants
+@st.cache_resource
+def load_plan_cache():
+    if PlanCache is None:
+        return None
+    try:
+        return PlanCache()
+    except OSError:
+        return None
+
+
+# Per-process cache of recent predictions, keyed on the patient record bytes
+@st.cache_resource
+def load_result_cache():
+    return ResultCache()
+
+
+# Background writers/workers of the model version in use, one per kind
+@st.cache_resource
+def load_current_workers():
+    return {}
+
+
+def replace_worker(kind, worker):
+    """
+    Make worker the current one of its kind and stop the one it replaces
+    (built for an earlier model version), so old threads never pile up.
+    """
+    workers = load_current_workers()
+    previous, workers[kind] = workers.get(kind), worker
+    if previous is not None and previous is not worker:
+        previous.close()
+    return worker
+
+
+# Drift monitor over this process's scoring stream (needs the host reference table), per model version
+@st.cache_resource
+def load_drift_monitor(_model, model_version):
+    if ModelHost is None or not isinstance(_model, ModelHost):
+        return None
+    return DriftMonitor(load_reference(_model), export_path=default_export_path())
+
+
+# Append-only audit log of every prediction made by this process (one writer per model version)
+@st.cache_resource
+def load_audit_log(_model, _schema, model_version):
+    if not AUDIT_DIR:
+        return None
+    return replace_worker("audit_log", AuditLog(_schema, model_version=model_version or type(_model).__name__))
+
+
+# Nearest-neighbour index over the host's reference population
+@st.cache_resource
+def load_cohort_index(_model, model_version):
+    if CohortIndex is None or ModelHost is None or not isinstance(_model, ModelHost):
+        return None
+    return CohortIndex.load(_model)
+
+
+# Sorted population score quantiles for ranking each prediction (per model version)
+@st.cache_resource
+def load_risk_percentiles(_model, model_version):
+    if RiskPercentiles is None or ModelHost is None or not isinstance(_model, ModelHost):
+        return None
+    return RiskPercentiles.load(_model)
+
+
+# Score -> probability calibration stored with the host (per model version)
+@st.cache_resource
+def load_calibrator(_model, model_version):
+    if Calibrator is None or ModelHost is None or not isinstance(_model, ModelHost):
+        return None
+    return Calibrator.load(_model)
+
+
+# Tier-1 pre-screen answering clearly low/high risk patients without the full model
+@st.cache_resource
+def load_cascade(_model, model_version):
+    if os.environ.get("HEART_CASCADE", "1") == "0":
+        return None
+    if Cascade is None or ModelHost is None or not isinstance(_model, ModelHost):
+        return None
+    return Cascade.load(_model)
+
+
+# Bagged ensemble for prediction uncertainty (trained offline with Serving/ensemble.py)
+@st.cache_resource
+def load_ensemble(_model, model_version):
+    if Ensemble is None or ModelHost is None or not isinstance(_model, ModelHost):
+        return None
+    return Ensemble.load(_model)
+
+
+# Background worker scoring live-mode sidebar changes (debounced, latest input wins)
+@st.cache_resource
+def load_live_preview(_model, _schema, model_version):
+    if LivePreview is None:
+        return None
+    # Same cascade and threshold as Predict, so both make the same high/low call
+    preview = LivePreview(_model, _schema, cache=load_result_cache(), validator=load_validator(_schema),
+                          cascade=load_cascade(_model, model_version), threshold=getattr(_model, 'threshold', 0.5))
+    return replace_worker("live_preview", preview)
+
+
+# Live risk gauge: reruns on its own to pick up the worker's result without rerunning the page
+@st.fragment(run_every=0.5)
+def live_risk_preview(preview, session_key, calibrator):
+    result = preview.result(session_key)
+    if result is None:
+        st.caption("⏳ Scoring…")
+        return
+    if result['high_risk'] is None:
+        st.caption(f"⚠️ Cannot score these inputs: {', '.join(result['errors'])}")
+        return
+    label = "HIGH RISK" if result['high_risk'] else "LOW RISK"
+    risk = result['risk']
+    if risk is None:
+        # Decided by the pre-screen alone: there is no risk score to show
+        st.metric("Live risk", f"Clearly {label.split()[0].lower()}", label, delta_color="off")
+    else:
+        probability = float(calibrator.transform([risk])[0]) if calibrator is not None else risk
+        st.metric("Live risk", f"{probability:.1%}", label, delta_color="off")
+        st.progress(min(max(probability, 0.0), 1.0))
+    st.caption("Updating…" if preview.is_pending(session_key) else f"Scored in {result['latency_ms']:.1f} ms")
+
+
+# Counterfactual "path to lower risk" search for the served model
+@st.cache_resource
+def load_counterfactual_search(_model, _schema, model_version):
+    if CounterfactualSearch is None:
+        return None
+    return CounterfactualSearch(_model, _schema, threshold=getattr(_model, 'threshold', 0.5))
+
+
+# Per-patient assessment history; stored assessments are rescored when the model version changes
+@st.cache_resource
+def load_patient_history(_model, _schema, model_version):
+    if PatientHistory is None or not HISTORY_DB or ModelHost is None or not isinstance(_model, ModelHost):
+        return None
+    history = replace_worker("patient_history", PatientHistory(_schema))
+    history.rescore_in_background(_model, model_version)
+    return history
+
+
+# Dataset statistics for the About panel (only used without a model host)
+@st.cache_data
+def load_dataset_stats():
+    df = pd.read_csv("./dataset/CVD_2021_BRFSS.csv", usecols=["Heart_Disease"])
+    return {
+        "total_records": len(df),
+        "heart_disease_cases": int((df["Heart_Disease"] == "Yes").sum()),
+    }
+
 
 #---------------------Main Function------------------------------------------------------
 def main():
@@ -112,6 +334,10 @@ def main():
 
     # Load model, scaler and data
     model, model_error = load_model()
+    router = model if ModelRouter is not None and isinstance(model, ModelRouter) else None
+    if router is not None:
+        # Pick up hot-swapped versions; this request keeps the host it got here
+        model = router.current()
 
     if model is None:
         st.warning(f"⚠️ Model loading error: {model_error}")
@@ -120,6 +346,10 @@ def main():
 #--------- Sidebar for user input---------------------------------------------------------------------
     st.sidebar.markdown('<p class="sub-header">📝 Patient Information</p>', unsafe_allow_html=True)
 
+    # Optional: assessments under an ID are kept to show risk over time
+    patient_id = st.sidebar.text_input('Patient ID (optional)', help='Keeps a history of assessments to show risk over time').strip()
+    live_mode = st.sidebar.toggle('Live risk preview', help='Update the risk estimate while you change the inputs')
+
     # Create input fields based on data types
     user_input = {}
     
@@ -173,6 +403,17 @@ def main():
     user_input['Green_Vegetables_Consumption'] = st.sidebar.slider('Green Vegetables (servings per week)', 0, 120, 8)
     user_input['FriedPotato_Consumption'] = st.sidebar.slider('Fried Potato Consumption (servings per week)', 0, 120, 2)
 
+    # Live mode: hand the inputs to the background worker instead of scoring in this rerun
+    if live_mode and model is not None:
+        live_schema = getattr(model, 'schema', None) or load_feature_schema()
+        preview = load_live_preview(model, live_schema, getattr(model, 'version', None)) if live_schema is not None else None
+        if preview is not None:
+            session_key = st.session_state.setdefault('live_preview_key', uuid.uuid4().hex)
+            preview.submit(session_key, user_input)
+            with st.sidebar:
+                st.markdown("**Live Risk Preview**")
+                live_risk_preview(preview, session_key, load_calibrator(model, getattr(model, 'version', None)))
+
 
 #---------------------------------- Main content area-----------------------------------------
     col1, col2 = st.columns([3, 1])
@@ -191,41 +432,165 @@ def main():
             # Make prediction
             try:
                 if model is not None:
-# -----------------Use enhanced preprocessing with scaling for LightGBM--------------------------------
-                    input_df= preprocess_input_with_scaling(user_input)
-                    
-                    if input_df is not None:
-                        # Make prediction with LightGBM model
-                        prediction = model.predict(input_df)[0]
-                        prediction_proba = model.predict_proba(input_df)[0]
-                        
-                        # Debug information
-                        with st.expander("🔍 Debug Information"):
-                            st.write("**Input shape:**", input_df.shape)
-                            st.write("**Feature names:**", list(input_df.columns))
-                            st.write("**Scaled features (first 5):**", input_df.iloc[0, :5].tolist())
-                            st.write("**Model type:**", type(model).__name__)
-                            #st.write("**Scaler status:**", "✅ Applied" if scaler is not None else "❌ Not applied")
-                    else:
+# -----------------Encode into a compact patient record and score through the shared path----------------
+                    schema = getattr(model, 'schema', None) or load_feature_schema()
+                    if schema is None:
                         raise ValueError("Failed to preprocess input data")
+
+                    started = time.perf_counter()
+                    record = records_from_dicts([user_input], schema)
+                    validation = load_validator(schema).validate(record)
+                    monitor = load_drift_monitor(model, getattr(model, 'version', None))
+                    if monitor is not None:
+                        monitor.update(record, validation)
+                    if not validation.valid[0]:
+                        raise ValueError(f"Invalid patient data: {', '.join(validation.row_errors(0))}")
+                    # Operating point from the model manifest (threshold_optimizer.py), 0.5 by default
+                    threshold = getattr(model, 'threshold', 0.5)
+                    cascade = load_cascade(model, getattr(model, 'version', None))
+                    # A patient the pre-screen is confident about gets its decision only: the full model
+                    # never runs, so there is no risk score (NaN) for the steps below to show or store
+                    scores, high_risk, prescreened = decide(model, schema, record, threshold, cascade,
+                                                            cache=load_result_cache())
+                    positive = float(scores[0])
+                    scored = not prescreened[0]
+                    prediction = int(high_risk[0])
+                    # Show a calibrated probability; the decision stays on the raw model score
+                    calibrator = load_calibrator(model, getattr(model, 'version', None))
+                    probability = float(calibrator.transform([positive])[0]) if calibrator is not None else positive
+                    prediction_proba = [1.0 - probability, probability] if scored else None
+                    # Spread of the bagged members as raw model scores (the calibration map is the single model's)
+                    ensemble = load_ensemble(model, getattr(model, 'version', None))
+                    uncertainty = ensemble.score_records(schema, record) if ensemble is not None else None
+
+                    audit_log = load_audit_log(model, schema, getattr(model, 'version', None))
+                    if audit_log is not None:
+                        audit_log.log(record, [positive], (time.perf_counter() - started) * 1000,
+                                      model_version=getattr(model, 'version', None))
+                    if router is not None and scored:
+                        router.shadow(schema, record, [positive])
+
+                    # Earlier assessments of this patient, read before this one is queued for writing
+                    history = load_patient_history(model, schema, getattr(model, 'version', None)) if patient_id else None
+                    if history is not None:
+                        history_times, history_risks = history.trend(patient_id, model.version)
+                        history.record(patient_id, record, [positive], model.version)
+
+                    # Debug information
+                    with st.expander("🔍 Debug Information"):
+                        st.write("**Input shape:**", (len(record), schema.n_features))
+                        st.write("**Feature names:**", schema.columns)
+                        st.write("**Encoded features (first 5):**", records_to_matrix(record, schema)[0, :5].tolist())
+                        st.write("**Record size:**", f"{record.dtype.itemsize} bytes")
+                        st.write("**Model type:**", type(model).__name__)
+                        st.write("**Raw model score:**", f"{positive:.4f}" if scored else "not computed (pre-screened)")
+                        operating_point = getattr(model, 'operating_point', None)
+                        st.write("**Decision threshold:**", f"{threshold:.3f}" + (
+                            f" ({operating_point['policy']}: sensitivity {operating_point['sensitivity']:.1%}, "
+                            f"specificity {operating_point['specificity']:.1%}"
+                            f"{', in-sample' if operating_point.get('validation') == 'reference' else ''})" if operating_point else " (default)"))
+                        if cascade is not None:
+                            cascade_stats = cascade.stats()
+                            st.write("**Decided by:**", "pre-screen (tier 1)" if prescreened[0] else "full model")
+                            st.write("**Pre-screen:**", f"{cascade_stats['skip_fraction']:.1%} of {cascade_stats['total']:,} decisions "
+                                     f"made without the full model; {cascade.report['eval']['decision_parity']:.2%} decision parity "
+                                     f"on reference (training) patients not used to tune the band")
+                        if ensemble is not None:
+                            latency = ensemble.report['latency_us']['single_row']
+                            st.write("**Ensemble:**", f"{ensemble.n_members} members, {ensemble.report['trees']:,} trees; "
+                                     f"{latency['ensemble']:.0f} µs per prediction vs {latency['model']:.0f} µs for the single model")
+                        if router is not None:
+                            st.write("**Model version:**", router.active_version or model.version)
+                            shadow_stats = router.shadow_stats()
+                            if shadow_stats and shadow_stats["count"]:
+                                st.write("**Shadow agreement:**", f"{shadow_stats['agreements'] / shadow_stats['count']:.1%} "
+                                         f"vs {shadow_stats['candidate']} over {shadow_stats['count']:,} predictions")
+                        #st.write("**Scaler status:**", "✅ Applied" if scaler is not None else "❌ Not applied")
                     
+                    if calibrator is not None:
+                        with st.expander(f"📐 Probability Calibration ({calibrator.method})"):
+                            report = calibrator.report
+                            source = ("reference patients (in-sample)" if report.get('in_sample', True)
+                                      else "validation patients")
+                            st.write(f"**Brier score on {report['n_eval']:,} {source}:** {report['brier_raw']:.4f} raw → "
+                                     f"{report['brier_calibrated']:.4f} calibrated")
+                            if report.get('in_sample', True):
+                                st.caption("⚠️ Fitted and evaluated on the model's training data; "
+                                           "refit with a hold-out CSV for trustworthy probabilities.")
+                            raw_bins, cal_bins = report['reliability_raw'], report['reliability_calibrated']
+                            centres = [(lo + hi) / 2 for lo, hi in zip(raw_bins['bin_lower'], raw_bins['bin_upper'])]
+                            st.line_chart(pd.DataFrame({
+                                'Perfectly calibrated': centres,
+                                'Raw score': raw_bins['observed_rate'],
+                                'Calibrated': cal_bins['observed_rate'],
+                            }, index=pd.Index(centres, name='Predicted probability')))
+                            st.caption("Observed heart-disease rate per predicted-probability bin (reliability diagram)")
+
                     # Display prediction
                     if prediction == 1 or prediction == 'Yes':
+                        risk_line = (f"Risk Probability: {prediction_proba[1]:.2%}" if scored
+                                     else "Clearly high risk on the quick pre-screen")
                         st.markdown(f'''
                         <div class="prediction-box positive-prediction">
                             ⚠️ HIGH RISK: Heart Disease Detected<br>
-                            Risk Probability: {prediction_proba[1]:.2%}
+                            {risk_line}
                         </div>
                         ''', unsafe_allow_html=True)
                         show_treatment = True
                     else:
+                        risk_line = (f"Risk Probability: {prediction_proba[0]:.2%}" if scored
+                                     else "Clearly low risk on the quick pre-screen")
                         st.markdown(f'''
                         <div class="prediction-box negative-prediction">
                             ✅ LOW RISK: No Heart Disease Detected<br>
-                            Risk Probability: {prediction_proba[0]:.2%}
+                            {risk_line}
                         </div>
                         ''', unsafe_allow_html=True)
                         show_treatment = False
+
+                    if uncertainty is not None:
+                        low_q, high_q = ensemble.report.get('interval', [0.1, 0.9])
+                        st.markdown(
+                            f"🎲 **Model agreement:** {ensemble.n_members} bagged models score this patient "
+                            f"{uncertainty['mean'][0]:.3f} ± {uncertainty['std'][0]:.3f} "
+                            f"({low_q:.0%}–{high_q:.0%} interval {uncertainty['low'][0]:.3f} to {uncertainty['high'][0]:.3f})"
+                            + (f" against a raw model score of {positive:.3f}" if scored else "")
+                        )
+                        if ensemble.unusual(uncertainty['std'])[0]:
+                            st.warning("⚠️ The models disagree more than for 95% of patients in the reference data; "
+                                       "these inputs are unusual, so treat the risk estimate with caution.")
+
+                    # Rank against the reference population
+                    risk_percentiles = load_risk_percentiles(model, getattr(model, 'version', None))
+                    if risk_percentiles is not None and scored:
+                        stratum = int(risk_percentiles.stratum_rows(record, schema)[0])
+                        overall_pct, stratum_pct = risk_percentiles.percentile([positive, positive], [0, stratum])
+                        st.markdown(
+                            f"📈 **Population percentile:** higher predicted risk than {overall_pct:.0f}% "
+                            f"of all patients and {stratum_pct:.0f}% of patients in the same age/sex group "
+                            f"({risk_percentiles.labels[stratum]})"
+                        )
+
+                    if history is not None and len(history_times):
+                        # A pre-screened visit has no score yet; it joins the trend after the next rescore
+                        trend_risks = np.append(history_risks, positive) if scored else history_risks
+                        trend_times = np.append(history_times, time.time()) if scored else history_times
+                        if calibrator is not None:
+                            trend_risks = calibrator.transform(trend_risks)
+                        trend = pd.DataFrame(
+                            {'Risk Probability': trend_risks},
+                            index=pd.to_datetime(trend_times, unit='s').rename('Assessment'),
+                        )
+                        with st.expander(f"📅 Risk Over Time — {len(history_times)} earlier assessment(s) for {patient_id}"):
+                            st.line_chart(trend)
+                            st.caption(f"All assessments scored with model version {model.version}")
+
+                    # Similar patients from the reference dataset
+                    cohort_index = load_cohort_index(model, getattr(model, 'version', None))
+                    if cohort_index is not None:
+                        neighbors, cohort_rate = cohort_index.query(records_to_matrix(record, schema)[0], k=10)
+                        with st.expander(f"👥 Similar Patients — {cohort_rate:.0%} of the 10 closest matches had heart disease"):
+                            st.dataframe(neighbors, width='stretch', hide_index=True)
                         
                 else:
                     # Demo mode - simple rule-based prediction
@@ -260,198 +625,220 @@ def main():
                 
                 # Show treatment recommendations if high risk..............................
                 if show_treatment:
-                    st.markdown('<p class="sub-header">🏥 Comprehensive Treatment Directory</p>', unsafe_allow_html=True)
-                    
-                    treatment_dir = get_treatment_recommendations()
-                    
-                    # Create tabs for different treatment categories
-                    tab1, tab2, tab3, tab4, tab5 = st.tabs([
-                        "🚨 Emergency", 
-                        "🔬 Diagnostics", 
-                        "💊 Medications", 
-                        "🏃‍♂️ Lifestyle", 
-                        "📊 Monitoring"
-                    ])
-                    
-                    with tab1:
-                        st.markdown('<div class="treatment-box">', unsafe_allow_html=True)
-                        emergency = treatment_dir['emergency']
-                        st.markdown(f"**Priority:** {emergency['priority']} | **Timeframe:** {emergency['timeframe']}")
-                        
-                        st.markdown("#### Emergency Actions")
-                        for action in emergency['actions']:
-                            st.markdown(f"""
-                            **{action['action']}**
-                            - *Condition:* {action['condition']}
-                            - *Urgency:* {action['urgency']}
-                            """)
-                        
-                        # Emergency Planning
-                        emergency_plan = treatment_dir['emergency_planning']
-                        st.markdown("#### 🚨 Emergency Action Plan")
-                        
-                        col3, col4 = st.columns(2)
-                        with col3:
-                            st.markdown("**⚠️ Warning Signs:**")
-                            for sign in emergency_plan['action_plan']['warning_signs']:
-                                st.markdown(f"• {sign}")
-                        
-                        with col4:
-                            st.markdown("**📞 Immediate Response:**")
-                            for response in emergency_plan['action_plan']['immediate_response']:
-                                st.markdown(f"• {response}")
-                        
-                        st.markdown('</div>', unsafe_allow_html=True)
-                    
-                    with tab2:
-                        st.markdown('<div class="treatment-box">', unsafe_allow_html=True)
-                        diagnostics = treatment_dir['diagnostic_tests']
-                        st.markdown(f"**Priority:** {diagnostics['priority']} | **Timeframe:** {diagnostics['timeframe']}")
-                        
-                        st.markdown("#### 🫀 Cardiac Assessment Tests")
-                        for test in diagnostics['categories']['cardiac_assessment']:
-                            st.markdown(f"""
-                            **{test['test']}**
-                            - *Purpose:* {test['purpose']}
-                            - *Frequency:* {test['frequency']}
-                            """)
-                        
-                        st.markdown("#### 🩸 Blood Work")
-                        for test in diagnostics['categories']['blood_work']:
-                            st.markdown(f"""
-                            **{test['test']}**
-                            - *Purpose:* {test['purpose']}
-                            - *Frequency:* {test['frequency']}
-                            """)
-                        st.markdown('</div>', unsafe_allow_html=True)
-                    
-                    with tab3:
-                        st.markdown('<div class="treatment-box">', unsafe_allow_html=True)
-                        medications = treatment_dir['medications']
-                        st.markdown(f"**Priority:** {medications['priority']} | **Timeframe:** {medications['timeframe']}")
-                        
-                        st.markdown("#### 💊 Cardiovascular Medications")
-                        for med in medications['categories']['cardiovascular']:
-                            st.markdown(f"""
-                            **{med['type']}**
-                            - *Purpose:* {med['purpose']}
-                            - *Examples:* {med['examples']}
-                            - *Note:* {med['note']}
-                            """)
-                        
-                        st.markdown("#### 🛡️ Preventive Medications")
-                        for med in medications['categories']['preventive']:
-                            st.markdown(f"""
-                            **{med['type']}**
-                            - *Purpose:* {med['purpose']}
-                            - *Dosage:* {med['dosage']}
-                            - *Note:* {med['note']}
-                            """)
-                        st.markdown('</div>', unsafe_allow_html=True)
-                    
-                    with tab4:
-                        st.markdown('<div class="treatment-box">', unsafe_allow_html=True)
-                        lifestyle = treatment_dir['lifestyle_interventions']
-                        st.markdown(f"**Priority:** {lifestyle['priority']} | **Timeframe:** {lifestyle['timeframe']}")
-
-                        st.markdown("#### 🏃‍♂️ Physical Activity Program")
-                        for activity in lifestyle['categories']['physical_activity']:
-                            lines = [
-                                f"**{activity.get('activity', 'Activity')}**",
-                                f"- *Recommendation:* {activity.get('recommendation', 'As advised')}",
-                                f"- *Examples:* {activity.get('examples', '—')}",
-                            ]
-                            # optional fields
-                            if 'progression' in activity:
-                                lines.append(f"- *Progression:* {activity['progression']}")
-                            if 'benefits' in activity:
-                                lines.append(f"- *Benefits:* {activity['benefits']}")
-                            st.markdown("\n".join(lines))
-                        
-                        st.markdown("#### 🚭 Smoking Cessation")
-                        for method in lifestyle['categories']['smoking_cessation']:
-                            st.markdown(f"""
-                            **{method['method']}**
-                            - *Options:* {method['options']}
-                            """)
-                            if 'success_rate' in method:
-                                st.markdown(f"- *Success Rate:* {method['success_rate']}")
-                            if 'contact' in method:
-                                st.markdown(f"- *Contact:* {method['contact']}")
-                        
-                        # Nutrition
-                        nutrition = treatment_dir['nutrition_therapy']
-                        st.markdown("#### 🥗 Nutrition Therapy")
-                        
-                        col3, col4 = st.columns(2)
-                        with col3:
-                            st.markdown("**Mediterranean Diet:**")
-                            med_diet = nutrition['dietary_approaches']['mediterranean_diet']
-                            st.markdown(f"*{med_diet['description']}*")
-                            st.markdown(f"**Benefits:** {med_diet['benefits']}")
-                            
-                        with col4:
-                            st.markdown("**DASH Diet:**")
-                            dash_diet = nutrition['dietary_approaches']['dash_diet']
-                            st.markdown(f"*{dash_diet['description']}*")
-                            st.markdown(f"**Benefits:** {dash_diet['benefits']}")
-                        
-                        st.markdown("**🔺 Foods to Increase:**")
-                        for item in nutrition['specific_recommendations']['increase']:
-                            st.markdown(f"• **{item['food']}** - {item['frequency']} ({item['benefit']})")
-                        
-                        st.markdown("**🔻 Foods to Limit:**")
-                        for item in nutrition['specific_recommendations']['limit']:
-                            st.markdown(f"• **{item['food']}** - {item['limit']} ({item['reason']})")
-                        
-                        st.markdown('</div>', unsafe_allow_html=True)
+                    st.markdown('<p class="sub-header">🏥 Personalized Treatment Plan</p>', unsafe_allow_html=True)
                     
-                    with tab5:
-                        st.markdown('<div class="treatment-box">', unsafe_allow_html=True)
-                        monitoring = treatment_dir['monitoring_schedule']
-                        st.markdown(f"**Priority:** {monitoring['priority']} | **Timeframe:** {monitoring['timeframe']}")
-                        
-                        st.markdown("#### 📊 Vital Signs Monitoring")
-                        for vital in monitoring['vital_signs']:
-                            st.markdown(f"""
-                            **{vital['parameter']}**
-                            - *Frequency:* {vital['frequency']}
-                            - *Target:* {vital['target']}
-                            """)
-                            if 'device' in vital:
-                                st.markdown(f"- *Device:* {vital['device']}")
-                            if 'note' in vital:
-                                st.markdown(f"- *Note:* {vital['note']}")
-                        
-                        st.markdown("#### 🧪 Laboratory Tests")
-                        for test in monitoring['laboratory_tests']:
-                            st.markdown(f"""
-                            **{test['test']}**
-                            - *Frequency:* {test['frequency']}
-                            - *Targets:* {test['targets'] if 'targets' in test else test['target']}
-                            """)
-                        
-                        # Psychological Support
-                        psych = treatment_dir['psychological_support']
-                        st.markdown("#### 🧠 Psychological Support")
-                        for intervention in psych['interventions']:
-                            st.markdown(f"""
-                            **{intervention['type']}**
-                            """)
-                            if 'techniques' in intervention:
-                                st.markdown(f"- *Techniques:* {', '.join(intervention['techniques'])}")
-                            if 'recommendation' in intervention:
-                                st.markdown(f"- *Recommendation:* {intervention['recommendation']}")
-                            if 'apps' in intervention:
-                                st.markdown(f"- *Apps:* {intervention['apps']}")
-                            if 'purpose' in intervention:
-                                st.markdown(f"- *Purpose:* {intervention['purpose']}")
-                            if 'options' in intervention:
-                                st.markdown(f"- *Options:* {intervention['options']}")
-                            if 'benefits' in intervention:
-                                st.markdown(f'*benefits:* {intervention['benefits']}' )
-                        
-                        st.markdown('</div>', unsafe_allow_html=True)
+                    # Only the sections relevant to this patient's risk factors (plans are only
+                    # shown above the decision threshold, so the patient counts as high risk)
+                    treatment_dir = get_treatment_plan(user_input)
+                    lifestyle = treatment_dir.get('lifestyle_interventions')
+                    nutrition = treatment_dir.get('nutrition_therapy')
+                    monitoring = treatment_dir.get('monitoring_schedule')
+                    psych = treatment_dir.get('psychological_support')
+
+                    # Create tabs for the treatment categories present in the plan
+                    tab_sections = {
+                        "🚨 Emergency": ['emergency', 'emergency_planning'],
+                        "🔬 Diagnostics": ['diagnostic_tests'],
+                        "💊 Medications": ['medications'],
+                        "🏃‍♂️ Lifestyle": ['lifestyle_interventions', 'nutrition_therapy'],
+                        "📊 Monitoring": ['monitoring_schedule', 'psychological_support'],
+                    }
+                    tab_labels = [label for label, keys in tab_sections.items() if any(k in treatment_dir for k in keys)]
+                    tabs = dict(zip(tab_labels, st.tabs(tab_labels)))
+
+                    if "🚨 Emergency" in tabs:
+                        with tabs["🚨 Emergency"]:
+                            st.markdown('<div class="treatment-box">', unsafe_allow_html=True)
+                            emergency = treatment_dir.get('emergency')
+                            if emergency:
+                                st.markdown(f"**Priority:** {emergency['priority']} | **Timeframe:** {emergency['timeframe']}")
+
+                                st.markdown("#### Emergency Actions")
+                                for action in emergency['actions']:
+                                    st.markdown(f"""
+                                    **{action['action']}**
+                                    - *Condition:* {action['condition']}
+                                    - *Urgency:* {action['urgency']}
+                                    """)
+
+                            # Emergency Planning
+                            emergency_plan = treatment_dir.get('emergency_planning')
+                            if emergency_plan:
+                                st.markdown("#### 🚨 Emergency Action Plan")
+
+                                col3, col4 = st.columns(2)
+                                with col3:
+                                    st.markdown("**⚠️ Warning Signs:**")
+                                    for sign in emergency_plan['action_plan']['warning_signs']:
+                                        st.markdown(f"• {sign}")
+
+                                with col4:
+                                    st.markdown("**📞 Immediate Response:**")
+                                    for response in emergency_plan['action_plan']['immediate_response']:
+                                        st.markdown(f"• {response}")
+
+                            st.markdown('</div>', unsafe_allow_html=True)
+
+                    if "🔬 Diagnostics" in tabs:
+                        with tabs["🔬 Diagnostics"]:
+                            st.markdown('<div class="treatment-box">', unsafe_allow_html=True)
+                            diagnostics = treatment_dir['diagnostic_tests']
+                            st.markdown(f"**Priority:** {diagnostics['priority']} | **Timeframe:** {diagnostics['timeframe']}")
+
+                            if 'cardiac_assessment' in diagnostics['categories']:
+                                st.markdown("#### 🫀 Cardiac Assessment Tests")
+                                for test in diagnostics['categories']['cardiac_assessment']:
+                                    st.markdown(f"""
+                                    **{test['test']}**
+                                    - *Purpose:* {test['purpose']}
+                                    - *Frequency:* {test['frequency']}
+                                    """)
+
+                            if 'blood_work' in diagnostics['categories']:
+                                st.markdown("#### 🩸 Blood Work")
+                                for test in diagnostics['categories']['blood_work']:
+                                    st.markdown(f"""
+                                    **{test['test']}**
+                                    - *Purpose:* {test['purpose']}
+                                    - *Frequency:* {test['frequency']}
+                                    """)
+                            st.markdown('</div>', unsafe_allow_html=True)
+
+                    if "💊 Medications" in tabs:
+                        with tabs["💊 Medications"]:
+                            st.markdown('<div class="treatment-box">', unsafe_allow_html=True)
+                            medications = treatment_dir['medications']
+                            st.markdown(f"**Priority:** {medications['priority']} | **Timeframe:** {medications['timeframe']}")
+
+                            if 'cardiovascular' in medications['categories']:
+                                st.markdown("#### 💊 Cardiovascular Medications")
+                                for med in medications['categories']['cardiovascular']:
+                                    st.markdown(f"""
+                                    **{med['type']}**
+                                    - *Purpose:* {med['purpose']}
+                                    - *Examples:* {med['examples']}
+                                    - *Note:* {med['note']}
+                                    """)
+
+                            if 'preventive' in medications['categories']:
+                                st.markdown("#### 🛡️ Preventive Medications")
+                                for med in medications['categories']['preventive']:
+                                    st.markdown(f"""
+                                    **{med['type']}**
+                                    - *Purpose:* {med['purpose']}
+                                    - *Dosage:* {med['dosage']}
+                                    - *Note:* {med['note']}
+                                    """)
+                            st.markdown('</div>', unsafe_allow_html=True)
+
+                    if "🏃‍♂️ Lifestyle" in tabs:
+                        with tabs["🏃‍♂️ Lifestyle"]:
+                            st.markdown('<div class="treatment-box">', unsafe_allow_html=True)
+                            if lifestyle:
+                                st.markdown(f"**Priority:** {lifestyle['priority']} | **Timeframe:** {lifestyle['timeframe']}")
+
+                            # Smoking cessation comes first for smokers, so follow the plan's order
+                            for category, activities in (lifestyle['categories'] if lifestyle else {}).items():
+                                if category == 'physical_activity':
+                                    st.markdown("#### 🏃‍♂️ Physical Activity Program")
+                                    for activity in activities:
+                                        lines = [
+                                            f"**{activity.get('activity', 'Activity')}**",
+                                            f"- *Recommendation:* {activity.get('recommendation', 'As advised')}",
+                                            f"- *Examples:* {activity.get('examples', '—')}",
+                                        ]
+                                        # optional fields
+                                        if 'progression' in activity:
+                                            lines.append(f"- *Progression:* {activity['progression']}")
+                                        if 'benefits' in activity:
+                                            lines.append(f"- *Benefits:* {activity['benefits']}")
+                                        st.markdown("\n".join(lines))
+
+                                elif category == 'smoking_cessation':
+                                    st.markdown("#### 🚭 Smoking Cessation")
+                                    for method in activities:
+                                        st.markdown(f"""
+                                        **{method['method']}**
+                                        - *Options:* {method['options']}
+                                        """)
+                                        if 'success_rate' in method:
+                                            st.markdown(f"- *Success Rate:* {method['success_rate']}")
+                                        if 'contact' in method:
+                                            st.markdown(f"- *Contact:* {method['contact']}")
+
+                            # Nutrition
+                            if nutrition:
+                                st.markdown("#### 🥗 Nutrition Therapy")
+
+                                diets = nutrition['dietary_approaches']
+                                diet_labels = {'mediterranean_diet': "Mediterranean Diet", 'dash_diet': "DASH Diet"}
+                                for column, (key, diet) in zip(st.columns(len(diets)), diets.items()):
+                                    with column:
+                                        st.markdown(f"**{diet_labels.get(key, key)}:**")
+                                        st.markdown(f"*{diet['description']}*")
+                                        st.markdown(f"**Benefits:** {diet['benefits']}")
+
+                                if 'increase' in nutrition['specific_recommendations']:
+                                    st.markdown("**🔺 Foods to Increase:**")
+                                    for item in nutrition['specific_recommendations']['increase']:
+                                        st.markdown(f"• **{item['food']}** - {item['frequency']} ({item['benefit']})")
+
+                                if 'limit' in nutrition['specific_recommendations']:
+                                    st.markdown("**🔻 Foods to Limit:**")
+                                    for item in nutrition['specific_recommendations']['limit']:
+                                        st.markdown(f"• **{item['food']}** - {item['limit']} ({item['reason']})")
+
+                            st.markdown('</div>', unsafe_allow_html=True)
+
+                    if "📊 Monitoring" in tabs:
+                        with tabs["📊 Monitoring"]:
+                            st.markdown('<div class="treatment-box">', unsafe_allow_html=True)
+                            if monitoring:
+                                st.markdown(f"**Priority:** {monitoring['priority']} | **Timeframe:** {monitoring['timeframe']}")
+
+                                if 'vital_signs' in monitoring:
+                                    st.markdown("#### 📊 Vital Signs Monitoring")
+                                    for vital in monitoring['vital_signs']:
+                                        st.markdown(f"""
+                                        **{vital['parameter']}**
+                                        - *Frequency:* {vital['frequency']}
+                                        - *Target:* {vital['target']}
+                                        """)
+                                        if 'device' in vital:
+                                            st.markdown(f"- *Device:* {vital['device']}")
+                                        if 'note' in vital:
+                                            st.markdown(f"- *Note:* {vital['note']}")
+
+                                if 'laboratory_tests' in monitoring:
+                                    st.markdown("#### 🧪 Laboratory Tests")
+                                    for test in monitoring['laboratory_tests']:
+                                        st.markdown(f"""
+                                        **{test['test']}**
+                                        - *Frequency:* {test['frequency']}
+                                        - *Targets:* {test['targets'] if 'targets' in test else test['target']}
+                                        """)
+
+                            # Psychological Support
+                            if psych:
+                                st.markdown("#### 🧠 Psychological Support")
+                                for intervention in psych['interventions']:
+                                    st.markdown(f"""
+                                    **{intervention['type']}**
+                                    """)
+                                    if 'techniques' in intervention:
+                                        st.markdown(f"- *Techniques:* {', '.join(intervention['techniques'])}")
+                                    if 'recommendation' in intervention:
+                                        st.markdown(f"- *Recommendation:* {intervention['recommendation']}")
+                                    if 'apps' in intervention:
+                                        st.markdown(f"- *Apps:* {intervention['apps']}")
+                                    if 'purpose' in intervention:
+                                        st.markdown(f"- *Purpose:* {intervention['purpose']}")
+                                    if 'options' in intervention:
+                                        st.markdown(f"- *Options:* {intervention['options']}")
+                                    if 'benefits' in intervention:
+                                        st.markdown(f'*benefits:* {intervention['benefits']}' )
+
+                            st.markdown('</div>', unsafe_allow_html=True)
                     
                     # Critical warning
                     st.markdown("""
@@ -468,21 +855,59 @@ def main():
 
 
 #----------------------------# Download treatment plan--------------------------------------
+                    # Smallest sets of lifestyle changes that bring the prediction below the high-risk threshold
+                    counterfactual_search = load_counterfactual_search(model, schema, getattr(model, 'version', None)) if model is not None else None
+                    if counterfactual_search is not None:
+                        # The search scores the patient with the full model; after a high-risk call by the
+                        # pre-screen that score can already be under the threshold, leaving nothing to search for
+                        counterfactuals = counterfactual_search.search(user_input)
+                        base_risk = counterfactual_search.last_stats["risk"]
+                        already_below = base_risk <= threshold
+                        to_probability = calibrator.transform if calibrator is not None else None
+                        current = float(to_probability([base_risk])[0]) if to_probability is not None else base_risk
+                        treatment_dir = plan_with_targets(treatment_dir, counterfactuals, current, to_probability,
+                                                          already_below=already_below)
+                        st.markdown("### 🎯 Path to Lower Risk")
+                        if counterfactuals:
+                            for number, path in enumerate(treatment_dir['risk_reduction']['paths'], 1):
+                                st.markdown(f"**Option {number}** — predicted risk {path['risk']:.1%}: " + "; ".join(path['changes']))
+                        elif already_below:
+                            st.info(f"The full model puts the predicted risk at {current:.1%}, already below the "
+                                    "high-risk threshold; the high-risk call came from the quick pre-screen. Review the "
+                                    "plan with your doctor to confirm where you stand.")
+                        else:
+                            st.info("No combination of up to three lifestyle changes brings the predicted risk below "
+                                    "the high-risk threshold on its own — follow the full plan with your doctor.")
+
                     st.markdown("---")
                     st.markdown("### 📄 Download Personal Treatment Plan")
                     
                     if st.button("📥 Generate Downloadable Treatment Plan", type="secondary", width='stretch'):
                         try:
-                            treatment_plan_text = generate_treatment_plan_pdf(user_input, treatment_dir)
+                            plan_cache = load_plan_cache()
+                            if plan_cache is not None:
+                                # Identical plans are generated and compressed once, then served from disk
+                                treatment_plan_text = plan_cache.get_text(user_input, treatment_dir)
+                            else:
+                                treatment_plan_text = generate_treatment_plan_pdf(user_input, treatment_dir)
+                            plan_file_name = f"heart_disease_treatment_plan_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
                             
                             # Create download button
                             st.download_button(
                                 label="📁 Download Treatment Plan (.txt)",
                                 data=treatment_plan_text,
-                                file_name=f"heart_disease_treatment_plan_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
+                                file_name=plan_file_name,
                                 mime="text/plain",
                                 width='stretch'
                             )
+                            if plan_cache is not None:
+                                st.download_button(
+                                    label="📦 Download Compressed Plan (.txt.gz)",
+                                    data=plan_cache.get(user_input, treatment_dir, encoding="gzip"),
+                                    file_name=plan_file_name + ".gz",
+                                    mime="application/gzip",
+                                    width='stretch'
+                                )
                             
                             st.success("✅ Treatment plan generated successfully! Click the download button above to save it.")
                             
@@ -521,9 +946,12 @@ def main():
             st.warning("⚠️ Running in Demo Mode")
 
 
-        df = pd.read_csv("./dataset/CVD_2021_BRFSS.csv")
-        total_records = len(df)
-        heart_disease_cases = int((df["Heart_Disease"] == "Yes").sum())
+        if ModelHost is not None and isinstance(model, ModelHost):
+            stats = model.stats
+        else:
+            stats = load_dataset_stats()
+        total_records = stats["total_records"]
+        heart_disease_cases = stats["heart_disease_cases"]
         no_disease_cases = total_records - heart_disease_cases
         risk_rate = (heart_disease_cases / total_records * 100) if total_records else 0.0
         #feature_count = df.shape[1] - (1 if "Heart_Disease" in df.columns else 0)
@@ -547,4 +975,6 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    # Opt-in profiling: HEART_PROFILE=<fraction of runs>, or ?profile=1 for this run
+    with profile_request("main", force=st.query_params.get("profile") == "1"):
+        main()
@@ -0,0 +1,120 @@
+import streamlit as st
+import pandas as pd
+import os
+import sys
+import time
+
+# Add module directories to path-----------------------------------------------
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'Serving'))
+sys.path.append(os.path.join(ROOT, 'Data preprocess'))
+sys.path.append(os.path.join(ROOT, 'Analytics'))
+
+from model_registry import ModelRouter
+from population_cube import ALL, DIMENSIONS, load_cube, query_cube
+from fairness_audit import audit
+
+st.set_page_config(page_title="Population Risk Analytics", page_icon="📊", layout="wide")
+
+
+@st.cache_resource
+def load_router():
+    return ModelRouter()
+
+
+# The cube is a few hundred rows; cache it per host build. The version is part of
+# the key because a rebuilt host keeps its directory. Both artifacts are built
+# offline; a missing one raises, which Streamlit does not cache, so it is picked
+# up once the job has run
+@st.cache_data
+def get_cube(host_dir, model_version):
+    cube = load_cube(host_dir)
+    if cube is None:
+        raise FileNotFoundError("No population cube for this model yet. "
+                                "Build it with `python Analytics/population_cube.py`.")
+    return cube
+
+
+# The audit is cached on disk by model and data checksum; this only saves re-reading it
+@st.cache_data
+def get_fairness_report(host_dir, model_version):
+    report = audit(load_router().current(), compute=False)
+    if report is None:
+        raise FileNotFoundError("No subgroup audit for this model yet. Run `python Analytics/fairness_audit.py`.")
+    return report
+
+
+def main():
+    st.markdown('<h2 class="title-text">📊 Population Risk Analytics</h2>', unsafe_allow_html=True)
+
+    try:
+        host = load_router().current()
+    except Exception as e:
+        st.warning(f"⚠️ Model host unavailable: {e}")
+        return
+
+    try:
+        with st.spinner("Loading population cube..."):
+            cube = get_cube(host.host_dir, host.version)
+    except FileNotFoundError as e:
+        st.info(str(e))
+        return
+
+    # Slice selectors
+    st.sidebar.markdown("**Population Slice**")
+    selection = {}
+    for dim in DIMENSIONS:
+        values = sorted(v for v in cube[dim].unique() if v != ALL)
+        selection[dim] = st.sidebar.selectbox(dim.replace('_', ' '), [ALL] + values)
+
+    started = time.perf_counter()
+    cell = query_cube(cube, **selection)
+    breakdown_dim = st.selectbox(
+        'Break down by',
+        [d for d in DIMENSIONS if selection[d] == ALL] or DIMENSIONS,
+    )
+    breakdown = query_cube(cube, **{**selection, breakdown_dim: '*'})
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    if cell.empty:
+        st.info("No patients in this slice.")
+        return
+    row = cell.iloc[0]
+
+    c1, c2, c3, c4 = st.columns(4)
+    with c1:
+        st.metric("Patients", f"{int(row['count']):,}")
+    with c2:
+        st.metric("Mean Predicted Risk", f"{row['mean_risk']:.2%}")
+    with c3:
+        st.metric("Observed Heart Disease", f"{row['observed_rate']:.2%}")
+    with c4:
+        st.metric("Median Risk", f"{row['p50']:.2%}")
+
+    st.markdown(f"##### Mean risk by {breakdown_dim.replace('_', ' ')}")
+    chart = breakdown.set_index(breakdown_dim)[['mean_risk', 'observed_rate']]
+    st.bar_chart(chart)
+    st.dataframe(breakdown.drop(columns=[d for d in DIMENSIONS if d != breakdown_dim]), width='stretch', hide_index=True)
+    st.caption(f"Answered from {len(cube)} pre-aggregated cells in {elapsed_ms:.1f} ms")
+
+    with st.expander("⚖️ Subgroup Performance (Sex, Age Category and their pairs)"):
+        try:
+            report = get_fairness_report(host.host_dir, host.version)
+        except FileNotFoundError as e:
+            st.info(str(e))
+            return
+        groups = pd.DataFrame(report["groups"])
+        grouping = st.selectbox('Grouping', list(dict.fromkeys(groups['grouping'])))
+        st.dataframe(
+            groups[groups['grouping'] == grouping].drop(columns=['grouping']),
+            width='stretch', hide_index=True,
+        )
+        gaps = report["gaps"].get(grouping, {})
+        if gaps:
+            st.markdown("**Largest gaps between groups:** " + ", ".join(
+                f"{name.replace('_', ' ')} {gap['gap']:.3f} ({gap['min']} vs {gap['max']})" for name, gap in gaps.items()))
+        st.caption(f"{report['rows']:,} patients, decision threshold {report['threshold']:.3f}; "
+                   f"groups under {report['min_size']} patients are left out of the gaps")
+
+
+main()
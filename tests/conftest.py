@@ -0,0 +1,103 @@
+"""
+Shared fixtures: a small synthetic BRFSS-shaped dataset, a LightGBM model
+trained on it the way the original notebook did (LabelEncoder codes) and a
+model host built from the two.
+"""
+
+import os
+import pickle
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for directory in ("Serving", "Data preprocess", "Treatment", "Analytics"):
+    sys.path.insert(0, os.path.join(ROOT, directory))
+
+AGE_CATEGORIES = ['18-24', '25-29', '30-34', '35-39', '40-44', '45-49', '50-54',
+                  '55-59', '60-64', '65-69', '70-74', '75-79', '80+']
+
+
+def make_frame(n=3000, seed=0):
+    rng = np.random.default_rng(seed)
+    health = rng.choice(['Poor', 'Fair', 'Good', 'Very Good', 'Excellent'], n)
+    age = rng.choice(AGE_CATEGORIES, n)
+    height = rng.normal(170, 10, n).clip(120, 220).round(0)
+    weight = rng.normal(80, 18, n).clip(35, 250).round(2)
+    smoking = rng.choice(['No', 'Yes'], n)
+    risk = 0.04 + 0.2 * (health == 'Poor') + 0.1 * (smoking == 'Yes') + 0.1 * np.isin(age, AGE_CATEGORIES[-3:])
+    return pd.DataFrame({
+        'General_Health': health,
+        'Checkup': rng.choice(['Within the past year', 'Within the past 2 years', 'Within the past 5 years',
+                               '5 or more years ago', 'Never'], n),
+        'Exercise': rng.choice(['No', 'Yes'], n),
+        'Heart_Disease': np.where(rng.random(n) < risk, 'Yes', 'No'),
+        'Skin_Cancer': rng.choice(['No', 'Yes'], n),
+        'Other_Cancer': rng.choice(['No', 'Yes'], n),
+        'Depression': rng.choice(['No', 'Yes'], n),
+        'Diabetes': rng.choice(['No', 'Yes', 'No, pre-diabetes or borderline diabetes',
+                                'Yes, but female told only during pregnancy'], n),
+        'Arthritis': rng.choice(['No', 'Yes'], n),
+        'Sex': rng.choice(['Female', 'Male'], n),
+        'Age_Category': age,
+        'Height_(cm)': height,
+        'Weight_(kg)': weight,
+        'BMI': (weight / (height / 100) ** 2).round(2),
+        'Smoking_History': smoking,
+        'Alcohol_Consumption': rng.integers(0, 30, n).astype(float),
+        'Fruit_Consumption': rng.integers(0, 120, n).astype(float),
+        'Green_Vegetables_Consumption': rng.integers(0, 120, n).astype(float),
+        'FriedPotato_Consumption': rng.integers(0, 120, n).astype(float),
+    })
+
+
+def label_encode(df):
+    """
+    Feature frame encoded like the original preprocessing: one LabelEncoder
+    per text column, fitted on the dataset.
+    """
+    from sklearn.preprocessing import LabelEncoder
+
+    X = df.drop(columns=['Heart_Disease'])
+    for col in [c for c in X.columns if not pd.api.types.is_numeric_dtype(X[c])]:
+        X[col] = LabelEncoder().fit(X[col].astype(str)).transform(X[col].astype(str))
+    return X
+
+
+@pytest.fixture(scope="session")
+def frame():
+    return make_frame()
+
+
+@pytest.fixture(scope="session")
+def classifier(frame):
+    import lightgbm as lgb
+
+    return lgb.LGBMClassifier(n_estimators=40, num_leaves=15, verbose=-1).fit(
+        label_encode(frame), (frame['Heart_Disease'] == 'Yes').astype(int))
+
+
+@pytest.fixture(scope="session")
+def sources(frame, classifier, tmp_path_factory):
+    directory = tmp_path_factory.mktemp("sources")
+    dataset_path = str(directory / "CVD_2021_BRFSS.csv")
+    model_path = str(directory / "best_lgb.pkl")
+    frame.to_csv(dataset_path, index=False)
+    with open(model_path, "wb") as f:
+        pickle.dump(classifier, f)
+    return model_path, dataset_path
+
+
+@pytest.fixture(scope="session")
+def host(sources, tmp_path_factory):
+    from model_host import attach_host
+
+    model_path, dataset_path = sources
+    return attach_host(str(tmp_path_factory.mktemp("hosts") / "host"), model_path, dataset_path)
+
+
+@pytest.fixture(scope="session")
+def schema(host):
+    return host.schema
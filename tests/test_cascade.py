@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from cascade import Cascade, decide
+from patient_record import records_from_frame
+
+
+class FixedModel:
+    """
+    Model double scoring every row the same, counting the rows it sees.
+    """
+
+    def __init__(self, score):
+        self.score = score
+        self.rows = 0
+
+    def predict_proba(self, X):
+        self.rows += len(X)
+        return np.column_stack([np.full(len(X), 1 - self.score), np.full(len(X), self.score)])
+
+
+def height_split(schema, low_leaf=0.01, high_leaf=0.5):
+    # Root split on height: short patients fall in a confident-low leaf, tall ones in the uncertain band
+    feature = schema.columns.index('Height_(cm)')
+    tree = {
+        'left': np.array([1, -1, -1]), 'right': np.array([2, -1, -1]),
+        'feature': np.array([feature, 0, 0]), 'threshold': np.array([170.0, 0.0, 0.0]),
+        'value': np.array([0.3, low_leaf, high_leaf]),
+    }
+    return Cascade(tree, low=0.05, high=0.95)
+
+
+@pytest.fixture
+def records(frame, schema):
+    return records_from_frame(frame.head(400), schema)
+
+
+def test_score_at_threshold_is_low_risk(schema, records):
+    scores, high_risk, prescreened = decide(FixedModel(0.5), schema, records, threshold=0.5)
+    assert (scores == 0.5).all()
+    assert not high_risk.any()
+    assert not prescreened.any()
+    _, high_risk, _ = decide(FixedModel(0.5000001), schema, records, threshold=0.5)
+    assert high_risk.all()
+
+
+def test_full_model_only_scores_the_band(schema, records):
+    model = FixedModel(0.8)
+    cascade = height_split(schema)
+    scores, high_risk, prescreened = decide(model, schema, records, threshold=0.5, cascade=cascade)
+
+    short = records['Height_(cm)'] <= 170
+    assert (prescreened == short).all()
+    assert model.rows == int((~short).sum())
+    # Pre-screened rows get the tier-1 decision and no full-model score
+    assert np.isnan(scores[short]).all() and not high_risk[short].any()
+    assert (scores[~short] == 0.8).all() and high_risk[~short].all()
+    assert cascade.stats() == {"total": len(records), "skipped": int(short.sum()),
+                               "skip_fraction": short.mean()}
+
+
+def test_band_decisions_use_the_full_model(schema, records):
+    # Tier 1 would call the band high risk; the full model's score decides
+    _, high_risk, prescreened = decide(FixedModel(0.2), schema, records, threshold=0.5,
+                                       cascade=height_split(schema, high_leaf=0.9))
+    assert not high_risk[~prescreened].any()
+
+
+def test_built_cascade_round_trip(host, records):
+    cascade = Cascade.load(host)
+    assert cascade is not None
+    scores, high_risk, prescreened = decide(host, host.schema, records, host.threshold, cascade)
+    assert np.isnan(scores[prescreened]).all()
+    reference, _, _ = decide(host, host.schema, records[~prescreened], host.threshold)
+    np.testing.assert_allclose(scores[~prescreened], reference)
+    assert (high_risk[~prescreened] == (reference > host.threshold)).all()
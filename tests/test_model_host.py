@@ -0,0 +1,57 @@
+import json
+import os
+
+import numpy as np
+
+from conftest import label_encode
+from model_host import MANIFEST_FILE, ModelHost, attach_host, build_host, save_operating_point
+from patient_record import records_from_frame, records_to_matrix
+
+
+def test_prediction_parity_with_baseline(frame, classifier, host):
+    # Baseline: the pickled classifier on the original LabelEncoder preprocessing
+    expected = classifier.predict_proba(label_encode(frame))[:, 1]
+    X = records_to_matrix(records_from_frame(frame, host.schema), host.schema)
+    np.testing.assert_allclose(host.predict_proba(X)[:, 1], expected, rtol=1e-6, atol=1e-9)
+    assert (host.predict(X) == (expected > host.threshold)).all()
+
+
+def test_reference_tables(frame, host):
+    assert host.reference_X.shape == (len(frame), host.schema.n_features)
+    assert int(np.asarray(host.reference_y).sum()) == int((frame['Heart_Disease'] == 'Yes').sum())
+    assert host.stats['total_records'] == len(frame)
+
+
+def test_rebuild_keeps_operating_point_and_swaps_atomically(sources, tmp_path):
+    model_path, dataset_path = sources
+    host_dir = str(tmp_path / "host")
+    first = attach_host(host_dir, model_path, dataset_path)
+    assert os.path.islink(host_dir)
+    save_operating_point(host_dir, {"threshold": 0.3})
+    with open(os.path.join(host_dir, "calibration.json"), "w") as f:
+        json.dump({"model_version": first.version}, f)
+
+    build_host(model_path, dataset_path, host_dir)
+    rebuilt = ModelHost(host_dir)
+    assert rebuilt.threshold == 0.3
+    assert os.path.exists(os.path.join(host_dir, "calibration.json"))
+    # Only the current build is left next to the link
+    assert sorted(os.listdir(tmp_path)) == ["host", os.readlink(host_dir)]
+
+
+def test_new_model_drops_operating_point(sources, tmp_path, caplog):
+    model_path, dataset_path = sources
+    host_dir = str(tmp_path / "host")
+    build_host(model_path, dataset_path, host_dir)
+    save_operating_point(host_dir, {"threshold": 0.3})
+    manifest_path = os.path.join(host_dir, MANIFEST_FILE)
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    manifest["model_version"] = "previous"
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f)
+
+    with caplog.at_level("WARNING", logger="model_host"):
+        build_host(model_path, dataset_path, host_dir)
+    assert ModelHost(host_dir).threshold == 0.5
+    assert "Model changed" in caplog.text
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from conftest import label_encode
+from patient_record import (MISSING_CODE, UNKNOWN_CODE, records_from_arrow, records_from_dicts, records_from_frame,
+                            records_to_arrow, records_to_dicts, records_to_matrix)
+
+
+def test_dicts_round_trip(frame, schema):
+    dicts = frame.drop(columns=['Heart_Disease']).head(50).to_dict("records")
+    back = records_to_dicts(records_from_dicts(dicts, schema), schema)
+    for original, restored in zip(dicts, back):
+        for col in schema.columns:
+            if col in schema.categories:
+                assert restored[col] == original[col]
+            else:
+                assert np.isclose(restored[col], original[col], rtol=1e-6)
+
+
+def test_frame_matches_dicts_and_label_encoding(frame, schema):
+    df = frame.head(200)
+    from_frame = records_from_frame(df, schema)
+    from_dicts = records_from_dicts(df.to_dict("records"), schema)
+    assert from_frame.tobytes() == from_dicts.tobytes()
+    matrix = records_to_matrix(from_frame, schema, dtype=np.float64)
+    expected = label_encode(frame)[schema.columns].head(200).to_numpy(dtype=np.float64)
+    np.testing.assert_allclose(matrix, expected, rtol=1e-6)
+
+
+def test_arrow_round_trip(frame, schema):
+    records = records_from_frame(frame.head(100), schema)
+    assert records_from_arrow(records_to_arrow(records, schema), schema).tobytes() == records.tobytes()
+
+
+def test_missing_and_unknown_values(schema):
+    records = records_from_dicts([{'Sex': 'Unknown', 'BMI': 'n/a'}], schema)
+    assert records['Sex'][0] == UNKNOWN_CODE
+    assert records['General_Health'][0] == MISSING_CODE
+    assert np.isnan(records['BMI'][0])
+    with pytest.raises(ValueError, match="Sex"):
+        records_to_matrix(records, schema)
+
+    # Missing values are imputed with the schema's fill values
+    records['Sex'] = MISSING_CODE
+    X = records_to_matrix(records, schema)
+    assert X[0, schema.columns.index('BMI')] == np.float32(schema.fill_values['BMI'])
+    assert X[0, schema.columns.index('General_Health')] == schema.fill_values['General_Health']
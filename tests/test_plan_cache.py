@@ -0,0 +1,61 @@
+import csv
+import gzip
+import io
+import os
+import tarfile
+import time
+
+from plan_cache import PlanCache, export_plans
+from treatment_rules import TreatmentRuleEngine
+
+PATIENT = {'General_Health': 'Fair', 'Age_Category': '60-64', 'Sex': 'Male', 'BMI': 31.2,
+           'Smoking_History': 'Yes', 'Diabetes': 'No', 'Exercise': 'No'}
+
+
+def plan(patient, risk=0.8):
+    return TreatmentRuleEngine().plan(patient, risk)
+
+
+def test_hit_after_miss(tmp_path):
+    cache = PlanCache(str(tmp_path))
+    first = cache.get(PATIENT, plan(PATIENT), "gzip")
+    second = cache.get(PATIENT, plan(PATIENT), "gzip")
+    assert first == second
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert gzip.decompress(first).decode("utf-8") == cache.get_text(PATIENT, plan(PATIENT))
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_lru_eviction(tmp_path):
+    cache = PlanCache(str(tmp_path))
+    patients = [dict(PATIENT, BMI=20.0 + i) for i in range(6)]
+    for patient in patients:
+        cache.get(patient, plan(patient))
+    entry_size = cache.stats()["bytes"] / len(patients)
+
+    # Age the entries in order, then hit the oldest so it becomes the most recently used
+    now = time.time()
+    for i, patient in enumerate(patients):
+        os.utime(cache.path(cache.key(patient, plan(patient))), (now - 100 + i, now - 100 + i))
+    cache.get(patients[0], plan(patients[0]))
+    cache.max_bytes = int(entry_size * 3.5)
+    cache.evict()
+
+    kept = [os.path.exists(cache.path(cache.key(p, plan(p)))) for p in patients]
+    assert kept == [True, False, False, False, True, True]
+    assert cache.stats()["bytes"] <= cache.max_bytes
+
+
+def test_export_names_and_index(tmp_path):
+    output = str(tmp_path / "plans.tar")
+    patients = [("A/1", PATIENT, 0.7), ("A_1", PATIENT, 0.2), ("A/1", PATIENT, 0.9), ("B", PATIENT, 0.4)]
+    assert export_plans(patients, output, PlanCache(str(tmp_path / "cache"))) == 4
+
+    with tarfile.open(output) as archive:
+        names = archive.getnames()
+        index = list(csv.reader(io.StringIO(archive.extractfile("index.csv").read().decode("utf-8"))))
+    assert names == ["plans/A_1.txt.gz", "plans/A_1-2.txt.gz", "plans/A_1-3.txt.gz", "plans/B.txt.gz", "index.csv"]
+    assert index[0] == ["patient_id", "risk", "file"]
+    assert [(row[0], row[2]) for row in index[1:]] == [
+        ("A/1", "plans/A_1.txt.gz"), ("A_1", "plans/A_1-2.txt.gz"), ("A/1", "plans/A_1-3.txt.gz"), ("B", "plans/B.txt.gz"),
+    ]
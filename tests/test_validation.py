@@ -0,0 +1,62 @@
+import numpy as np
+
+from patient_record import records_from_dicts
+from validation import CLINICAL_RANGES, RecordValidator
+
+
+def patient(**changes):
+    base = {
+        'General_Health': 'Good', 'Checkup': 'Within the past year', 'Exercise': 'Yes', 'Skin_Cancer': 'No',
+        'Other_Cancer': 'No', 'Depression': 'No', 'Diabetes': 'No', 'Arthritis': 'No', 'Sex': 'Female',
+        'Age_Category': '50-54', 'Height_(cm)': 165.0, 'Weight_(kg)': 70.0, 'BMI': 70.0 / 1.65 ** 2,
+        'Smoking_History': 'No', 'Alcohol_Consumption': 2.0, 'Fruit_Consumption': 30.0,
+        'Green_Vegetables_Consumption': 20.0, 'FriedPotato_Consumption': 4.0,
+    }
+    base.update(changes)
+    return base
+
+
+def test_per_row_masks(schema):
+    validator = RecordValidator(schema)
+    rows = [
+        patient(),
+        patient(Sex='Other'),
+        patient(**{'Height_(cm)': 90.0, 'BMI': 70.0 / 0.9 ** 2}),
+        patient(BMI=40.0),
+        {k: v for k, v in patient().items() if k != 'Exercise'},
+    ]
+    result = validator.validate(records_from_dicts(rows, schema))
+    assert result.valid.tolist() == [True, False, False, False, False]
+    assert result.row_errors(1) == ['Sex:unknown']
+    assert result.row_errors(2) == ['Height_(cm):range']
+    assert result.row_errors(3) == ['BMI:consistency']
+    assert result.row_errors(4) == ['Exercise:missing']
+    assert result.errors.shape == (5, len(result.rules))
+    assert result.summary() == {'Sex:unknown': 1, 'Height_(cm):range': 1, 'BMI:consistency': 1, 'Exercise:missing': 1}
+
+
+def test_allow_missing_keeps_partial_rows(schema):
+    records = records_from_dicts([{'Sex': 'Male', 'Age_Category': '80+'}, {'Sex': 'Other'}], schema)
+    result = RecordValidator(schema, allow_missing=True).validate(records)
+    assert result.valid.tolist() == [True, False]
+
+
+def test_widget_bounds_are_accepted(schema):
+    # Every value the sidebar allows must pass, whatever the training data covered
+    extremes = [
+        patient(**{'Height_(cm)': 100.0, 'Weight_(kg)': 300.0, 'BMI': 300.0}),
+        patient(**{'Height_(cm)': 250.0, 'Weight_(kg)': 30.0, 'BMI': 30.0 / 2.5 ** 2}),
+        patient(Alcohol_Consumption=100.0, Fruit_Consumption=120.0, Green_Vegetables_Consumption=120.0,
+                FriedPotato_Consumption=120.0),
+    ]
+    assert RecordValidator(schema).validate(records_from_dicts(extremes, schema)).valid.all()
+    beyond = patient(Alcohol_Consumption=CLINICAL_RANGES['Alcohol_Consumption'][1] + 1000)
+    assert not RecordValidator(schema).validate(records_from_dicts([beyond], schema)).valid[0]
+
+
+def test_preprocess_imputes_partial_input(schema):
+    from preprocess_scaler import preprocess_input_with_scaling
+
+    row = preprocess_input_with_scaling({'Sex': 'Male', 'Age_Category': '80+'}, schema)
+    assert list(row.columns) == schema.columns
+    assert not np.isnan(row.to_numpy()).any()